@@ -1,8 +1,25 @@
 """Tesserae API implementation"""
+import atexit
+import functools
+import os
+import threading
+
 import flask
 from flask_cors import CORS
 
-import tesserae.db
+from apitess.admission import AdmissionController
+from apitess.cache import register_cache
+from apitess.compression import register_compression
+from apitess.database import IndexBuilder, connect, reads_from_secondary
+from apitess.deletions import DeletionWorker
+from apitess.events import Watcher
+from apitess.ingestprogress import IngestTracker, fetch_ingest_statuses
+from apitess.jsonprovider import register_json_provider
+from apitess.lastqueried import LastQueriedFlusher
+from apitess.metrics import InstrumentedDB, register_metrics
+from apitess.profiling import register_profiling
+from apitess.textindex import register_text_index
+from apitess.utils import fetch_search_statuses
 
 
 def _load_config(app, test_config):
@@ -19,25 +36,101 @@ def _register_before_request(app, jobqueue, ingest_queue):
     """Make database and searcher available to app
 
     From this point forward, before_request exposes access to the database via
-    g.db and to the searcher via g.searcher.
+    g.db and to the searcher via g.searcher.  Bumps to the last_queried time of
+    searches are collected through g.last_queried and written to the database
+    every LAST_QUERIED_FLUSH_INTERVAL seconds.  g.admission decides whether new
+    searches are accepted (see AdmissionController.from_config for the
+    configuration options).  g.status_watcher polls the database every
+    STATUS_WATCH_INTERVAL seconds for the searches whose status is being
+    streamed, and g.ingest_watcher does the same for texts being ingested,
+    whose stages are recorded every INGEST_TRACK_INTERVAL seconds (see
+    apitess.ingestprogress).  On the administrative server, texts are
+    deleted in the background by a worker that checks for new deletions
+    every DELETION_POLL_INTERVAL seconds, and takes over those whose worker
+    has not renewed its claim for DELETION_CLAIM_TIMEOUT seconds (see
+    apitess.deletions).  When metrics are enabled, g.db times its
+    operations.  The indexes the queries rely on are created in the
+    background, and retried every INDEX_RETRY_INTERVAL seconds while the
+    database cannot be reached.
+
+    The database is opened as described in apitess.database.connect; for the
+    read-only requests listed there, g.db reads according to
+    MONGO_READ_PREFERENCE rather than from the primary.
+
+    The database connection, and the threads that use it, are opened by the
+    first request each process serves rather than here, so that an app
+    created before worker processes are forked (see apitess.launcher) does
+    not share a MongoClient or lose its threads across the fork.
     """
-    # http://librelist.com/browser/flask/2013/8/21/flask-pymongo-and-blueprint/#811dd1b119757bc09d28425a5bda86d9
-    db = tesserae.db.TessMongoConnection(app.config['MONGO_HOSTNAME'],
-                                         app.config['MONGO_PORT'],
-                                         app.config['MONGO_USER'],
-                                         app.config['MONGO_PASSWORD'],
-                                         db=app.config['DB_NAME'])
+    admission = AdmissionController.from_config(app.config)
+    app.extensions['admission'] = admission
+    opened = {}
+    open_lock = threading.Lock()
+
+    def open_database():
+        pid = os.getpid()
+        if opened.get('pid') == pid:
+            return opened
+        with open_lock:
+            if opened.get('pid') == pid:
+                return opened
+            # http://librelist.com/browser/flask/2013/8/21/flask-pymongo-and-blueprint/#811dd1b119757bc09d28425a5bda86d9
+            db, read_db = connect(app.config)
+            IndexBuilder(db, app.logger,
+                         app.config.get('INDEX_RETRY_INTERVAL', 60)).start()
+            if 'metrics' in app.extensions:
+                read_db = InstrumentedDB(read_db, app.extensions['metrics'])
+                db = InstrumentedDB(db, app.extensions['metrics'])
+            last_queried = LastQueriedFlusher(
+                db, app.config.get('LAST_QUERIED_FLUSH_INTERVAL', 10))
+            last_queried.start()
+            atexit.register(last_queried.stop)
+            app.extensions['last_queried'] = last_queried
+            status_watcher = Watcher(
+                functools.partial(fetch_search_statuses, db),
+                app.config.get('STATUS_WATCH_INTERVAL', 1))
+            ingest_tracker = IngestTracker(
+                db, app.config.get('INGEST_TRACK_INTERVAL', 2))
+            ingest_tracker.start()
+            atexit.register(ingest_tracker.stop)
+            ingest_watcher = Watcher(
+                functools.partial(fetch_ingest_statuses, db),
+                app.config.get('STATUS_WATCH_INTERVAL', 1))
+            if os.environ.get('ADMIN_INSTANCE') == 'true':
+                deletion_worker = DeletionWorker(
+                    app, db, app.config.get('DELETION_POLL_INTERVAL', 2),
+                    app.config.get('DELETION_CLAIM_TIMEOUT', 300))
+                deletion_worker.start()
+                atexit.register(deletion_worker.stop)
+            opened.update(db=db,
+                          read_db=read_db,
+                          last_queried=last_queried,
+                          status_watcher=status_watcher,
+                          ingest_watcher=ingest_watcher,
+                          pid=pid)
+        return opened
 
     @app.before_request
     def before_request():
-        flask.g.db = db
+        if flask.request.endpoint == 'health.live':
+            # liveness must not wait on the database
+            return
+        resources = open_database()
+        if reads_from_secondary():
+            flask.g.db = resources['read_db']
+        else:
+            flask.g.db = resources['db']
+        flask.g.last_queried = resources['last_queried']
+        flask.g.admission = admission
+        flask.g.status_watcher = resources['status_watcher']
+        flask.g.ingest_watcher = resources['ingest_watcher']
         flask.g.jobqueue = jobqueue
         flask.g.ingest_queue = ingest_queue
 
 
 def _register_blueprints(app):
     from . import parallels, stopwords, texts, units, features, \
-        multitexts, languages
+        multitexts, languages, health
     app.register_blueprint(parallels.bp)
     app.register_blueprint(stopwords.bp)
     app.register_blueprint(texts.bp)
@@ -45,6 +138,7 @@ def _register_blueprints(app):
     app.register_blueprint(features.bp)
     app.register_blueprint(multitexts.bp)
     app.register_blueprint(languages.bp)
+    app.register_blueprint(health.bp)
 
 
 def create_app(jobqueue, ingest_queue, test_config=None):
@@ -65,8 +159,14 @@ def create_app(jobqueue, ingest_queue, test_config=None):
     app = flask.Flask(__name__, instance_relative_config=True)
 
     _load_config(app, test_config)
+    register_json_provider(app)
+    register_metrics(app)
+    register_profiling(app)
     _register_before_request(app, jobqueue, ingest_queue)
+    register_cache(app)
+    register_text_index(app)
     _register_blueprints(app)
+    register_compression(app)
 
     CORS(app, expose_headers=['Content-Type', 'Location'])
 
@@ -0,0 +1,211 @@
+"""Admission control for work submitted to the job queue"""
+import datetime
+import math
+
+from bson.objectid import ObjectId
+import tesserae.db.entities
+
+# seconds after which a search still not finished is presumed stuck (e.g.,
+# because the worker running it died) and no longer counted as pending
+MAX_PENDING_AGE = 3600
+# maps the results_id of each search to the client that submitted it
+SUBMITTERS_COLLECTION = 'search_submitters'
+# seconds after which the database forgets who submitted a search; must be
+# longer than the max_pending_age used by the AdmissionController
+SUBMITTER_TTL = 24 * 60 * 60
+
+
+class Overloaded(Exception):
+    """Raised when a search should not be accepted right now
+
+    Attributes
+    ----------
+    status_code : int
+        503 when the server as a whole is overloaded; 429 when the client has
+        used up its share of the queue
+    retry_after : int
+        number of seconds after which the client may try again
+    message : str
+        explanation for the client
+    """
+
+    def __init__(self, status_code, retry_after, message):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.message = message
+
+
+def _cutoff(max_age):
+    return datetime.datetime.now(
+        datetime.timezone.utc) - datetime.timedelta(seconds=max_age)
+
+
+def pending_searches_filter(max_age=MAX_PENDING_AGE, results_ids=None):
+    """Build the query matching searches accepted but not yet finished
+
+    Parameters
+    ----------
+    max_age : float or None
+        searches submitted more than `max_age` seconds ago are not matched,
+        so that stuck searches cannot hold the backlog up forever; if None,
+        every unfinished search is matched
+    results_ids : list of str or None
+        if given, only the searches with these results_ids are matched
+    """
+    pending = {
+        'status': {
+            '$exists': True,
+            '$nin': [
+                tesserae.db.entities.Search.DONE,
+                tesserae.db.entities.Search.FAILED
+            ]
+        }
+    }
+    if max_age is not None:
+        # ObjectIds encode when the search was submitted
+        pending['_id'] = {'$gte': ObjectId.from_datetime(_cutoff(max_age))}
+    if results_ids is not None:
+        pending['results_id'] = {'$in': results_ids}
+    return pending
+
+
+def count_pending_searches(db, max_age=MAX_PENDING_AGE, results_ids=None):
+    """Count searches that have been accepted but have not yet finished
+
+    See `pending_searches_filter` for the parameters.
+    """
+    return db.connection[
+        tesserae.db.entities.Search.collection].count_documents(
+            pending_searches_filter(max_age, results_ids))
+
+
+class AdmissionController:
+    """Sheds new searches once the job queue backlog grows too long
+
+    The backlog is the number of searches in the database that have not yet
+    finished.  Its drain time is estimated from the expected duration of a
+    single search and the number of workers running searches.  Who submitted
+    each search is recorded in the database as well, so that the limits hold
+    across all the processes serving the API.
+
+    Parameters
+    ----------
+    max_backlog : int or None
+        number of unfinished searches at which new searches are refused; if
+        None, the backlog is not limited
+    seconds_per_search : float
+        expected number of seconds a worker needs to run one search
+    workers : int
+        number of workers running searches
+    max_per_client : int or None
+        number of unfinished searches a single client may have submitted; if
+        None, clients are not limited
+    max_pending_age : float or None
+        number of seconds after which an unfinished search no longer counts
+        toward the backlog (see `count_pending_searches`)
+    client_header : str or None
+        request header, set by a trusted reverse proxy, that holds the
+        client's address; if None, clients are told apart by the address
+        of the connection
+    """
+
+    def __init__(self,
+                 max_backlog=None,
+                 seconds_per_search=60,
+                 workers=1,
+                 max_per_client=None,
+                 max_pending_age=MAX_PENDING_AGE,
+                 client_header=None):
+        self.max_backlog = max_backlog
+        self.seconds_per_search = seconds_per_search
+        self.workers = max(workers, 1)
+        self.max_per_client = max_per_client
+        self.max_pending_age = max_pending_age
+        self.client_header = client_header
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(max_backlog=config.get('ADMISSION_MAX_BACKLOG'),
+                   seconds_per_search=config.get(
+                       'ADMISSION_SECONDS_PER_SEARCH', 60),
+                   workers=config.get('ADMISSION_WORKERS', 1),
+                   max_per_client=config.get('ADMISSION_MAX_PER_CLIENT'),
+                   max_pending_age=config.get('ADMISSION_MAX_PENDING_AGE',
+                                              MAX_PENDING_AGE),
+                   client_header=config.get('ADMISSION_CLIENT_HEADER'))
+
+    def identify(self, request):
+        """Name the client that sent `request`
+
+        When the header lists several addresses, as X-Forwarded-For does,
+        the last one, added by the proxy nearest to this server, is used;
+        those before it could have been sent by the client itself.
+        """
+        if self.client_header is not None:
+            forwarded = request.headers.get(self.client_header)
+            if forwarded:
+                return forwarded.split(',')[-1].strip()
+        return request.remote_addr
+
+    def drain_seconds(self, backlog):
+        """Estimate how long the workers need to run `backlog` searches"""
+        return backlog * self.seconds_per_search / self.workers
+
+    def admit(self, db, client):
+        """Check whether `client` may submit a new search
+
+        Parameters
+        ----------
+        db : tesserae.db.TessMongoConnection
+        client : str
+            identifier of the client submitting the search
+
+        Raises
+        ------
+        Overloaded
+            if the search should be refused
+        """
+        if self.max_per_client is not None:
+            outstanding = self._outstanding(db, client)
+            if outstanding >= self.max_per_client:
+                raise Overloaded(
+                    429,
+                    self._retry_after(outstanding - self.max_per_client + 1),
+                    (f'You already have {outstanding} searches waiting to '
+                     'run. Please wait for some of them to finish before '
+                     'submitting more.'))
+        if self.max_backlog is not None:
+            backlog = count_pending_searches(db, self.max_pending_age)
+            if backlog >= self.max_backlog:
+                raise Overloaded(
+                    503, self._retry_after(backlog - self.max_backlog + 1),
+                    ('The server is currently too busy to accept new '
+                     'searches. Please try again later.'))
+
+    def record(self, db, client, results_id):
+        """Note that `client` submitted the search `results_id`"""
+        if self.max_per_client is None:
+            return
+        db.connection[SUBMITTERS_COLLECTION].insert_one({
+            '_id': results_id,
+            'client': client,
+            'submitted': datetime.datetime.now(datetime.timezone.utc)
+        })
+
+    def _outstanding(self, db, client):
+        """Count the unfinished searches submitted by `client`"""
+        recent = {'client': client}
+        if self.max_pending_age is not None:
+            recent['submitted'] = {'$gte': _cutoff(self.max_pending_age)}
+        results_ids = [
+            submitter['_id']
+            for submitter in db.connection[SUBMITTERS_COLLECTION].find(
+                recent, projection={'_id': True})
+        ]
+        if not results_ids:
+            return 0
+        return count_pending_searches(db, self.max_pending_age, results_ids)
+
+    def _retry_after(self, excess):
+        return max(1, math.ceil(self.drain_seconds(excess)))
@@ -0,0 +1,277 @@
+"""Server-side caching of read endpoint responses"""
+import collections
+import functools
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import flask
+
+
+class MemoryBackend:
+    """Least-recently-used cache held in the memory of this process
+
+    Cached values are (body, mimetype, etag) tuples; the cache is bounded
+    both by the number of responses and by the total size of their bodies.
+
+    Parameters
+    ----------
+    max_entries : int
+        number of responses kept; the least recently used are evicted first
+    ttl : float
+        number of seconds a response is kept
+    max_bytes : int
+        total size of the bodies kept; the least recently used are evicted
+        first, and a body larger than this is not cached at all
+    """
+
+    def __init__(self, max_entries, ttl, max_bytes):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._entries = collections.OrderedDict()
+        self._keys_by_tag = collections.defaultdict(set)
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, tag, key):
+        with self._lock:
+            entry = self._entries.get((tag, key))
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                self._remove((tag, key))
+                return None
+            self._entries.move_to_end((tag, key))
+            return value
+
+    def set(self, tag, key, value):
+        size = len(value[0])
+        with self._lock:
+            self._remove((tag, key))
+            if size > self.max_bytes:
+                return
+            self._entries[(tag, key)] = (time.monotonic() + self.ttl, value)
+            self._keys_by_tag[tag].add(key)
+            self._size += size
+            while len(self._entries) > self.max_entries or \
+                    self._size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, tag):
+        with self._lock:
+            for key in list(self._keys_by_tag.get(tag, ())):
+                self._remove((tag, key))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_tag.clear()
+            self._size = 0
+
+    def _remove(self, entry_key):
+        tag, key = entry_key
+        entry = self._entries.pop(entry_key, None)
+        if entry is not None:
+            self._size -= len(entry[1][0])
+        keys = self._keys_by_tag.get(tag)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_tag[tag]
+
+
+class DiskBackend:
+    """Cache stored in a directory, so that it can be shared by processes
+
+    Every tag gets its own subdirectory, so that invalidating a tag removes a
+    single directory.  Each response is stored as a one-line JSON header,
+    holding its expiry, mimetype, and ETag, followed by its raw body; nothing
+    read back from the directory is ever executed.
+
+    Parameters
+    ----------
+    directory : str
+        where the responses are stored; created readable only by this user
+        if it does not exist
+    ttl : float
+        number of seconds a response is kept
+    """
+
+    def __init__(self, directory, ttl):
+        self.directory = directory
+        self.ttl = ttl
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+
+    def _tag_dir(self, tag):
+        return os.path.join(self.directory, _digest(tag))
+
+    def get(self, tag, key):
+        path = os.path.join(self._tag_dir(tag), _digest(key))
+        try:
+            with open(path, 'rb') as ifh:
+                header = json.loads(ifh.readline())
+                body = ifh.read()
+            expires = header['expires']
+            value = (body, header['mimetype'], header['etag'])
+        except (OSError, ValueError, TypeError, KeyError):
+            return None
+        if expires < time.time():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return value
+
+    def set(self, tag, key, value):
+        tag_dir = self._tag_dir(tag)
+        os.makedirs(tag_dir, mode=0o700, exist_ok=True)
+        body, mimetype, etag = value
+        header = {
+            'expires': time.time() + self.ttl,
+            'mimetype': mimetype,
+            'etag': etag,
+        }
+        # write to a temporary file first so readers never see partial data
+        fd, tmp_path = tempfile.mkstemp(dir=tag_dir)
+        with os.fdopen(fd, 'wb') as ofh:
+            ofh.write(json.dumps(header).encode('utf-8') + b'\n')
+            ofh.write(body)
+        os.replace(tmp_path, os.path.join(tag_dir, _digest(key)))
+
+    def invalidate(self, tag):
+        shutil.rmtree(self._tag_dir(tag), ignore_errors=True)
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            shutil.rmtree(os.path.join(self.directory, name),
+                          ignore_errors=True)
+
+
+def _digest(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def _default_cache_dir():
+    """A cache directory in the temporary directory private to this user
+
+    Raises
+    ------
+    RuntimeError
+        if the directory exists but is not owned by this user or can be
+        written by others
+    """
+    directory = os.path.join(tempfile.gettempdir(),
+                             f'apitess_cache-{os.getuid()}')
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    info = os.lstat(directory)
+    if info.st_uid != os.getuid() or info.st_mode & 0o077 or \
+            os.path.islink(directory):
+        raise RuntimeError(
+            f'{directory} is not private to this user; set RESPONSE_CACHE_DIR'
+            ' to a directory that is')
+    return directory
+
+
+def register_cache(app):
+    """Set up the response cache selected by the app's configuration
+
+    RESPONSE_CACHE chooses the backend: "memory" (the default), "disk", or
+    None to disable caching.  RESPONSE_CACHE_TTL sets how many seconds
+    responses are kept, RESPONSE_CACHE_MAX_ENTRIES and
+    RESPONSE_CACHE_MAX_BYTES bound the number and total body size of the
+    responses held by the memory backend, and RESPONSE_CACHE_DIR sets where
+    the disk backend stores responses.  Responses whose bodies are larger
+    than RESPONSE_CACHE_MAX_BODY_BYTES are never cached by either backend.
+
+    Note that the memory backend only sees invalidations made by its own
+    process; when read and write routes are served by different processes,
+    use the disk backend (apitess.launcher does so for several workers).
+    """
+    kind = app.config.get('RESPONSE_CACHE', 'memory')
+    ttl = app.config.get('RESPONSE_CACHE_TTL', 300)
+    if kind == 'memory':
+        backend = MemoryBackend(
+            app.config.get('RESPONSE_CACHE_MAX_ENTRIES', 1024), ttl,
+            app.config.get('RESPONSE_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+    elif kind == 'disk':
+        directory = app.config.get('RESPONSE_CACHE_DIR')
+        if directory is None:
+            directory = _default_cache_dir()
+        backend = DiskBackend(directory, ttl)
+    elif kind is None:
+        backend = None
+    else:
+        raise ValueError(f'Unknown RESPONSE_CACHE setting: {kind}')
+    app.extensions['response_cache'] = backend
+
+
+def cached(tag, should_cache=None):
+    """Serve successful responses of a view from the response cache
+
+    Entries are keyed on the endpoint, its arguments, and the normalized URL
+    query values, and grouped under `tag` so that write routes can
+    invalidate them (see invalidate).
+
+    Parameters
+    ----------
+    tag : str
+        group the entries belong to; may contain format fields naming the
+        view's arguments, e.g. "text:{object_id}"
+    should_cache : callable or None
+        given the JSON body of a successful response, returns whether it may
+        be cached; if None, all successful responses are cached
+    """
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            backend = flask.current_app.extensions.get('response_cache')
+            if backend is None:
+                return view(*args, **kwargs)
+            entry_tag = tag.format(**kwargs)
+            key = '&'.join([flask.request.endpoint] + [
+                f'{k}={v}' for k, v in sorted(kwargs.items())
+            ] + [
+                f'{k}={v}'
+                for k, v in sorted(flask.request.args.items(multi=True))
+            ])
+            hit = backend.get(entry_tag, key)
+            if hit is not None:
+                body, mimetype, etag = hit
+                response = flask.Response(body, mimetype=mimetype)
+                response.set_etag(etag)
+                return response
+            response = flask.make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            if should_cache is not None and \
+                    not should_cache(response.get_json()):
+                return response
+            body = response.get_data()
+            if len(body) > flask.current_app.config.get(
+                    'RESPONSE_CACHE_MAX_BODY_BYTES', 4 * 1024 * 1024):
+                return response
+            etag = response.get_etag()[0] or hashlib.sha1(body).hexdigest()
+            response.set_etag(etag)
+            backend.set(entry_tag, key, (body, response.mimetype, etag))
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def invalidate(*tags):
+    """Drop every cached response grouped under any of `tags`"""
+    backend = flask.current_app.extensions.get('response_cache')
+    if backend is None:
+        return
+    for tag in tags:
+        backend.invalidate(tag)
@@ -0,0 +1,120 @@
+"""Negotiated compression of response bodies"""
+import gzip
+
+import flask
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from apitess.metrics import timed
+
+# Content types whose bodies are worth compressing
+COMPRESSIBLE_MIMETYPES = {
+    'application/json',
+    'application/x-ndjson',
+    'text/html',
+    'text/plain',
+    'text/tab-separated-values',
+}
+
+
+def _gzip(data, level):
+    return gzip.compress(data, compresslevel=level)
+
+
+def _brotli(data, level):
+    return brotli.compress(data, quality=level)
+
+
+def _zstd(data, level):
+    return zstandard.ZstdCompressor(level=level).compress(data)
+
+
+def available_encodings():
+    """List the content codings this server can produce, most preferred first
+
+    Returns
+    -------
+    list of (str, callable, str)
+        name of the coding, function compressing bytes at a given level, and
+        the configuration key holding that level
+    """
+    encodings = []
+    if zstandard is not None:
+        encodings.append(('zstd', _zstd, 'COMPRESS_ZSTD_LEVEL'))
+    if brotli is not None:
+        encodings.append(('br', _brotli, 'COMPRESS_BR_LEVEL'))
+    encodings.append(('gzip', _gzip, 'COMPRESS_GZIP_LEVEL'))
+    return encodings
+
+
+def negotiate_encoding(accept_encodings):
+    """Choose a content coding acceptable to the client
+
+    Parameters
+    ----------
+    accept_encodings : werkzeug.datastructures.Accept
+        parsed Accept-Encoding header of the request
+
+    Returns
+    -------
+    (str, callable, str) or None
+        entry from available_encodings with the highest quality value for the
+        client (ties go to the server's preference); None if the client
+        accepts none of them
+    """
+    best = None
+    best_quality = 0
+    for encoding in available_encodings():
+        quality = accept_encodings[encoding[0]]
+        if quality > best_quality:
+            best = encoding
+            best_quality = quality
+    return best
+
+
+def register_compression(app):
+    """Compress response bodies according to the request's Accept-Encoding
+
+    Only responses with a compressible content type and a body of at least
+    COMPRESS_MIN_SIZE bytes are compressed.  Streamed responses and
+    responses that already declare a Content-Encoding are left alone.  The
+    compression level of each coding is set with COMPRESS_GZIP_LEVEL,
+    COMPRESS_BR_LEVEL, and COMPRESS_ZSTD_LEVEL.
+    """
+    app.config.setdefault('COMPRESS_MIN_SIZE', 500)
+    app.config.setdefault('COMPRESS_GZIP_LEVEL', 6)
+    app.config.setdefault('COMPRESS_BR_LEVEL', 4)
+    app.config.setdefault('COMPRESS_ZSTD_LEVEL', 3)
+
+    @app.after_request
+    def compress_response(response):
+        if response.mimetype not in COMPRESSIBLE_MIMETYPES:
+            return response
+        response.vary.add('Accept-Encoding')
+        if response.direct_passthrough or response.is_streamed or \
+                response.status_code < 200 or \
+                response.status_code in (204, 304) or \
+                'Content-Encoding' in response.headers:
+            return response
+        encoding = negotiate_encoding(flask.request.accept_encodings)
+        if encoding is None:
+            return response
+        data = response.get_data()
+        if len(data) < app.config['COMPRESS_MIN_SIZE']:
+            return response
+        name, compress, level_key = encoding
+        with timed('compress'):
+            response.set_data(compress(data, app.config[level_key]))
+        response.headers['Content-Encoding'] = name
+        # each coding is a distinct representation, so needs a distinct tag
+        etag, weak = response.get_etag()
+        if etag is not None:
+            response.set_etag(f'{etag}-{name}', weak)
+        return response
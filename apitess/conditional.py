@@ -0,0 +1,106 @@
+"""Conditional GET support through entity tags"""
+import functools
+import hashlib
+
+import flask
+
+from apitess.compression import available_encodings
+
+# Cache-Control for resources that never change once they exist
+IMMUTABLE = 'public, max-age=31536000, immutable'
+# Cache-Control for resources that may change, so must be revalidated
+REVALIDATE = 'no-cache'
+
+
+def make_etag(*parts):
+    """Build an entity tag that identifies a resource from its description
+
+    Parameters
+    ----------
+    *parts : str
+        values that together determine the content of the resource
+
+    Returns
+    -------
+    str
+        unquoted entity tag
+    """
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def query_etag(*parts):
+    """Build an entity tag from `parts` and the request's URL query values"""
+    args = sorted(flask.request.args.items(multi=True))
+    return make_etag(*parts, *(f'{k}={v}' for k, v in args))
+
+
+def fresh_etag(etag):
+    """Find the client's entity tag for its copy, if that copy is current
+
+    Compressed representations carry the name of their content coding as a
+    suffix on the entity tag (see apitess.compression), so the client's tags
+    are compared with that suffix removed.
+
+    Parameters
+    ----------
+    etag : str
+        entity tag of the uncompressed representation of the resource
+
+    Returns
+    -------
+    str or None
+        the matching tag from the request's If-None-Match header; None if the
+        client holds no current copy
+    """
+    if_none_match = flask.request.if_none_match
+    if not if_none_match:
+        return None
+    if if_none_match.star_tag:
+        return etag
+    suffixes = ['-' + name for name, _, _ in available_encodings()]
+    for tag in if_none_match.as_set():
+        bare = tag
+        for suffix in suffixes:
+            if bare.endswith(suffix):
+                bare = bare[:-len(suffix)]
+                break
+        if bare == etag:
+            return tag
+    return None
+
+
+def not_modified(etag, cache_control):
+    """Build a 304 response for a client whose copy is still current"""
+    response = flask.Response(status=304)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+
+def conditional(view):
+    """Tag successful responses of `view` and answer revalidations with 304
+
+    The entity tag is derived from the response body, so the body is still
+    built, but it is neither compressed nor sent when the client's copy is
+    current.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        response = flask.make_response(view(*args, **kwargs))
+        if response.status_code != 200:
+            return response
+        etag = response.get_etag()[0]
+        if etag is None:
+            etag = hashlib.sha1(response.get_data()).hexdigest()
+        current = fresh_etag(etag)
+        if current:
+            return not_modified(current, REVALIDATE)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = REVALIDATE
+        return response
+
+    return wrapper
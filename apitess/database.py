@@ -0,0 +1,230 @@
+"""Connecting to MongoDB and routing reads to replica set secondaries"""
+import copy
+import threading
+
+import flask
+import pymongo
+import pymongo.errors
+from pymongo.read_preferences import Nearest, Primary, PrimaryPreferred, \
+    Secondary, SecondaryPreferred
+import tesserae.db
+import tesserae.db.entities
+
+from apitess.admission import SUBMITTERS_COLLECTION, SUBMITTER_TTL
+from apitess.deletions import DELETIONS_COLLECTION
+from apitess.inflight import CLAIM_TTL, IN_FLIGHT_COLLECTION
+from apitess.ingestprogress import PROGRESS_COLLECTION
+from apitess.uploads import FILES_COLLECTION
+
+# configuration keys passed on to pymongo.MongoClient when they are set
+CLIENT_OPTIONS = {
+    'MONGO_MAX_POOL_SIZE': 'maxPoolSize',
+    'MONGO_MIN_POOL_SIZE': 'minPoolSize',
+    'MONGO_MAX_IDLE_TIME_MS': 'maxIdleTimeMS',
+    'MONGO_CONNECT_TIMEOUT_MS': 'connectTimeoutMS',
+    'MONGO_SOCKET_TIMEOUT_MS': 'socketTimeoutMS',
+    'MONGO_SERVER_SELECTION_TIMEOUT_MS': 'serverSelectionTimeoutMS',
+    'MONGO_WAIT_QUEUE_TIMEOUT_MS': 'waitQueueTimeoutMS',
+    'MONGO_REPLICA_SET': 'replicaSet',
+}
+
+READ_PREFERENCES = {
+    'primary': Primary,
+    'primaryPreferred': PrimaryPreferred,
+    'secondary': Secondary,
+    'secondaryPreferred': SecondaryPreferred,
+    'nearest': Nearest,
+}
+
+# Blueprints and endpoints that only read data that does not change while
+# clients poll it; their GET requests use MONGO_READ_PREFERENCE.  Everything
+# else, including search submissions, search statuses, and admin writes, goes
+# to the primary.
+SECONDARY_READ_BLUEPRINTS = {
+    'features',
+    'languages',
+    'stopwords',
+    'texts',
+    'units',
+}
+SECONDARY_READ_ENDPOINTS = {
+    'multitexts.retrieve_results',
+    'parallels.download',
+    'parallels.retrieve_results',
+    'parallels.stream_results',
+}
+# endpoints of those blueprints that report progress, which must not lag
+PRIMARY_READ_ENDPOINTS = {
+    'texts.deletion_status',
+    'texts.ingest_status',
+    'texts.stream_ingest_status',
+}
+
+
+def client_options(config):
+    """Collect the MongoClient options set in `config`"""
+    return {
+        option: config[key]
+        for key, option in CLIENT_OPTIONS.items()
+        if config.get(key) is not None
+    }
+
+
+def read_preference(config):
+    """Build the read preference for read-only requests from `config`
+
+    MONGO_READ_PREFERENCE names the mode (e.g., "secondaryPreferred"), and
+    MONGO_MAX_STALENESS_SECONDS optionally bounds how far behind the primary
+    a secondary may be to serve reads.
+
+    Returns
+    -------
+    pymongo.read_preferences.ServerMode or None
+        None if reads should go to the primary
+    """
+    mode = config.get('MONGO_READ_PREFERENCE', 'primary')
+    if mode not in READ_PREFERENCES:
+        raise ValueError(f'Unknown MONGO_READ_PREFERENCE setting: {mode}')
+    if mode == 'primary':
+        return None
+    max_staleness = config.get('MONGO_MAX_STALENESS_SECONDS')
+    if max_staleness is None:
+        return READ_PREFERENCES[mode]()
+    return READ_PREFERENCES[mode](max_staleness=max_staleness)
+
+
+def connect(config):
+    """Open the database as configured
+
+    Returns
+    -------
+    db : tesserae.db.TessMongoConnection
+        connection that reads from and writes to the primary
+    read_db : tesserae.db.TessMongoConnection
+        connection sharing the same client (and so the same connection pool)
+        whose reads follow MONGO_READ_PREFERENCE; this is `db` itself if reads
+        go to the primary
+    """
+    db = tesserae.db.TessMongoConnection(config['MONGO_HOSTNAME'],
+                                         config['MONGO_PORT'],
+                                         config['MONGO_USER'],
+                                         config['MONGO_PASSWORD'],
+                                         db=config['DB_NAME'],
+                                         **client_options(config))
+    preference = read_preference(config)
+    if preference is None:
+        return db, db
+    read_db = copy.copy(db)
+    read_db.connection = db.connection.with_options(
+        read_preference=preference)
+    return db, read_db
+
+
+# fields by which the /texts/ catalog can be sorted; ties are broken by _id
+TEXT_SORT_FIELDS = ('author', 'title', 'year')
+
+# fields by which a search's parallels can be paged through with a cursor
+# using an index; ties are broken by _id.  Paging by matched_features sorts
+# on a key computed from the whole array, which no index can serve.
+MATCH_SORT_FIELDS = ('score', 'source_tag', 'target_tag')
+
+
+# indexes the API's queries rely on, as (collection, keys, options) triples
+INDEXES = [(tesserae.db.entities.Text.collection, [(field, pymongo.ASCENDING),
+                                                   ('_id', pymongo.ASCENDING)],
+            {}) for field in TEXT_SORT_FIELDS]
+INDEXES.extend((tesserae.db.entities.Match.collection,
+                [('search_id', pymongo.ASCENDING),
+                 (field, pymongo.ASCENDING), ('_id', pymongo.ASCENDING)], {})
+               for field in MATCH_SORT_FIELDS)
+INDEXES.extend((collection, [(field, pymongo.ASCENDING)], {})
+               for collection, field in (
+                   # the pending searches are counted on every submission
+                   (tesserae.db.entities.Search.collection, 'status'),
+                   (FILES_COLLECTION, 'text_id'),
+                   (PROGRESS_COLLECTION, 'finished'),
+                   (DELETIONS_COLLECTION, 'status')))
+INDEXES.append((SUBMITTERS_COLLECTION, [('client', pymongo.ASCENDING),
+                                         ('submitted', pymongo.ASCENDING)],
+                {}))
+# records that are no longer needed are dropped by the database
+INDEXES.append((SUBMITTERS_COLLECTION, [('submitted', pymongo.ASCENDING)], {
+    'expireAfterSeconds': SUBMITTER_TTL
+}))
+INDEXES.append((IN_FLIGHT_COLLECTION, [('claimed', pymongo.ASCENDING)], {
+    'expireAfterSeconds': CLAIM_TTL
+}))
+
+
+def ensure_indexes(db, logger, indexes=INDEXES):
+    """Create the indexes the API's queries rely on, if they are missing
+
+    Failing to create an index for any other reason than the database being
+    unreachable (e.g., for lack of privileges) only slows the queries down,
+    so it is logged rather than raised.
+
+    Returns
+    -------
+    list of (str, list, dict)
+        the indexes left uncreated because the database could not be
+        reached, which should be tried again later
+    """
+    for i, (collection, keys, options) in enumerate(indexes):
+        try:
+            db.connection[collection].create_index(keys, **options)
+        except pymongo.errors.ConnectionFailure as e:
+            # every other index would wait out the same timeout
+            logger.warning('Could not reach the database to create indexes: '
+                           '%s', e)
+            return indexes[i:]
+        except pymongo.errors.PyMongoError as e:
+            logger.warning('Could not create index on %s %s: %s', collection,
+                           keys, e)
+    return []
+
+
+class IndexBuilder:
+    """Creates the API's indexes in the background
+
+    Index creation waits on the database, so it is kept off the request
+    path.  Indexes that could not be created because the database was
+    unreachable are tried again every `retry_interval` seconds.
+
+    Parameters
+    ----------
+    db : tesserae.db.TessMongoConnection
+    logger : logging.Logger
+    retry_interval : float
+        number of seconds between attempts
+    """
+
+    def __init__(self, db, logger, retry_interval):
+        self.db = db
+        self.logger = logger
+        self.retry_interval = retry_interval
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def _run(self):
+        pending = INDEXES
+        while pending and not self._stopped.is_set():
+            pending = ensure_indexes(self.db, self.logger, pending)
+            if pending:
+                self._stopped.wait(self.retry_interval)
+
+
+def reads_from_secondary():
+    """Whether the current request may have its reads served by secondaries"""
+    if flask.request.method not in ('GET', 'HEAD') or \
+            flask.request.endpoint in PRIMARY_READ_ENDPOINTS:
+        return False
+    return flask.request.blueprint in SECONDARY_READ_BLUEPRINTS or \
+        flask.request.endpoint in SECONDARY_READ_ENDPOINTS
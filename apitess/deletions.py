@@ -0,0 +1,240 @@
+"""Deleting texts in the background
+
+Removing a text cascades through its units, features, frequency counts, and
+cached searches, which takes too long for large works to finish within a
+request.  DELETE /texts/<object_id>/ therefore only records a deletion job,
+which hides the text from the read endpoints, and keeps searches from being
+submitted against it, at once; a DeletionWorker in an administrative server
+process then claims the job and removes the text.
+"""
+import datetime
+import threading
+
+import pymongo
+import pymongo.errors
+import tesserae.db.entities
+from tesserae.db.entities.text import TextStatus
+from tesserae.utils.delete import remove_text
+
+from apitess.cache import invalidate
+from apitess.ingestprogress import forget_progress
+from apitess.textindex import get_text_index
+
+DELETIONS_COLLECTION = 'text_deletions'
+# deletions in these states hide their texts
+PENDING = (TextStatus.INIT, TextStatus.RUN)
+
+
+def _now():
+    # pymongo reads datetimes back as naive UTC
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+def submit_deletion(db, text_id):
+    """Queue the deletion of a text, unless it is already queued
+
+    Parameters
+    ----------
+    db : tesserae.db.TessMongoConnection
+    text_id : bson.objectid.ObjectId
+
+    Returns
+    -------
+    dict
+        the deletion job
+    """
+    deletions = db.connection[DELETIONS_COLLECTION]
+    job = deletions.find_one({'text_id': text_id, 'status': {'$in': PENDING}})
+    if job is not None:
+        return job
+    job = {
+        'text_id': text_id,
+        'status': TextStatus.INIT,
+        'message': None,
+        'submitted': _now(),
+        'started': None,
+        'claimed': None,
+        'finished': None,
+    }
+    job['_id'] = deletions.insert_one(job).inserted_id
+    return job
+
+
+def find_deletion(db, deletion_id):
+    return db.connection[DELETIONS_COLLECTION].find_one({'_id': deletion_id})
+
+
+def hidden_text_ids(db):
+    """Find the texts waiting to be deleted, which must not be served"""
+    return {
+        job['text_id']
+        for job in db.connection[DELETIONS_COLLECTION].find(
+            {'status': {
+                '$in': PENDING
+            }}, projection={'text_id': True})
+    }
+
+
+def is_hidden(db, text_id):
+    """Whether a text is waiting to be deleted"""
+    return db.connection[DELETIONS_COLLECTION].find_one(
+        {
+            'text_id': text_id,
+            'status': {
+                '$in': PENDING
+            }
+        },
+        projection={'_id': True}) is not None
+
+
+def _isoformat(naive_utc):
+    if naive_utc is None:
+        return None
+    return naive_utc.replace(tzinfo=datetime.timezone.utc).isoformat()
+
+
+def deletion_json(job):
+    """Describe a deletion job as served by its status endpoint"""
+    elapsed = None
+    if job['started'] is not None and job['finished'] is not None:
+        elapsed = (job['finished'] - job['started']).total_seconds()
+    return {
+        'deletion_id': str(job['_id']),
+        'object_id': str(job['text_id']),
+        'status': job['status'],
+        'message': job['message'],
+        'submitted': _isoformat(job['submitted']),
+        'started': _isoformat(job['started']),
+        'finished': _isoformat(job['finished']),
+        'elapsed_seconds': elapsed,
+    }
+
+
+class DeletionWorker:
+    """Claims queued deletions and carries them out, one at a time
+
+    Workers in several processes share the queue; each job is claimed by
+    exactly one of them.  Running one deletion at a time per process keeps
+    a burst of DELETE requests from flooding the database with cascades.
+
+    While a job runs, its claim is renewed every third of `claim_timeout`.
+    A running job whose claim has not been renewed for `claim_timeout`
+    seconds was left by a process that died, and is claimed again.
+
+    Parameters
+    ----------
+    app : flask.Flask
+        the app whose cached responses and text index are updated once a
+        text is gone
+    db : tesserae.db.TessMongoConnection
+    interval : float
+        number of seconds to wait for new jobs once the queue is empty
+    claim_timeout : float
+        number of seconds after which an unrenewed claim is abandoned
+    """
+
+    def __init__(self, app, db, interval, claim_timeout):
+        self.app = app
+        self.db = db
+        self.interval = interval
+        self.claim_timeout = claim_timeout
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        """Stops taking new jobs, waiting for the current one to finish"""
+        self._stopped.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def claim(self):
+        """Take the oldest queued or abandoned job, or None if there is none"""
+        now = _now()
+        abandoned = now - datetime.timedelta(seconds=self.claim_timeout)
+        return self.db.connection[DELETIONS_COLLECTION].find_one_and_update(
+            {
+                '$or': [{
+                    'status': TextStatus.INIT
+                }, {
+                    'status': TextStatus.RUN,
+                    'claimed': {
+                        '$lt': abandoned
+                    }
+                }, {
+                    # claimed before claims were renewed
+                    'status': TextStatus.RUN,
+                    'claimed': None,
+                    'started': {
+                        '$lt': abandoned
+                    }
+                }]
+            }, {'$set': {
+                'status': TextStatus.RUN,
+                'started': now,
+                'claimed': now
+            }},
+            sort=[('_id', pymongo.ASCENDING)],
+            return_document=pymongo.ReturnDocument.AFTER)
+
+    def _renew_claim(self, job, done):
+        """Renew the claim on `job` until `done` is set"""
+        while not done.wait(self.claim_timeout / 3):
+            try:
+                self.db.connection[DELETIONS_COLLECTION].update_one(
+                    {
+                        '_id': job['_id'],
+                        'status': TextStatus.RUN
+                    }, {'$set': {
+                        'claimed': _now()
+                    }})
+            except pymongo.errors.PyMongoError:
+                # try again at the next renewal
+                pass
+
+    def run_job(self, job):
+        status = TextStatus.DONE
+        message = None
+        done = threading.Event()
+        renewer = threading.Thread(target=self._renew_claim,
+                                   args=(job, done),
+                                   daemon=True)
+        renewer.start()
+        try:
+            found = self.db.find(tesserae.db.entities.Text.collection,
+                                 _id=job['text_id'])
+            if found:
+                remove_text(self.db, found[0])
+            forget_progress(self.db, job['text_id'])
+        except Exception as e:
+            status = TextStatus.FAILED
+            message = 'Could not remove from database: {}'.format(e)
+        finally:
+            done.set()
+            renewer.join()
+        self.db.connection[DELETIONS_COLLECTION].update_one(
+            {'_id': job['_id']}, {
+                '$set': {
+                    'status': status,
+                    'message': message,
+                    'finished': _now()
+                }
+            })
+        with self.app.app_context():
+            invalidate('texts', f'text:{job["text_id"]}', 'languages',
+                       'features', 'units', 'stopwords')
+            if status == TextStatus.DONE:
+                get_text_index().remove(str(job['text_id']))
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                job = self.claim()
+            except pymongo.errors.PyMongoError:
+                job = None
+            if job is None:
+                self._stopped.wait(self.interval)
+                continue
+            self.run_job(job)
@@ -0,0 +1,128 @@
+"""Server-sent event streams backed by a shared database watcher"""
+import json
+import queue
+import threading
+import time
+
+
+class _Subscriber:
+    def __init__(self):
+        self.events = queue.Queue()
+        self.last = None
+
+
+class Watcher:
+    """Polls the database on behalf of every connected event stream
+
+    However many clients are subscribed, the watcher makes a single query per
+    poll for all of the keys being watched, and hands each subscriber the
+    snapshots that differ from the last one it received.  The polling thread
+    runs only while there are subscribers.
+
+    Parameters
+    ----------
+    fetch : callable
+        given a list of keys, returns a dict mapping each key that still
+        exists to a JSON-serializable snapshot of its state
+    interval : float
+        number of seconds between polls
+    """
+
+    def __init__(self, fetch, interval):
+        self.fetch = fetch
+        self.interval = interval
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def subscribe(self, key):
+        """Start receiving snapshots for `key`
+
+        Returns
+        -------
+        queue.Queue
+            snapshots will be put on this queue as they change; None is put
+            on the queue if `key` disappears from the database
+        """
+        subscriber = _Subscriber()
+        with self._lock:
+            self._subscribers.setdefault(key, []).append(subscriber)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        return subscriber.events
+
+    def unsubscribe(self, key, events):
+        """Stop delivering snapshots to the queue returned by subscribe"""
+        with self._lock:
+            subscribers = self._subscribers.get(key, [])
+            subscribers[:] = [s for s in subscribers if s.events is not events]
+            if not subscribers:
+                self._subscribers.pop(key, None)
+
+    def poll(self):
+        """Query for every watched key and notify subscribers of changes"""
+        with self._lock:
+            keys = list(self._subscribers)
+        if not keys:
+            return
+        snapshots = self.fetch(keys)
+        with self._lock:
+            for key in keys:
+                snapshot = snapshots.get(key)
+                for subscriber in self._subscribers.get(key, []):
+                    if snapshot != subscriber.last:
+                        subscriber.last = snapshot
+                        subscriber.events.put(snapshot)
+
+    def _run(self):
+        while True:
+            try:
+                self.poll()
+            except Exception:
+                # a failed query must not end every stream; subscribers
+                # keep their last snapshot and the next poll tries again
+                pass
+            with self._lock:
+                if not self._subscribers:
+                    self._thread = None
+                    return
+            time.sleep(self.interval)
+
+
+def event_stream(watcher, key, is_final, keep_alive=15):
+    """Generate server-sent events for the snapshots of `key`
+
+    Parameters
+    ----------
+    watcher : Watcher
+    key
+        the key to subscribe to
+    is_final : callable
+        given a snapshot, returns whether no more changes are expected, in
+        which case the stream ends after sending it
+    keep_alive : float
+        number of seconds of silence after which a comment is sent to keep
+        the connection open
+
+    Yields
+    ------
+    str
+        text of server-sent events
+    """
+    events = watcher.subscribe(key)
+    try:
+        while True:
+            try:
+                snapshot = events.get(timeout=keep_alive)
+            except queue.Empty:
+                yield ': keep-alive\n\n'
+                continue
+            if snapshot is None:
+                yield 'event: gone\ndata: {}\n\n'
+                return
+            yield f'event: status\ndata: {json.dumps(snapshot)}\n\n'
+            if is_final(snapshot):
+                return
+    finally:
+        watcher.unsubscribe(key, events)
@@ -5,6 +5,9 @@ from bson.objectid import ObjectId
 import flask
 from flask_cors import cross_origin
 
+from apitess.cache import cached
+from apitess.conditional import conditional
+from apitess.deletions import hidden_text_ids
 from apitess.utils import fix_id
 import tesserae
 
@@ -14,6 +17,8 @@ bp = flask.Blueprint('features', __name__, url_prefix='/features')
 
 @bp.route('/')
 @cross_origin()
+@conditional
+@cached('features')
 def query_features():
     """Consult database for feature information"""
     alloweds = {'language', 'feature', 'token'}
@@ -27,11 +32,14 @@ def query_features():
     results = [fix_id(r.json_encode()) for r in flask.g.db.find(
         tesserae.db.entities.Feature.collection,
         **filters)]
+    # texts being deleted no longer count
+    hidden = {str(text_id) for text_id in hidden_text_ids(flask.g.db)}
     for feature in results:
         feature_freqs = feature['frequencies']
         tmp = {}
         for k, v in feature_freqs.items():
-            tmp[str(k)] = v
+            if str(k) not in hidden:
+                tmp[str(k)] = v
         feature['frequencies'] = tmp
         del feature['object_id']
     return flask.jsonify(features=results)
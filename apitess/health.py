@@ -0,0 +1,122 @@
+"""Liveness and readiness probes for load balancers"""
+import datetime
+import time
+
+import flask
+import pymongo
+import pymongo.errors
+
+import tesserae.db.entities
+from tesserae.db.entities.text import TextStatus
+
+from apitess.admission import pending_searches_filter
+
+bp = flask.Blueprint('health', __name__, url_prefix='/health')
+
+
+def _backlog(db, collection, pending, running):
+    """Summarize the jobs recorded in `collection` that are not yet finished
+
+    Jobs are ordered by their ObjectIds, which encode when they were created.
+
+    Parameters
+    ----------
+    pending : dict
+        query matching the unfinished jobs
+    running : dict
+        query matching the jobs being worked on
+
+    Returns
+    -------
+    dict
+        "depth" is the number of unfinished jobs, "running" the number being
+        worked on, and "oldest_pending_seconds" the age of the oldest
+        unfinished job (or None if there are none)
+    """
+    coll = db.connection[collection]
+    oldest = coll.find_one(pending,
+                           projection={'_id': True},
+                           sort=[('_id', pymongo.ASCENDING)])
+    oldest_seconds = None
+    if oldest is not None:
+        oldest_seconds = (
+            datetime.datetime.now(datetime.timezone.utc) -
+            oldest['_id'].generation_time).total_seconds()
+    return {
+        'depth': coll.count_documents(pending),
+        'running': coll.count_documents(running),
+        'oldest_pending_seconds': oldest_seconds,
+    }
+
+
+def _over_limit(failures, config, key, value, description):
+    limit = config.get(key)
+    if limit is not None and value is not None and value > limit:
+        failures.append(f'{description} ({value}) exceeds {key} ({limit})')
+
+
+@bp.route('/live')
+def live():
+    """Report that the process is able to serve requests
+
+    The database is never touched, not even to open the connection that
+    other endpoints share.
+    """
+    response = flask.jsonify({'status': 'alive'})
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
+@bp.route('/ready')
+def ready():
+    """Report whether this node should be sent traffic
+
+    The node is not ready if the database cannot be reached, or if the
+    database round trip or the search and ingest backlogs exceed the limits
+    set by HEALTH_MAX_DB_LATENCY_MS, HEALTH_MAX_SEARCH_BACKLOG,
+    HEALTH_MAX_INGEST_BACKLOG, and HEALTH_MAX_PENDING_AGE_SECONDS.  Limits
+    that are not set are not checked.
+    """
+    config = flask.current_app.config
+    db = flask.g.db
+    failures = []
+    report = {}
+    try:
+        start = time.perf_counter()
+        db.connection.command('ping')
+        latency_ms = (time.perf_counter() - start) * 1000
+        report['database'] = {'latency_ms': latency_ms}
+        # searches stuck for longer than admission control tolerates are
+        # left out, as they are by admission control and the metrics
+        searches = pending_searches_filter(flask.g.admission.max_pending_age)
+        report['search_queue'] = _backlog(
+            db, tesserae.db.entities.Search.collection, searches,
+            dict(searches, status=tesserae.db.entities.Search.RUN))
+        # texts without a status (e.g., stored before ingestion statuses were
+        # recorded) are finished, not pending
+        report['ingest_queue'] = _backlog(
+            db, tesserae.db.entities.Text.collection, {
+                'ingestion_status.0': {
+                    '$exists': True,
+                    '$nin': [TextStatus.DONE, TextStatus.FAILED]
+                }
+            }, {'ingestion_status.0': TextStatus.RUN})
+    except pymongo.errors.PyMongoError as e:
+        failures.append(f'Database is unavailable: {e}')
+    else:
+        _over_limit(failures, config, 'HEALTH_MAX_DB_LATENCY_MS', latency_ms,
+                    'Database round trip in milliseconds')
+        for queue, limit_key in (('search_queue', 'HEALTH_MAX_SEARCH_BACKLOG'),
+                                 ('ingest_queue',
+                                  'HEALTH_MAX_INGEST_BACKLOG')):
+            _over_limit(failures, config, limit_key,
+                        report[queue]['depth'], f'Depth of {queue}')
+            _over_limit(failures, config, 'HEALTH_MAX_PENDING_AGE_SECONDS',
+                        report[queue]['oldest_pending_seconds'],
+                        f'Age in seconds of the oldest job in {queue}')
+    report['status'] = 'unavailable' if failures else 'ready'
+    report['failures'] = failures
+    response = flask.jsonify(report)
+    response.status_code = 503 if failures else 200
+    response.headers['Cache-Control'] = 'no-store'
+    return response
@@ -0,0 +1,100 @@
+"""Coalescing of identical searches that have not yet completed"""
+import datetime
+import hashlib
+import json
+
+import pymongo.errors
+
+# maps the fingerprint of a search to the results_id of a pending search
+IN_FLIGHT_COLLECTION = 'search_claims'
+# seconds a claim is trusted until its search is recorded in the database
+CLAIM_GRACE = 60
+# seconds after which the database drops a claim, whatever became of its
+# search; claims are otherwise released once their search is seen to end
+CLAIM_TTL = 24 * 60 * 60
+
+
+def fingerprint(spec):
+    """Builds a key shared by all requests for the same search
+
+    Parameters
+    ----------
+    spec : dict
+        JSON-serializable description of the search; lists of strings are
+        treated as unordered
+
+    Returns
+    -------
+    str
+        hex digest identifying the search
+    """
+    def normalize(value):
+        if isinstance(value, dict):
+            return {k: normalize(v) for k, v in value.items()}
+        if isinstance(value, list):
+            if all(isinstance(v, str) for v in value):
+                return sorted(value)
+            return [normalize(v) for v in value]
+        return value
+
+    encoded = json.dumps(normalize(spec), sort_keys=True,
+                         separators=(',', ':'))
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+def claim(db, key, results_id):
+    """Registers `results_id` as the search for `key`, unless one exists
+
+    Claims are kept in the database, so that identical searches submitted
+    to different worker processes are coalesced as well.
+
+    Returns
+    -------
+    str or None
+        the results_id already registered for `key`; None if `results_id`
+        was registered by this call
+    """
+    claims = db.connection[IN_FLIGHT_COLLECTION]
+    update = {
+        '$setOnInsert': {
+            'results_id': results_id,
+            'claimed': datetime.datetime.now(datetime.timezone.utc)
+        }
+    }
+    try:
+        # the document from before the update is returned, so None means
+        # that this call inserted the claim
+        existing = claims.find_one_and_update({'_id': key},
+                                              update,
+                                              projection={'results_id': True},
+                                              upsert=True)
+    except pymongo.errors.DuplicateKeyError:
+        # another process inserted the claim first
+        existing = claims.find_one({'_id': key},
+                                   projection={'results_id': True})
+        if existing is None:
+            return claim(db, key, results_id)
+    return None if existing is None else existing['results_id']
+
+
+def release(db, key, results_id):
+    """Forgets `key`, if it is still registered to `results_id`"""
+    db.connection[IN_FLIGHT_COLLECTION].delete_one({
+        '_id': key,
+        'results_id': results_id
+    })
+
+
+def is_recent(db, key, results_id, grace=CLAIM_GRACE):
+    """Whether `key` was claimed for `results_id` within `grace` s"""
+    cutoff = datetime.datetime.now(
+        datetime.timezone.utc) - datetime.timedelta(seconds=grace)
+    return db.connection[IN_FLIGHT_COLLECTION].find_one(
+        {
+            '_id': key,
+            'results_id': results_id,
+            'claimed': {
+                '$gt': cutoff
+            }
+        },
+        projection={'_id': True}) is not None
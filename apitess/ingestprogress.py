@@ -0,0 +1,231 @@
+"""Timelines of the stages texts pass through while being ingested
+
+Ingestion runs in tesserae's ingest workers, which report the stage a text
+is in (e.g., tokenizing, extracting features, building units, updating
+frequencies) through the text's ingestion status and message.  The tracker
+here polls the texts still being ingested and records, for each, when every
+stage was first seen, so that the time spent in each stage can be reported.
+"""
+import datetime
+import threading
+
+import pymongo.errors
+import tesserae.db.entities
+from tesserae.db.entities.text import TextStatus
+
+PROGRESS_COLLECTION = 'ingest_progress'
+FINISHED = (TextStatus.DONE, TextStatus.FAILED)
+
+
+def _now():
+    # pymongo reads datetimes back as naive UTC
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+def _status(text):
+    # texts stored before ingestion statuses were recorded are ingested
+    return (text.get('ingestion_status') or [TextStatus.DONE])[0]
+
+
+def stage_of(text):
+    """Name the stage a text is in, from its stored document"""
+    status = _status(text)
+    if status == TextStatus.RUN and text.get('ingestion_msg'):
+        return text['ingestion_msg']
+    return status
+
+
+class IngestTracker:
+    """Records the stage changes of texts being ingested
+
+    Every `interval` seconds, the texts not yet ingested, along with those
+    whose last recorded stage was not final, are fetched with one query, and
+    a stage is appended to the timeline of each text whose stage changed.
+    Timings are therefore accurate to within `interval` seconds.  Trackers in
+    several processes may watch the same texts; a stage is recorded only by
+    the first to see it.
+
+    Parameters
+    ----------
+    db : tesserae.db.TessMongoConnection
+    interval : float
+        number of seconds between polls
+    """
+
+    def __init__(self, db, interval):
+        self.db = db
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def poll(self):
+        """Record the stages that changed since the last poll"""
+        progress = self.db.connection[PROGRESS_COLLECTION]
+        current = {
+            doc['_id']: doc['current']
+            for doc in progress.find({'finished': False},
+                                     projection={'current': True})
+        }
+        texts = self.db.connection[tesserae.db.entities.Text.collection].find(
+            {
+                '$or': [{
+                    'ingestion_status.0': {
+                        '$exists': True,
+                        '$nin': list(FINISHED)
+                    }
+                }, {
+                    '_id': {
+                        '$in': list(current)
+                    }
+                }]
+            },
+            projection={
+                'ingestion_status': True,
+                'ingestion_msg': True
+            })
+        for text in texts:
+            stage = stage_of(text)
+            if current.get(text['_id']) == stage:
+                continue
+            submitted = text['_id'].generation_time.replace(tzinfo=None)
+            # a text first seen waiting to be ingested has waited since it
+            # was submitted
+            started = submitted if text['_id'] not in current and \
+                stage == TextStatus.INIT else _now()
+            try:
+                progress.update_one(
+                    {
+                        '_id': text['_id'],
+                        'current': {
+                            '$ne': stage
+                        }
+                    }, {
+                        '$set': {
+                            'current': stage,
+                            'finished': stage in FINISHED
+                        },
+                        '$push': {
+                            'stages': {
+                                'stage': stage,
+                                'started': started
+                            }
+                        },
+                        '$setOnInsert': {
+                            'submitted': submitted
+                        }
+                    },
+                    upsert=True)
+            except pymongo.errors.DuplicateKeyError:
+                # another process recorded this stage first
+                pass
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.poll()
+            except pymongo.errors.PyMongoError:
+                # try again at the next poll
+                pass
+
+
+def forget_progress(db, text_id):
+    db.connection[PROGRESS_COLLECTION].delete_one({'_id': text_id})
+
+
+def _seconds(start, end):
+    return (end - start).total_seconds()
+
+
+def _isoformat(naive_utc):
+    return naive_utc.replace(tzinfo=datetime.timezone.utc).isoformat()
+
+
+def progress_json(text, progress):
+    """Describe the ingestion of a text as served by the status endpoints
+
+    Parameters
+    ----------
+    text : dict
+        the text's document, with at least its ingestion status and message
+    progress : dict or None
+        the text's timeline, if one was recorded
+
+    Returns
+    -------
+    dict
+        the ingestion status and message, with the stages seen so far; every
+        stage but the current one has its "elapsed_seconds", as does the
+        whole ingestion once finished
+    """
+    status = _status(text)
+    stages = []
+    recorded = progress['stages'] if progress else []
+    for i, stage in enumerate(recorded):
+        if stage['stage'] in FINISHED:
+            break
+        ended = recorded[i + 1]['started'] if i + 1 < len(recorded) else None
+        stages.append({
+            'stage': stage['stage'],
+            'started': _isoformat(stage['started']),
+            'elapsed_seconds':
+            _seconds(stage['started'], ended) if ended else None,
+        })
+    elapsed = None
+    if progress and recorded and recorded[-1]['stage'] in FINISHED:
+        elapsed = _seconds(progress['submitted'], recorded[-1]['started'])
+    return {
+        'object_id': str(text['_id']),
+        'status': status,
+        'message': text.get('ingestion_msg'),
+        'submitted': text['_id'].generation_time.isoformat(),
+        'elapsed_seconds': elapsed,
+        'stages': stages,
+    }
+
+
+def fetch_ingest_statuses(db, keys):
+    """Retrieve the ingestion status of many texts with two queries
+
+    Parameters
+    ----------
+    db : tesserae.db.TessMongoConnection
+    keys : list of bson.objectid.ObjectId
+        object_ids of the texts
+
+    Returns
+    -------
+    dict
+        mapping from each text found in the database to the JSON object that
+        the status endpoints would serve for it
+    """
+    texts = db.connection[tesserae.db.entities.Text.collection].find(
+        {'_id': {
+            '$in': keys
+        }},
+        projection={
+            'ingestion_status': True,
+            'ingestion_msg': True
+        })
+    progress = {
+        doc['_id']: doc
+        for doc in db.connection[PROGRESS_COLLECTION].find(
+            {'_id': {
+                '$in': keys
+            }})
+    }
+    return {
+        text['_id']: progress_json(text, progress.get(text['_id']))
+        for text in texts
+    }
+
+
+def is_finished(status_json):
+    return status_json['status'] in FINISHED
@@ -0,0 +1,80 @@
+"""JSON serialization for API responses
+
+orjson is used when it is installed; otherwise serialization falls back to
+the standard library.  Either way, ObjectIds are written as their hex
+strings and every other type is serialized as Flask's own provider does it
+(e.g., datetimes as HTTP dates), so responses do not depend on which
+serializer produced them.
+"""
+from bson.objectid import ObjectId
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+def _default(o):
+    """Serialize types that JSON does not know about"""
+    if isinstance(o, ObjectId):
+        return str(o)
+    return DefaultJSONProvider.default(o)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """JSON provider backed by orjson, if available
+
+    Calls that ask for formatting orjson does not support (e.g., a custom
+    `separators` or `cls`) are handed to the standard library.
+    """
+
+    default = staticmethod(_default)
+
+    def _options(self, indent=None):
+        # datetimes and dataclasses go through _default, as they would
+        # with the standard library
+        option = (orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+                  | orjson.OPT_PASSTHROUGH_DATACLASS)
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return option
+
+    def _dumpb(self, obj, indent=None):
+        return orjson.dumps(obj, default=_default,
+                            option=self._options(indent))
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or set(kwargs) - {'indent'}:
+            return super().dumps(obj, **kwargs)
+        return self._dumpb(obj, kwargs.get('indent')).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        pretty = ((self.compact is None and self._app.debug)
+                  or self.compact is False)
+        body = self._dumpb(obj, indent=2 if pretty else None)
+        return self._app.response_class(body + b'\n',
+                                        mimetype=self.mimetype)
+
+
+def register_json_provider(app):
+    """Install the JSON provider selected by the app's configuration
+
+    JSON_PROVIDER chooses the provider: "fast" (the default) uses orjson
+    when it is installed, and "default" keeps Flask's own.
+    """
+    kind = app.config.get('JSON_PROVIDER', 'fast')
+    if kind == 'fast':
+        app.json = FastJSONProvider(app)
+    elif kind != 'default':
+        raise ValueError(f'Unknown JSON_PROVIDER setting: {kind}')
@@ -9,6 +9,9 @@ from bson.errors import InvalidId
 import flask
 from flask_cors import cross_origin
 
+from apitess.cache import cached
+from apitess.conditional import conditional
+from apitess.deletions import hidden_text_ids
 import apitess.errors
 from apitess.utils import fix_id
 import tesserae.db.entities
@@ -20,6 +23,8 @@ bp = flask.Blueprint('languages', __name__, url_prefix='/languages')
 
 @bp.route('/')
 @cross_origin()
+@conditional
+@cached('languages')
 def query_languages():
     """Consult database for available languages
 
@@ -29,6 +34,11 @@ def query_languages():
         The languages available to this database.
     """
     collection = tesserae.db.entities.Text.collection
-    results = flask.g.db.connection[collection].distinct('language')
+    # languages provided only by texts being deleted are not listed
+    hidden = list(hidden_text_ids(flask.g.db))
+    results = flask.g.db.connection[collection].distinct(
+        'language', {'_id': {
+            '$nin': hidden
+        }})
     return flask.jsonify(languages=list(results))
 
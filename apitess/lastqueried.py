@@ -0,0 +1,111 @@
+"""Batched recording of when search results were last requested"""
+import logging
+import threading
+
+import pymongo
+import pymongo.errors
+import tesserae.db.entities
+
+logger = logging.getLogger(__name__)
+
+
+class LastQueriedFlusher:
+    """Collects last_queried bumps in memory and writes them in bulk
+
+    Every request for a search's status or results marks the search as
+    recently used so that it is not purged from cache.  Rather than writing
+    to the database on every such request, the newest timestamp for each
+    search is kept in memory and written out with a single bulk update every
+    `interval` seconds.
+
+    Parameters
+    ----------
+    db : tesserae.db.TessMongoConnection
+        connection through which the timestamps are written
+    interval : float
+        number of seconds between writes
+    """
+
+    def __init__(self, db, interval):
+        self.db = db
+        self.interval = interval
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        """Stops the background writer, writing anything still pending
+
+        This runs as the process exits, so if the write fails, a warning is
+        logged and the timestamps are dropped.
+        """
+        self._stopped.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        try:
+            self.flush()
+        except pymongo.errors.PyMongoError as e:
+            with self._lock:
+                dropped = len(self._pending)
+                self._pending = {}
+            logger.warning('Dropped %d last_queried timestamps: %s', dropped,
+                           e)
+
+    def touch(self, search):
+        """Marks `search` as having been queried just now
+
+        Parameters
+        ----------
+        search : tesserae.db.entities.Search
+        """
+        search.update_last_queried()
+        with self._lock:
+            self._pending[search.id] = search.last_queried
+
+    def flush(self):
+        """Writes all pending timestamps to the database
+
+        If the write fails, the timestamps are kept pending, so that the
+        next flush writes them along with any newer ones.
+
+        Raises
+        ------
+        pymongo.errors.PyMongoError
+            if the write fails
+        """
+        with self._lock:
+            pending = self._pending
+            self._pending = {}
+        if not pending:
+            return
+        # $max keeps a stale write from another process from moving the
+        # timestamp backwards
+        updates = [
+            pymongo.UpdateOne({'_id': search_id},
+                              {'$max': {
+                                  'last_queried': last_queried
+                              }})
+            for search_id, last_queried in pending.items()
+        ]
+        searches = self.db.connection[tesserae.db.entities.Search.collection]
+        try:
+            searches.bulk_write(updates, ordered=False)
+        except pymongo.errors.PyMongoError:
+            with self._lock:
+                for search_id, last_queried in pending.items():
+                    newer = self._pending.get(search_id)
+                    if newer is None or newer < last_queried:
+                        self._pending[search_id] = last_queried
+            raise
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.flush()
+            except pymongo.errors.PyMongoError:
+                # the timestamps are retried at the next flush
+                pass
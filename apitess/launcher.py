@@ -0,0 +1,142 @@
+"""Serve the TIS API with several HTTP worker processes
+
+The app is loaded once in a master process, which also starts the pools of
+search and ingest workers; the HTTP worker processes are then forked from the
+master, so they all submit jobs into the same pools instead of each starting
+pools of their own.  Every HTTP worker opens its own database connection when
+it serves its first request.
+
+A response cache held in memory would only be invalidated in the worker that
+served the write, so with more than one HTTP worker the response cache is
+kept on disk, where all of them share it, unless RESPONSE_CACHE says
+otherwise; RESPONSE_CACHE = "memory" is refused.
+
+This needs gunicorn, which can be installed with `pip install .[server]`.
+
+Usage:
+    apitess-serve --config config.py --workers 4 --search-workers 5
+"""
+import argparse
+import multiprocessing
+import os
+
+import flask
+import gunicorn.app.base
+
+import apitess
+from tesserae.utils.coordinate import JobQueue
+from tesserae.utils.ingest import IngestQueue
+
+
+def load_config(path):
+    """Read a flask configuration file into a dict"""
+    config = flask.Config(os.getcwd())
+    config.from_pyfile(os.path.abspath(path))
+    return dict(config)
+
+
+def share_response_cache(config, workers):
+    """Make the response cache in `config` shared by all `workers`
+
+    Raises
+    ------
+    ValueError
+        if `config` asks for a per-process memory cache for several workers
+    """
+    if workers <= 1:
+        return
+    if config.setdefault('RESPONSE_CACHE', 'disk') == 'memory':
+        raise ValueError(
+            'RESPONSE_CACHE = "memory" cannot be used with more than one '
+            'worker, since writes would only invalidate the cache of the '
+            'worker serving them; use "disk" or None instead')
+
+
+class Launcher(gunicorn.app.base.BaseApplication):
+    """gunicorn application that preloads the TIS API
+
+    Parameters
+    ----------
+    config : dict
+        flask configuration of the app, including the database settings
+    search_workers : int
+        number of processes running searches for all HTTP workers
+    options : dict
+        gunicorn settings
+    """
+
+    def __init__(self, config, search_workers, options):
+        self.config = config
+        self.search_workers = search_workers
+        self.options = options
+        self.jobqueue = None
+        self.ingest_queue = None
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+        self.cfg.set('preload_app', True)
+        self.cfg.set('on_exit', self._cleanup)
+
+    def load(self):
+        # called once, in the master, before the HTTP workers are forked
+        db_cred = {
+            'host': self.config['MONGO_HOSTNAME'],
+            'port': self.config['MONGO_PORT'],
+            'user': self.config['MONGO_USER'],
+            'password': self.config['MONGO_PASSWORD'],
+            'db': self.config['DB_NAME']
+        }
+        self.jobqueue = JobQueue(self.search_workers, db_cred)
+        self.ingest_queue = IngestQueue(db_cred)
+        return apitess.create_app(self.jobqueue, self.ingest_queue,
+                                  self.config)
+
+    def _cleanup(self, server):
+        # only the master owns the pools; HTTP workers exit without this
+        if self.jobqueue is not None:
+            self.jobqueue.cleanup()
+        if self.ingest_queue is not None:
+            self.ingest_queue.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--config',
+                        default='config.py',
+                        help='flask configuration file with the database '
+                        'settings (MONGO_HOSTNAME, MONGO_PORT, MONGO_USER, '
+                        'MONGO_PASSWORD, DB_NAME)')
+    parser.add_argument('--bind', default='127.0.0.1:5000')
+    parser.add_argument('--workers',
+                        type=int,
+                        default=multiprocessing.cpu_count(),
+                        help='number of HTTP worker processes')
+    parser.add_argument('--threads',
+                        type=int,
+                        default=4,
+                        help='number of threads in each HTTP worker, which '
+                        'also bounds how many event streams it can hold open')
+    parser.add_argument('--search-workers',
+                        type=int,
+                        default=5,
+                        help='number of processes running searches')
+    parser.add_argument('--timeout', type=int, default=120)
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    try:
+        share_response_cache(config, args.workers)
+    except ValueError as e:
+        parser.error(str(e))
+    Launcher(config, args.search_workers, {
+        'bind': args.bind,
+        'workers': args.workers,
+        'threads': args.threads,
+        'timeout': args.timeout,
+    }).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,312 @@
+"""Request and database metrics in the Prometheus text exposition format
+
+Metrics are kept in the memory of each process, so when the application is
+served by several worker processes, each one reports its own.
+"""
+import bisect
+import collections
+import contextlib
+import functools
+import threading
+import time
+
+import flask
+import pymongo.monitoring
+
+from apitess.admission import MAX_PENDING_AGE, count_pending_searches
+import tesserae.db.entities
+from tesserae.db.entities.text import TextStatus
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5,
+                   10)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+EXPOSITION_MIMETYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DB_OPERATIONS = ('find', 'insert', 'update', 'delete')
+BACKGROUND = '(background)'
+
+
+class Histogram:
+    """Distribution of observed values over fixed buckets"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """Collection of the metrics of one application
+
+    Parameters
+    ----------
+    gauges : list of (str, str, callable)
+        name, help text, and function computing the current value of each
+        gauge; the functions are called at scrape time with the database
+    """
+
+    def __init__(self, gauges=()):
+        self.gauges = list(gauges)
+        self._lock = threading.Lock()
+        self._requests = collections.Counter()
+        self._histograms = collections.defaultdict(dict)
+
+    def _observe(self, family, labels, buckets, value):
+        with self._lock:
+            histogram = self._histograms[family].get(labels)
+            if histogram is None:
+                histogram = Histogram(buckets)
+                self._histograms[family][labels] = histogram
+            histogram.observe(value)
+
+    def observe_request(self, endpoint, method, status, seconds, size):
+        with self._lock:
+            self._requests[(endpoint, method, str(status))] += 1
+        self._observe('request_duration_seconds', (endpoint, method),
+                      LATENCY_BUCKETS, seconds)
+        if size is not None:
+            self._observe('response_size_bytes', (endpoint, method),
+                          SIZE_BUCKETS, size)
+
+    def observe_db_call(self, operation, seconds):
+        self._observe('db_call_duration_seconds',
+                      (_current_endpoint(), operation), LATENCY_BUCKETS,
+                      seconds)
+
+    def observe_mongo_command(self, command, seconds):
+        self._observe('mongo_command_duration_seconds',
+                      (_current_endpoint(), command), LATENCY_BUCKETS,
+                      seconds)
+
+    def observe_phase(self, phase, seconds):
+        self._observe('request_phase_duration_seconds',
+                      (_current_endpoint(), phase), LATENCY_BUCKETS, seconds)
+
+    def exposition(self, db):
+        """Render all metrics in the Prometheus text format"""
+        with self._lock:
+            requests = dict(self._requests)
+            histograms = {
+                family: {
+                    labels: (h.buckets, list(h.counts), h.sum, h.count)
+                    for labels, h in by_labels.items()
+                }
+                for family, by_labels in self._histograms.items()
+            }
+        lines = [
+            '# HELP apitess_requests_total Requests handled',
+            '# TYPE apitess_requests_total counter',
+        ]
+        for (endpoint, method, status), count in sorted(requests.items()):
+            labels = _labels(endpoint=endpoint, method=method, status=status)
+            lines.append(f'apitess_requests_total{{{labels}}} {count}')
+        for family, label_names, help_text in HISTOGRAM_FAMILIES:
+            name = f'apitess_{family}'
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} histogram')
+            for label_values, snapshot in sorted(
+                    histograms.get(family, {}).items()):
+                labels = _labels(**dict(zip(label_names, label_values)))
+                lines.extend(_histogram_lines(name, labels, *snapshot))
+        for name, help_text, compute in self.gauges:
+            lines.append(f'# HELP apitess_{name} {help_text}')
+            lines.append(f'# TYPE apitess_{name} gauge')
+            lines.append(f'apitess_{name} {compute(db)}')
+        return '\n'.join(lines) + '\n'
+
+
+HISTOGRAM_FAMILIES = (
+    ('request_duration_seconds', ('endpoint', 'method'),
+     'Time spent handling requests, up to the response headers'),
+    ('response_size_bytes', ('endpoint', 'method'),
+     'Size of response bodies as sent, for responses that are not streamed'),
+    ('db_call_duration_seconds', ('endpoint', 'operation'),
+     'Time spent in calls to the tesserae database connection'),
+    ('mongo_command_duration_seconds', ('endpoint', 'command'),
+     'Time spent in MongoDB commands, including those not made through the '
+     'tesserae database connection'),
+    ('request_phase_duration_seconds', ('endpoint', 'phase'),
+     'Time spent in individual phases of request handling'),
+)
+
+
+def _labels(**labels):
+    return ','.join(
+        '{}="{}"'.format(
+            k,
+            str(v).replace('\\', '\\\\').replace('"', '\\"').replace(
+                '\n', '\\n')) for k, v in labels.items())
+
+
+def _histogram_lines(name, labels, buckets, counts, total, count):
+    lines = []
+    cumulative = 0
+    for bound, bucket_count in zip(buckets, counts):
+        cumulative += bucket_count
+        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+    lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {count}')
+    lines.append(f'{name}_sum{{{labels}}} {total}')
+    lines.append(f'{name}_count{{{labels}}} {count}')
+    return lines
+
+
+def _current_endpoint():
+    if flask.has_request_context():
+        return flask.request.endpoint or 'unmatched'
+    return BACKGROUND
+
+
+def _current_metrics():
+    if flask.has_app_context():
+        return flask.current_app.extensions.get('metrics')
+    return None
+
+
+@contextlib.contextmanager
+def timed(phase):
+    """Record the time spent in the enclosed block as a phase of the request
+
+    Nothing is recorded when metrics are disabled.
+    """
+    metrics = _current_metrics()
+    if metrics is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.observe_phase(phase, time.perf_counter() - start)
+
+
+class InstrumentedDB:
+    """Wrapper around a database connection that times its operations
+
+    Parameters
+    ----------
+    db : tesserae.db.TessMongoConnection
+        connection whose find, insert, update, and delete calls are timed
+    metrics : Metrics
+        where the timings are recorded
+    """
+
+    def __init__(self, db, metrics):
+        self._db = db
+        self._metrics = metrics
+
+    def __getattr__(self, name):
+        attr = getattr(self._db, name)
+        if name not in DB_OPERATIONS:
+            return attr
+
+        def timed_operation(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                self._metrics.observe_db_call(name,
+                                              time.perf_counter() - start)
+
+        return timed_operation
+
+
+class _CommandListener(pymongo.monitoring.CommandListener):
+    """Attribute MongoDB commands to the request that issued them"""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._record(event)
+
+    def failed(self, event):
+        self._record(event)
+
+    def _record(self, event):
+        metrics = _current_metrics()
+        if metrics is not None:
+            metrics.observe_mongo_command(event.command_name,
+                                          event.duration_micros / 1e6)
+
+
+_listener_registered = False
+_listener_lock = threading.Lock()
+
+
+def _register_command_listener():
+    """Listen to MongoDB commands of clients created from now on"""
+    global _listener_registered
+    with _listener_lock:
+        if not _listener_registered:
+            pymongo.monitoring.register(_CommandListener())
+            _listener_registered = True
+
+
+def count_pending_ingests(db):
+    """Count texts that have been accepted but have not yet been ingested
+
+    Texts stored before ingestion statuses were recorded have none, and are
+    ingested.
+    """
+    return db.connection[tesserae.db.entities.Text.collection].count_documents(
+        {
+            'ingestion_status.0': {
+                '$exists': True,
+                '$nin': [TextStatus.DONE, TextStatus.FAILED]
+            }
+        })
+
+
+def register_metrics(app):
+    """Record metrics for every request and serve them at /metrics
+
+    Must be called before the database connection is created, so that its
+    MongoDB commands are seen, and before other after_request hooks are
+    registered, so that the timings and sizes include their work.  Setting
+    METRICS_ENABLED to False turns metrics off.
+    """
+    if not app.config.get('METRICS_ENABLED', True):
+        return
+    # counts what admission control counts, stuck searches excluded
+    count_searches = functools.partial(
+        count_pending_searches,
+        max_age=app.config.get('ADMISSION_MAX_PENDING_AGE', MAX_PENDING_AGE))
+    metrics = Metrics(gauges=[
+        ('search_queue_depth', 'Searches submitted but not yet finished',
+         count_searches),
+        ('ingest_queue_depth', 'Texts submitted but not yet ingested',
+         count_pending_ingests),
+    ])
+    app.extensions['metrics'] = metrics
+    _register_command_listener()
+
+    @app.before_request
+    def start_timer():
+        flask.g.request_start = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        start = flask.g.get('request_start')
+        if start is not None:
+            size = None
+            if not response.is_streamed:
+                size = response.calculate_content_length()
+            metrics.observe_request(flask.request.endpoint or 'unmatched',
+                                    flask.request.method,
+                                    response.status_code,
+                                    time.perf_counter() - start, size)
+        return response
+
+    def serve_metrics():
+        response = flask.Response(metrics.exposition(flask.g.db),
+                                  mimetype='text/plain')
+        response.headers['Content-Type'] = EXPOSITION_MIMETYPE
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+
+    app.add_url_rule('/metrics', 'metrics', serve_metrics)
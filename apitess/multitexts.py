@@ -1,5 +1,4 @@
 """The family of /multitexts/ endpoints"""
-import gzip
 import os
 import queue
 import uuid
@@ -7,8 +6,11 @@ import uuid
 import flask
 from flask_cors import cross_origin
 
+import apitess.conditional
 import apitess.errors
 import apitess.utils
+from apitess.admission import Overloaded
+from apitess.deletions import hidden_text_ids
 import tesserae.utils.multitext
 
 bp = flask.Blueprint('multitexts', __name__, url_prefix='/multitexts')
@@ -18,7 +20,7 @@ bp = flask.Blueprint('multitexts', __name__, url_prefix='/multitexts')
     'POST',
     'OPTIONS',
 ))
-@cross_origin(expose_headers='Location')
+@cross_origin(expose_headers=['Location', 'Retry-After'])
 def submit_multitext():
     """Run multitext search"""
     error_response, received = apitess.errors.check_body(flask.request)
@@ -44,13 +46,21 @@ def submit_multitext():
             400,
             data=received,
             message='Cannot run multitext search on empty selection of texts')
-    _, failures = apitess.utils.make_object_ids(received['text_ids'])
+    text_ids, failures = apitess.utils.make_object_ids(received['text_ids'])
     if failures:
         return apitess.errors.error(
             400,
             data=received,
             message='Malformed object_ids specified in "texts": {}'.format(
                 failures))
+    hidden = hidden_text_ids(flask.g.db)
+    being_deleted = [str(oid) for oid in text_ids if oid in hidden]
+    if being_deleted:
+        return apitess.errors.error(
+            400,
+            data=received,
+            message='The following texts are being deleted: {}'.format(
+                being_deleted))
 
     accepted_unit_types = ['line', 'phrase']
     if received['unit_type'] not in accepted_unit_types:
@@ -86,18 +96,27 @@ def submit_multitext():
     response.headers['Location'] = os.path.join(flask.request.base_url,
                                                 results_id, '')
 
+    client = flask.g.admission.identify(flask.request)
     try:
+        flask.g.admission.admit(flask.g.db, client)
         tesserae.utils.multitext.submit_multitext(flask.g.jobqueue, flask.g.db,
                                                   results_id,
                                                   received['parallels_uuid'],
                                                   received['text_ids'],
                                                   received['unit_type'])
+    except Overloaded as e:
+        response = apitess.errors.error(e.status_code,
+                                        data=received,
+                                        message=e.message)
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response
     except queue.Full:
-        return apitess.error.error(
+        return apitess.errors.error(
             500,
             data=received,
             message=('The search request could not be added to the queue. '
                      'Please try again in a few minutes'))
+    flask.g.admission.record(flask.g.db, client, results_id)
     return response
 
 
@@ -108,6 +127,13 @@ def retrieve_status(results_id):
         flask.g.db.find, results_id, tesserae.utils.multitext.MULTITEXT_SEARCH)
 
 
+@bp.route('/<results_id>/status/stream/')
+@cross_origin()
+def stream_status(results_id):
+    return apitess.utils.common_stream_status(
+        results_id, tesserae.utils.multitext.MULTITEXT_SEARCH)
+
+
 @bp.route('/<results_id>/')
 @cross_origin()
 def retrieve_results(results_id):
@@ -130,37 +156,46 @@ def retrieve_results(results_id):
         return response
 
     url_query_params = flask.request.args
-    page_options, err = apitess.utils.get_page_options_or_error(
-        url_query_params)
+    if 'cursor' in url_query_params:
+        cursor_options, err = apitess.utils.get_cursor_options_or_error(
+            url_query_params)
+    else:
+        cursor_options = None
+        page_options, err = apitess.utils.get_page_options_or_error(
+            url_query_params)
     if err:
         return err
 
-    params = results_status_found[0].parameters
+    # results of a completed search never change
+    etag = apitess.conditional.query_etag(str(results_status_found[0].id))
+    flask.g.last_queried.touch(results_status_found[0])
+    current = apitess.conditional.fresh_etag(etag)
+    if current:
+        return apitess.conditional.not_modified(
+            current, apitess.conditional.IMMUTABLE)
 
-    multiresults = [
-        mr for mr in tesserae.utils.multitext.get_results(
-            flask.g.db, results_status_found[0].id, page_options)
-    ]
+    params = results_status_found[0].parameters
     search_id = tesserae.utils.search.get_id_by_uuid(flask.g.db,
                                                      params['parallels_uuid'])
-    response = flask.Response(
-        response=gzip.compress(
-            flask.json.dumps({
-                'data':
-                params,
-                'max_score':
-                tesserae.utils.search.get_max_score(flask.g.db, search_id),
-                'total_count':
-                tesserae.utils.search.get_results_count(flask.g.db, search_id),
-                'multiresults':
-                multiresults
-            }).encode()),
-        mimetype='application/json',
-    )
-    response.status_code = 200
-    response.status = '200 OK'
-    response.headers['Content-Encoding'] = 'gzip'
-
-    results_status_found[0].update_last_queried()
-    flask.g.db.update(results_status_found[0])
+    max_score, total_count = apitess.utils.get_search_summary(
+        flask.g.db, search_id)
+    page = {
+        'data': params,
+        'max_score': max_score,
+        'total_count': total_count,
+    }
+    if cursor_options:
+        page['multiresults'], page['cursor'] = \
+            apitess.utils.get_keyset_multiresults(
+                flask.g.db, results_status_found[0].id, search_id,
+                cursor_options)
+    else:
+        page['multiresults'] = [
+            mr for mr in tesserae.utils.multitext.get_results(
+                flask.g.db, results_status_found[0].id, page_options)
+        ]
+
+    response = flask.jsonify(page)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = apitess.conditional.IMMUTABLE
     return response
@@ -1,23 +1,33 @@
 """The family of /parallels/ endpoints"""
-import gzip
 import os
 import queue
 import uuid
+import zlib
 
 import flask
 import tesserae.db.entities
 import tesserae.utils.exports
 import tesserae.utils.search
-from bson.objectid import ObjectId
 from flask_cors import cross_origin
 from tesserae.matchers.text_options import TextOptions
 from tesserae.utils.downloads import ResultsWriter
 
 import apitess.errors
-from apitess.utils import common_retrieve_status, get_page_options_or_error
+from apitess.admission import Overloaded
+from apitess.conditional import fresh_etag, IMMUTABLE, not_modified, \
+    query_etag
+from apitess.deletions import hidden_text_ids
+import apitess.inflight
+from apitess.metrics import timed
+from apitess.utils import common_retrieve_status, common_stream_status, \
+    get_cursor_options_or_error, get_keyset_results, get_search_summary, \
+    get_page_options_or_error, make_object_ids, match_json, MATCH_PROJECTION
 
 bp = flask.Blueprint('parallels', __name__, url_prefix='/parallels')
 
+# Number of parallels serialized together before handing a chunk to gzip
+STREAM_CHUNK_SIZE = 500
+
 
 def _validate_units(specs, name):
     """Provide error messages if units are not specified correctly
@@ -46,55 +56,74 @@ def _validate_units(specs, name):
     return result
 
 
-@bp.route('/', methods=(
-    'POST',
-    'OPTIONS',
-))
-@cross_origin(expose_headers='Location')
-def submit_search():
-    """Run a Tesserae search"""
-    error_response, received = apitess.errors.check_body(flask.request)
-    if error_response:
-        return error_response
-    requireds = {'source', 'target', 'method'}
-    miss_error = apitess.errors.check_requireds(received, requireds)
-    if miss_error:
-        return miss_error
+def _check_units(received):
+    """Provide an error message if source or target units are malformed
 
-    source = received['source']
-    target = received['target']
-
-    errors = _validate_units(source, 'source')
-    errors.extend(_validate_units(target, 'target'))
+    Returns
+    -------
+    str or None
+        error message, if any errors were found; otherwise None
+    """
+    errors = _validate_units(received['source'], 'source')
+    errors.extend(_validate_units(received['target'], 'target'))
     if errors:
-        return apitess.errors.error(
-            400,
-            data=received,
-            message=('The following errors were found in source and target '
-                     'unit specifications:\n{}'.format('\n\t'.join(errors))))
-
-    source_object_id = source['object_id']
-    target_object_id = target['object_id']
-    results = flask.g.db.find(
-        tesserae.db.entities.Text.collection,
-        _id=[ObjectId(source_object_id),
-             ObjectId(target_object_id)])
-    results = {str(t.id): t for t in results}
+        return ('The following errors were found in source and target '
+                'unit specifications:\n{}'.format('\n\t'.join(errors)))
+    return None
+
+
+def _find_texts(object_ids):
+    """Retrieve the texts with the specified object_ids in a single query
+
+    Parameters
+    ----------
+    object_ids : iterable of str
+        identifiers of texts to retrieve
+
+    Returns
+    -------
+    dict[str, tesserae.db.entities.Text]
+        mapping from object_id to text, for the texts that were found and are
+        not being deleted
+    """
+    oids, _ = make_object_ids(set(object_ids))
+    if not oids:
+        return {}
+    found = flask.g.db.find(tesserae.db.entities.Text.collection, _id=oids)
+    hidden = hidden_text_ids(flask.g.db)
+    return {str(t.id): t for t in found if t.id not in hidden}
+
+
+def _check_texts_found(received, texts):
+    """Provide an error message if source or target texts are missing
+
+    Returns
+    -------
+    str or None
+        error message, if any texts were not found; otherwise None
+    """
     errors = []
-    if source_object_id not in results:
-        errors.append(source_object_id)
-    if target_object_id not in results:
-        errors.append(target_object_id)
+    for name in ('source', 'target'):
+        object_id = received[name]['object_id']
+        if object_id not in texts:
+            errors.append(object_id)
     if errors:
-        return apitess.errors.error(
-            400,
-            data=received,
-            message=('Unable to find the following object_id(s) among the '
-                     'texts in the database:\n\t{}'.format(
-                         '\n\t'.join(errors))))
-    source_text = results[source_object_id]
-    target_text = results[target_object_id]
+        return ('Unable to find the following object_id(s) among the '
+                'texts in the database:\n\t{}'.format('\n\t'.join(errors)))
+    return None
+
+
+def _check_method(received):
+    """Provide an error message if the method specification is malformed
 
+    Note that a valid "min_score" is converted to a number in place, and a
+    missing one is set to 0.
+
+    Returns
+    -------
+    str or None
+        error message, if any errors were found; otherwise None
+    """
     method_requireds = {
         'original': {
             'name', 'feature', 'stopwords', 'score_basis', 'freq_basis',
@@ -107,61 +136,110 @@ def submit_search():
     }
     method = received['method']
     if 'name' not in method:
-        return apitess.errors.error(400,
-                                    data=received,
-                                    message='No specified method name.')
+        return 'No specified method name.'
+    if method['name'] not in method_requireds:
+        return (f'Specified method name ({method["name"]}) is not supported. '
+                f'(Supported values are {list(method_requireds)})')
     missing = []
     for req in method_requireds[method['name']]:
         if req not in method:
             missing.append(req)
     if missing:
-        return apitess.errors.error(
-            400,
-            data=received,
-            message=('The specified method is missing the following required '
-                     'key(s): {}'.format(', '.join(missing))))
+        return ('The specified method is missing the following required '
+                'key(s): {}'.format(', '.join(missing)))
 
     if 'min_score' in method:
         try:
             method['min_score'] = float(method['min_score'])
         except ValueError:
-            return apitess.error.error(
-                400,
-                data=received,
-                message=(f'Specified minimum score ({method["min_score"]}) '
-                         'could not be converted into a number'))
+            return (f'Specified minimum score ({method["min_score"]}) '
+                    'could not be converted into a number')
     else:
         method['min_score'] = 0
+    return None
+
+
+def _results_location(results_id, paginated=False):
+    """Build the URL at which results for `results_id` will be found"""
+    # we want the final '/' on the URL
+    location = os.path.join(
+        flask.url_for('parallels.submit_search', _external=True), results_id,
+        '')
+    if paginated:
+        location += '?' + '&'.join(
+            f'{a}={b}' for a, b in {
+                'sort_by': 'score',
+                'sort_order': 'descending',
+                'per_page': '100',
+                'page_number': '0'
+            }.items())
+    return location
+
+
+def _schedule_search(received, texts):
+    """Find or queue the search described by a validated request
+
+    Parameters
+    ----------
+    received : dict
+        search request that has passed validation
+    texts : dict[str, tesserae.db.entities.Text]
+        mapping from object_id to text, including the source and target
+
+    Returns
+    -------
+    status_code : int
+        303 if the results are cached or already being computed; 201 if a new
+        search was queued
+    location : str
+        URL at which the results will be found
+
+    Raises
+    ------
+    apitess.admission.Overloaded
+        if the server is not accepting new searches right now
+    queue.Full
+        if the search could not be added to the queue
+    """
+    source = received['source']
+    target = received['target']
+    method = received['method']
 
     results_id = tesserae.utils.search.check_cache(flask.g.db, source, target,
                                                    method)
     if results_id:
-        response = flask.Response()
-        response.status_code = 303
-        response.status = '303 See Other'
         # Redirect should point to paginated results
-        response.headers['Location'] = os.path.join(
-            flask.request.base_url, results_id, '?' + '&'.join(
-                f'{a}={b}' for a, b in {
-                    'sort_by': 'score',
-                    'sort_order': 'descending',
-                    'per_page': '100',
-                    'page_number': '0'
-                }.items()))
-        return response
+        return 303, _results_location(results_id, paginated=True)
 
-    response = flask.Response()
-    response.status_code = 201
-    response.status = '201 Created'
+    # identical searches submitted before the first one finishes are pointed
+    # to the first one instead of being queued again
+    search_key = apitess.inflight.fingerprint({
+        'source': {
+            'object_id': source['object_id'],
+            'units': source['units']
+        },
+        'target': {
+            'object_id': target['object_id'],
+            'units': target['units']
+        },
+        'method': method,
+    })
     results_id = uuid.uuid4().hex
-    # we want the final '/' on the URL
-    response.headers['Location'] = os.path.join(flask.request.base_url,
-                                                results_id, '')
+    pending_id = apitess.inflight.claim(flask.g.db, search_key, results_id)
+    if pending_id is not None and not _is_live(search_key, pending_id):
+        pending_id = apitess.inflight.claim(flask.g.db, search_key,
+                                            results_id)
+    if pending_id is not None:
+        return 303, _results_location(pending_id)
 
+    client = flask.g.admission.identify(flask.request)
     try:
+        flask.g.admission.admit(flask.g.db, client)
         search_params = {
-            'source': TextOptions(source_text, source['units']),
-            'target': TextOptions(target_text, target['units']),
+            'source': TextOptions(texts[source['object_id']],
+                                  source['units']),
+            'target': TextOptions(texts[target['object_id']],
+                                  target['units']),
         }
         search_params.update(
             {key: method[key]
@@ -169,15 +247,155 @@ def submit_search():
         tesserae.utils.search.submit_search(flask.g.jobqueue, flask.g.db,
                                             results_id, method['name'],
                                             search_params)
+    except Exception:
+        apitess.inflight.release(flask.g.db, search_key, results_id)
+        raise
+    flask.g.admission.record(flask.g.db, client, results_id)
+    return 201, _results_location(results_id)
+
+
+def _is_live(search_key, results_id):
+    """Whether a coalesced search has produced or will produce results
+
+    A search that has been claimed but not yet recorded in the database is
+    considered live only for a short while after it was claimed.  The claim
+    on `search_key` is released once its search is seen to be finished,
+    failed, or missing, so that a later submission does not point to results
+    that were purged.
+    """
+    found = flask.g.db.find(tesserae.db.entities.Search.collection,
+                            results_id=results_id,
+                            search_type=tesserae.utils.search.NORMAL_SEARCH)
+    if not found:
+        if apitess.inflight.is_recent(flask.g.db, search_key, results_id):
+            return True
+        status = None
+    else:
+        status = found[0].status
+        if status not in (tesserae.db.entities.Search.DONE,
+                          tesserae.db.entities.Search.FAILED):
+            return True
+    apitess.inflight.release(flask.g.db, search_key, results_id)
+    return status == tesserae.db.entities.Search.DONE
+
+
+@bp.route('/', methods=(
+    'POST',
+    'OPTIONS',
+))
+@cross_origin(expose_headers=['Location', 'Retry-After'])
+def submit_search():
+    """Run a Tesserae search"""
+    error_response, received = apitess.errors.check_body(flask.request)
+    if error_response:
+        return error_response
+    requireds = {'source', 'target', 'method'}
+    miss_error = apitess.errors.check_requireds(received, requireds)
+    if miss_error:
+        return miss_error
+
+    message = _check_units(received)
+    if message:
+        return apitess.errors.error(400, data=received, message=message)
+    texts = _find_texts(
+        [received['source']['object_id'], received['target']['object_id']])
+    message = _check_texts_found(received, texts) or _check_method(received)
+    if message:
+        return apitess.errors.error(400, data=received, message=message)
+
+    try:
+        status_code, location = _schedule_search(received, texts)
+    except Overloaded as e:
+        response = apitess.errors.error(e.status_code,
+                                        data=received,
+                                        message=e.message)
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response
     except queue.Full:
-        return apitess.error.error(
+        return apitess.errors.error(
             500,
             data=received,
             message=('The search request could not be added to the queue. '
                      'Please try again in a few minutes'))
+    response = flask.Response()
+    response.status_code = status_code
+    if status_code == 303:
+        response.status = '303 See Other'
+    else:
+        response.status = '201 Created'
+    response.headers['Location'] = location
     return response
 
 
+@bp.route('/batch/', methods=(
+    'POST',
+    'OPTIONS',
+))
+@cross_origin()
+def submit_search_batch():
+    """Run many Tesserae searches with a single request
+
+    The request data payload holds a list of search requests under
+    "searches"; every search request has the same form as one POSTed to
+    /parallels/.  Texts referenced by all of the searches are retrieved from
+    the database together.
+    """
+    error_response, received = apitess.errors.check_body(flask.request)
+    if error_response:
+        return error_response
+    miss_error = apitess.errors.check_requireds(received, {'searches'})
+    if miss_error:
+        return miss_error
+    searches = received['searches']
+    if not isinstance(searches, list) or \
+            not all(isinstance(s, dict) for s in searches):
+        return apitess.errors.error(
+            400,
+            data=received,
+            message='"searches" must be a list of search requests.')
+
+    requireds = ('source', 'target', 'method')
+    outcomes = [None] * len(searches)
+    object_ids = []
+    for i, search in enumerate(searches):
+        missing = [req for req in requireds if req not in search]
+        if missing:
+            outcomes[i] = (400, None, (
+                'The search request is missing the following required '
+                'key(s): {}'.format(', '.join(missing))))
+            continue
+        message = _check_units(search)
+        if message:
+            outcomes[i] = (400, None, message)
+            continue
+        object_ids.append(search['source']['object_id'])
+        object_ids.append(search['target']['object_id'])
+
+    texts = _find_texts(object_ids)
+    for i, search in enumerate(searches):
+        if outcomes[i] is not None:
+            continue
+        message = _check_texts_found(search, texts) or _check_method(search)
+        if message:
+            outcomes[i] = (400, None, message)
+            continue
+        try:
+            status_code, location = _schedule_search(search, texts)
+            outcomes[i] = (status_code, location, None)
+        except Overloaded as e:
+            outcomes[i] = (e.status_code, None, e.message)
+        except queue.Full:
+            outcomes[i] = (500, None, (
+                'The search request could not be added to the queue. '
+                'Please try again in a few minutes'))
+
+    return flask.jsonify(searches=[{
+        'status': status_code,
+        'location': location,
+        'message': message
+    } for status_code, location, message in outcomes])
+
+
 @bp.route('/<results_id>/status/')
 @cross_origin()
 def retrieve_status(results_id):
@@ -185,6 +403,13 @@ def retrieve_status(results_id):
                                   tesserae.utils.search.NORMAL_SEARCH)
 
 
+@bp.route('/<results_id>/status/stream/')
+@cross_origin()
+def stream_status(results_id):
+    return common_stream_status(results_id,
+                                tesserae.utils.search.NORMAL_SEARCH)
+
+
 @bp.route('/<results_id>/downloads/')
 @cross_origin()
 def download(results_id):
@@ -197,8 +422,7 @@ def download(results_id):
         response.status_code = 404
         return response
     status = results_status_found[0]
-    status.update_last_queried()
-    flask.g.db.update(status)
+    flask.g.last_queried.touch(status)
     if status.status == tesserae.db.entities.Search.DONE:
         return flask.send_file(tesserae.utils.downloads.get_results_filename(
             status, ResultsWriter.RESULTS_DIR),
@@ -230,30 +454,108 @@ def retrieve_results(results_id):
         return response
 
     url_query_params = flask.request.args
-    page_options, err = get_page_options_or_error(url_query_params)
+    if 'cursor' in url_query_params:
+        cursor_options, err = get_cursor_options_or_error(url_query_params)
+    else:
+        cursor_options = None
+        page_options, err = get_page_options_or_error(url_query_params)
     if err:
         return err
 
     search_id = results_status_found[0].id
-    response = flask.Response(
-        response=gzip.compress(
-            flask.json.dumps({
-                'data':
-                results_status_found[0].parameters,
-                'max_score':
-                tesserae.utils.search.get_max_score(flask.g.db, search_id),
-                'total_count':
-                tesserae.utils.search.get_results_count(flask.g.db, search_id),
-                'parallels':
-                tesserae.utils.search.get_results(flask.g.db, search_id,
-                                                  page_options)
-            }).encode('utf-8')),
-        mimetype='application/json',
-    )
+    # results of a completed search never change
+    etag = query_etag(str(search_id))
+    flask.g.last_queried.touch(results_status_found[0])
+    current = fresh_etag(etag)
+    if current:
+        return not_modified(current, IMMUTABLE)
+
+    with timed('summary'):
+        max_score, total_count = get_search_summary(flask.g.db, search_id)
+    page = {
+        'data': results_status_found[0].parameters,
+        'max_score': max_score,
+        'total_count': total_count,
+    }
+    with timed('page'):
+        if cursor_options:
+            page['parallels'], page['cursor'] = get_keyset_results(
+                flask.g.db, search_id, cursor_options)
+        else:
+            page['parallels'] = tesserae.utils.search.get_results(
+                flask.g.db, search_id, page_options)
+
+    with timed('serialize'):
+        response = flask.jsonify(page)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = IMMUTABLE
+    return response
+
+
+@bp.route('/<results_id>/stream/')
+@cross_origin()
+def stream_results(results_id):
+    """Stream every parallel of a search as newline-delimited JSON
+
+    Parallels are read from a database cursor and, if the client accepts
+    gzip, compressed incrementally, so memory use does not grow with the size
+    of the search results.
+    """
+    results_status_found = flask.g.db.find(
+        tesserae.db.entities.Search.collection,
+        results_id=results_id,
+        search_type=tesserae.utils.search.NORMAL_SEARCH)
+    if not results_status_found:
+        response = flask.Response('Could not find results_id')
+        response.status_code = 404
+        return response
+    status = results_status_found[0]
+    if status.status != tesserae.db.entities.Search.DONE:
+        status_url = flask.url_for('parallels.retrieve_status',
+                                   results_id=results_id,
+                                   _external=True)
+        response = flask.Response(
+            f'Unable to retrieve results; check {status_url} endpoint.')
+        response.headers['Cache-Control'] = 'no-store'
+        response.status_code = 404
+        return response
+
+    matches = flask.g.db.connection[
+        tesserae.db.entities.Match.collection].find(
+            {'search_id': status.id},
+            projection=MATCH_PROJECTION,
+            batch_size=STREAM_CHUNK_SIZE)
+
+    # the compression layer leaves streamed bodies alone, so gzip is applied
+    # here, chunk by chunk, when the client accepts it
+    use_gzip = flask.request.accept_encodings['gzip'] > 0
+
+    def generate():
+        # wbits of 16 + MAX_WBITS produces gzip framing
+        compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+        lines = []
+        for match_doc in matches:
+            lines.append(flask.json.dumps(match_json(match_doc)))
+            if len(lines) >= STREAM_CHUNK_SIZE:
+                chunk = ('\n'.join(lines) + '\n').encode('utf-8')
+                lines = []
+                if use_gzip:
+                    chunk = compressor.compress(chunk)
+                if chunk:
+                    yield chunk
+        if lines:
+            chunk = ('\n'.join(lines) + '\n').encode('utf-8')
+            yield compressor.compress(chunk) if use_gzip else chunk
+        if use_gzip:
+            yield compressor.flush()
+
+    response = flask.Response(flask.stream_with_context(generate()),
+                              mimetype='application/x-ndjson')
     response.status_code = 200
     response.status = '200 OK'
-    response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    if use_gzip:
+        response.headers['Content-Encoding'] = 'gzip'
 
-    results_status_found[0].update_last_queried()
-    flask.g.db.update(results_status_found[0])
+    flask.g.last_queried.touch(status)
     return response
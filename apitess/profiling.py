@@ -0,0 +1,170 @@
+"""Opt-in profiling of individual requests
+
+When PROFILE_ENABLED is set, a request is run under cProfile if it is picked
+at random with probability PROFILE_SAMPLE_RATE or, on admin instances only,
+if it carries the PROFILE_HEADER header.  Each profile is saved to
+PROFILE_DIR as a pstats file next to a JSON file describing the request; only
+the PROFILE_KEEP most recent profiles are kept.  On admin instances, the
+saved profiles are listed at /profiles/.
+"""
+import cProfile
+import datetime
+import io
+import json
+import os
+import pstats
+import random
+import threading
+import time
+import uuid
+
+import flask
+
+import apitess.errors
+
+PROFILE_DIR = os.path.join(os.path.expanduser('~'), 'tess_data', 'profiles')
+# number of functions summarized in a profile's description
+TOP_FUNCTIONS = 15
+
+bp = flask.Blueprint('profiles', __name__, url_prefix='/profiles')
+
+# cProfile cannot profile two threads at once, so concurrent requests that
+# should be profiled are run unprofiled instead
+_profiler_lock = threading.Lock()
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _summarize(profiler):
+    """List the functions with the most cumulative time in a profile"""
+    stats = pstats.Stats(profiler, stream=io.StringIO())
+    stats.sort_stats(pstats.SortKey.CUMULATIVE)
+    top = []
+    for func in stats.fcn_list[:TOP_FUNCTIONS]:
+        filename, line, name = func
+        primitive_calls, calls, tottime, cumtime, _ = stats.stats[func]
+        top.append({
+            'function': f'{filename}:{line}({name})',
+            'calls': calls,
+            'tottime': tottime,
+            'cumtime': cumtime,
+        })
+    return top
+
+
+def _save_profile(directory, keep, profiler, description):
+    """Write a profile and its description, then drop the oldest profiles"""
+    os.makedirs(directory, exist_ok=True)
+    name = '{}-{}'.format(_now().strftime('%Y%m%dT%H%M%S%f'),
+                          uuid.uuid4().hex[:8])
+    profiler.dump_stats(os.path.join(directory, name + '.prof'))
+    description['name'] = name
+    description['top'] = _summarize(profiler)
+    with open(os.path.join(directory, name + '.json'), 'w',
+              encoding='utf-8') as ofh:
+        json.dump(description, ofh)
+    # names begin with a timestamp, so sort oldest first
+    for stale in _profile_names(directory)[:-keep]:
+        for ext in ('.prof', '.json'):
+            try:
+                os.remove(os.path.join(directory, stale + ext))
+            except OSError:
+                pass
+
+
+def _profile_names(directory):
+    try:
+        filenames = os.listdir(directory)
+    except OSError:
+        return []
+    return sorted(f[:-len('.json')] for f in filenames if f.endswith('.json'))
+
+
+def register_profiling(app):
+    """Profile requests as configured (see the module docstring)"""
+    if not app.config.get('PROFILE_ENABLED', False):
+        return
+    app.config.setdefault('PROFILE_HEADER', 'X-Tesserae-Profile')
+    app.config.setdefault('PROFILE_SAMPLE_RATE', 0.0)
+    app.config.setdefault('PROFILE_DIR', PROFILE_DIR)
+    app.config.setdefault('PROFILE_KEEP', 100)
+    # anyone can send the header, so the public instance ignores it
+    is_admin = os.environ.get('ADMIN_INSTANCE') == 'true'
+
+    @app.before_request
+    def start_profiler():
+        requested = is_admin and \
+            app.config['PROFILE_HEADER'] in flask.request.headers
+        if not requested and \
+                random.random() >= app.config['PROFILE_SAMPLE_RATE']:
+            return
+        if not _profiler_lock.acquire(blocking=False):
+            return
+        profiler = cProfile.Profile()
+        flask.g.profile_start = time.perf_counter()
+        flask.g.profiler = profiler
+        profiler.enable()
+
+    @app.teardown_request
+    def stop_profiler(exc):
+        profiler = flask.g.pop('profiler', None)
+        if profiler is None:
+            return
+        profiler.disable()
+        wall_time = time.perf_counter() - flask.g.pop('profile_start')
+        _profiler_lock.release()
+        _save_profile(
+            app.config['PROFILE_DIR'], app.config['PROFILE_KEEP'], profiler, {
+                'created': _now().isoformat(),
+                'method': flask.request.method,
+                'path': flask.request.path,
+                'endpoint': flask.request.endpoint,
+                'view_args': flask.request.view_args,
+                'args': flask.request.args.to_dict(flat=False),
+                'wall_time': wall_time,
+                'error': None if exc is None else repr(exc),
+            })
+
+    if is_admin:
+        app.register_blueprint(bp)
+
+
+@bp.route('/')
+def query_profiles():
+    """List the most recent profiles, newest first"""
+    try:
+        limit = int(flask.request.args.get('limit', 20))
+    except ValueError:
+        return apitess.errors.error(
+            400,
+            data=flask.request.args.to_dict(),
+            message='"limit" must be an integer')
+    directory = flask.current_app.config['PROFILE_DIR']
+    profiles = []
+    for name in reversed(_profile_names(directory)):
+        if len(profiles) >= limit:
+            break
+        try:
+            with open(os.path.join(directory, name + '.json'),
+                      encoding='utf-8') as ifh:
+                profiles.append(json.load(ifh))
+        except (OSError, ValueError):
+            # removed by rotation or still being written
+            continue
+    return flask.jsonify({'profiles': profiles})
+
+
+@bp.route('/<name>/')
+def get_profile(name):
+    """Download a profile in pstats format"""
+    directory = flask.current_app.config['PROFILE_DIR']
+    if name not in _profile_names(directory):
+        return apitess.errors.error(
+            404,
+            name=name,
+            message=f'No profile named {name} was found.')
+    return flask.send_from_directory(directory, name + '.prof',
+                                     mimetype='application/octet-stream',
+                                     as_attachment=True)
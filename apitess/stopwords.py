@@ -4,6 +4,9 @@ import os
 import flask
 from flask_cors import cross_origin
 
+from apitess.cache import cached, invalidate
+from apitess.conditional import conditional
+from apitess.deletions import hidden_text_ids
 import apitess.errors
 import apitess.utils
 import tesserae.db.entities
@@ -12,8 +15,41 @@ from tesserae.utils.stopwords import create_stoplist, get_stoplist_tokens
 bp = flask.Blueprint('stopwords', __name__, url_prefix='/stopwords')
 
 
+def _language_basis(language, hidden):
+    """Find the texts a language's stopwords are counted over
+
+    Returns
+    -------
+    dict
+        keyword arguments for create_stoplist: none if no text in `language`
+        is being deleted, so that the whole language counts; otherwise a
+        "basis" listing the object_ids of the others
+    """
+    texts = flask.g.db.connection[tesserae.db.entities.Text.collection]
+    if not hidden or texts.count_documents({
+            'language': language,
+            '_id': {
+                '$in': list(hidden)
+            }
+    }) == 0:
+        return {}
+    return {
+        'basis': [
+            str(doc['_id']) for doc in texts.find(
+                {
+                    'language': language,
+                    '_id': {
+                        '$nin': list(hidden)
+                    }
+                },
+                projection={'_id': True})
+        ]
+    }
+
+
 @bp.route('/')
 @cross_origin()
+@cached('stopwords')
 def query_stopwords():
     """Build a stopwords list"""
     if len(flask.request.args) == 0:
@@ -31,11 +67,15 @@ def query_stopwords():
                   for k, v in flask.request.args.items()},
             message='"list_size" must be an integer')
 
+    # texts being deleted are left out of the counts
+    hidden = hidden_text_ids(flask.g.db)
+
     # language takes precedence over works
     language = flask.request.args.get('language', None)
     if language:
         stopword_indices = create_stoplist(flask.g.db, list_size, feature,
-                                           language)
+                                           language,
+                                           **_language_basis(language, hidden))
         if len(stopword_indices) == 0:
             return apitess.errors.error(
                 400,
@@ -54,8 +94,10 @@ def query_stopwords():
         oids, fails = apitess.utils.parse_works_arg(works)
         if fails:
             return apitess.errors.bad_object_ids(fails, flask.request.args)
-        text_results = flask.g.db.find(tesserae.db.entities.Text.collection,
-                                       _id=oids)
+        text_results = [
+            t for t in flask.g.db.find(tesserae.db.entities.Text.collection,
+                                       _id=oids) if t.id not in hidden
+        ]
         if len(text_results) != len(oids):
             # figure out which works were not found in the database and report
             found = {str(r.id) for r in text_results}
@@ -93,6 +135,8 @@ def query_stopwords():
 
 @bp.route('/lists/')
 @cross_origin()
+@conditional
+@cached('stopwords_lists')
 def query_stopwords_lists():
     """Report curated stopwords lists in database"""
     found = flask.g.db.find(tesserae.db.entities.StopwordsList.collection)
@@ -101,6 +145,8 @@ def query_stopwords_lists():
 
 @bp.route('/lists/<name>/')
 @cross_origin()
+@conditional
+@cached('stopwords_list:{name}')
 def get_stopwords_list(name):
     """Retrieve specified stopwords list"""
     found = flask.g.db.find(tesserae.db.entities.StopwordsList.collection,
@@ -166,6 +212,7 @@ if os.environ.get('ADMIN_INSTANCE') == 'true':
             return apitess.errors.error(500,
                                         data=data,
                                         message='Unknown server error')
+        invalidate('stopwords_lists', f'stopwords_list:{name}')
         response = flask.jsonify({'stopwords': data['stopwords']})
         response.status_code = 201
         response.headers['Content-Location'] = os.path.join(
@@ -189,6 +236,7 @@ if os.environ.get('ADMIN_INSTANCE') == 'true':
                 name=name,
                 message='Server error in deleting: deleted {} documents'.
                 format(result.deleted_count))
+        invalidate('stopwords_lists', f'stopwords_list:{name}')
         response = flask.Response()
         response.status_code = 204
         return response
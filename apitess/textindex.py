@@ -0,0 +1,373 @@
+"""In-memory prefix index over text metadata, for autocompletion"""
+import bisect
+import difflib
+import heapq
+import re
+import threading
+import time
+import unicodedata
+
+import flask
+
+import tesserae.db.entities
+
+# metadata that is searched
+INDEXED_FIELDS = ('author', 'title', 'cts_urn')
+# metadata returned for each match
+RESULT_FIELDS = ('object_id', 'author', 'title', 'cts_urn', 'language')
+
+# letters that Unicode decomposition leaves whole
+LIGATURES = str.maketrans({'æ': 'ae', 'œ': 'oe', 'ø': 'o', 'đ': 'd'})
+# runs of characters that are neither letters nor digits
+NOT_ALNUM = re.compile(r'[\W_]+')
+# sorts after every character, so that (prefix + LAST,) bounds the run of
+# terms starting with prefix
+LAST = '\U0010ffff'
+
+
+def normalize(value):
+    """Fold case and strip diacritics, so that "Æschylus" finds "aeschylus"
+
+    Punctuation becomes whitespace, so that URNs split into words.
+    """
+    folded = str(value).casefold().translate(LIGATURES)
+    if not folded.isascii():
+        folded = ''.join(
+            char for char in unicodedata.normalize('NFKD', folded)
+            if not unicodedata.combining(char))
+    return ' '.join(NOT_ALNUM.sub(' ', folded).split())
+
+
+class TextIndex:
+    """Sorted arrays of normalized metadata, searched by binary search
+
+    Every indexed field value is stored whole and split into words, each as
+    (term, object_id) pairs kept in sorted order, so that all terms beginning
+    with a prefix form a contiguous run found with bisect.
+
+    The index is rebuilt from the database once it is older than `ttl`
+    seconds.  Only the first build makes a search wait; later rebuilds run in
+    a background thread, while searches keep using the previous index, which
+    is swapped for the new one once it is complete.
+
+    Parameters
+    ----------
+    ttl : float
+        number of seconds after which the index is rebuilt from the database,
+        to pick up changes made by other processes
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._built = None
+        self._rebuilding = False
+        # changes made while a rebuild is running, replayed onto its result
+        self._journal = None
+        self._clear()
+
+    def _clear(self):
+        self._texts = {}
+        self._sort_keys = {}
+        self._terms_by_id = {}
+        self._ordered = []
+        self._fields = []
+        self._words = []
+        self._vocabulary = []
+
+    def ensure_current(self, db, hidden=set):
+        """Build the index from the database if it is missing or expired
+
+        Parameters
+        ----------
+        db : tesserae.db.TessMongoConnection
+        hidden : callable
+            returns the ObjectIds of texts to leave out; it is only called
+            when the index is rebuilt, possibly from another thread
+        """
+        if self._built is None:
+            with self._build_lock:
+                if self._built is None:
+                    self._rebuild(db, hidden)
+            return
+        if time.monotonic() - self._built < self.ttl:
+            return
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+        threading.Thread(target=self._rebuild_quietly,
+                         args=(db, hidden),
+                         daemon=True).start()
+
+    def _rebuild_quietly(self, db, hidden):
+        try:
+            self._rebuild(db, hidden)
+        except Exception:
+            # the previous index keeps being used, and the next search
+            # after the TTL tries again
+            pass
+
+    def _rebuild(self, db, hidden):
+        with self._lock:
+            self._journal = []
+        try:
+            docs = db.connection[tesserae.db.entities.Text.collection].find(
+                {'_id': {
+                    '$nin': list(hidden())
+                }},
+                projection={field: True
+                            for field in RESULT_FIELDS})
+            fresh = TextIndex(self.ttl)
+            fresh._load(dict(doc, object_id=str(doc['_id'])) for doc in docs)
+        except BaseException:
+            with self._lock:
+                self._journal = None
+                self._rebuilding = False
+            raise
+        with self._lock:
+            for change, arg in self._journal:
+                if change == 'add':
+                    fresh._remove(arg['object_id'])
+                    fresh._add(arg)
+                else:
+                    fresh._remove(arg)
+            self._texts = fresh._texts
+            self._sort_keys = fresh._sort_keys
+            self._terms_by_id = fresh._terms_by_id
+            self._ordered = fresh._ordered
+            self._fields = fresh._fields
+            self._words = fresh._words
+            self._vocabulary = fresh._vocabulary
+            self._journal = None
+            self._rebuilding = False
+            self._built = time.monotonic()
+
+    def _load(self, texts):
+        """Index many texts at once, sorting each array only once"""
+        for text in texts:
+            fields, words = self._describe(text)
+            self._ordered.append(self._sort_keys[text['object_id']])
+            self._fields.extend((term, text['object_id']) for term in fields)
+            self._words.extend((term, text['object_id']) for term in words)
+        self._ordered.sort()
+        self._fields.sort()
+        self._words.sort()
+        self._vocabulary = sorted({term for term, _ in self._words})
+
+    def add(self, text):
+        """Index a text, replacing any earlier version of it
+
+        Parameters
+        ----------
+        text : dict
+            metadata of the text, including its "object_id"
+        """
+        with self._lock:
+            if self._journal is not None:
+                self._journal.append(('add', text))
+            self._remove(text['object_id'])
+            self._add(text)
+
+    def remove(self, object_id):
+        """Drop a text from the index"""
+        with self._lock:
+            if self._journal is not None:
+                self._journal.append(('remove', object_id))
+            self._remove(object_id)
+
+    def _describe(self, text):
+        """Record the metadata and terms of a text; return its terms"""
+        object_id = text['object_id']
+        self._texts[object_id] = {
+            field: text.get(field)
+            for field in RESULT_FIELDS
+        }
+        normalized = {
+            field: normalize(text.get(field) or '')
+            for field in INDEXED_FIELDS
+        }
+        self._sort_keys[object_id] = (normalized['author'],
+                                      normalized['title'], object_id)
+        fields = {value for value in normalized.values() if value}
+        words = {word for value in fields for word in value.split()}
+        self._terms_by_id[object_id] = (tuple(fields), tuple(words))
+        return fields, words
+
+    def _add(self, text):
+        object_id = text['object_id']
+        fields, words = self._describe(text)
+        bisect.insort(self._ordered, self._sort_keys[object_id])
+        for term in fields:
+            bisect.insort(self._fields, (term, object_id))
+        for term in words:
+            bisect.insort(self._words, (term, object_id))
+            pos = bisect.bisect_left(self._vocabulary, term)
+            if pos == len(self._vocabulary) or self._vocabulary[pos] != term:
+                self._vocabulary.insert(pos, term)
+
+    def _remove(self, object_id):
+        if self._texts.pop(object_id, None) is None:
+            return
+        sort_key = self._sort_keys.pop(object_id)
+        del self._ordered[bisect.bisect_left(self._ordered, sort_key)]
+        fields, words = self._terms_by_id.pop(object_id)
+        for entries, terms in ((self._fields, fields), (self._words, words)):
+            for term in terms:
+                pos = bisect.bisect_left(entries, (term, object_id))
+                if pos < len(entries) and entries[pos] == (term, object_id):
+                    del entries[pos]
+        for term in words:
+            pos = bisect.bisect_left(self._words, (term, ''))
+            if pos == len(self._words) or self._words[pos][0] != term:
+                del self._vocabulary[bisect.bisect_left(
+                    self._vocabulary, term)]
+
+    @staticmethod
+    def _bounds(entries, prefix):
+        """Locate the run of entries whose terms start with `prefix`"""
+        start = bisect.bisect_left(entries, (prefix, ''))
+        end = bisect.bisect_left(entries, (prefix + LAST, ''), start)
+        return start, end
+
+    def _alternatives(self, word):
+        """Find the prefixes that a query word stands for
+
+        The word itself is used if some indexed word begins with it;
+        otherwise, indexed words close to it are, to correct misspellings.
+        These are only looked for among the distinct words sharing the first
+        letter of `word` and of a length that difflib could accept, which
+        keeps the search for them short.
+
+        Returns
+        -------
+        list of str
+            the prefixes, which may be empty
+        int
+            the number of entries whose terms start with any of them
+        """
+        start, end = self._bounds(self._words, word)
+        if start < end:
+            return [word], end - start
+        first = bisect.bisect_left(self._vocabulary, word[0])
+        last = bisect.bisect_left(self._vocabulary, word[0] + LAST, first)
+        # a difflib ratio of at least 0.75 needs lengths within these bounds
+        shortest, longest = 0.6 * len(word), len(word) / 0.6
+        candidates = [
+            term for term in self._vocabulary[first:last]
+            if shortest <= len(term) <= longest
+        ]
+        alternatives = difflib.get_close_matches(word,
+                                                 candidates,
+                                                 n=5,
+                                                 cutoff=0.75)
+        count = 0
+        for close in alternatives:
+            start, end = self._bounds(self._words, close)
+            count += end - start
+        return alternatives, count
+
+    def search(self, query, limit):
+        """Find the texts best matching `query`
+
+        Texts with a field that begins with the whole query rank first, then
+        texts with, for every word of the query, a word that begins with it,
+        and last texts matched only after correcting a misspelled word.
+
+        Returns
+        -------
+        list of dict
+            metadata of at most `limit` texts, best matches first
+        """
+        normalized = normalize(query)
+        if not normalized:
+            return []
+        with self._lock:
+            best = self._best(
+                lambda fields, _: any(
+                    field.startswith(normalized) for field in fields),
+                [self._bounds(self._fields, normalized)], self._fields,
+                limit, ())
+            if len(best) == limit:
+                return [dict(self._texts[oid]) for oid in best]
+            # every text with a field that begins with the query also
+            # matches word by word, so those already found are left out
+            alternatives = []
+            for word in normalized.split():
+                found = self._alternatives(word)
+                if not found[0]:
+                    break
+                alternatives.append(found)
+            else:
+                prefixes, _ = min(alternatives, key=lambda found: found[1])
+                words = [tuple(found[0]) for found in alternatives]
+                best += self._best(
+                    lambda _, text_words: all(
+                        any(term.startswith(prefixes) for term in text_words)
+                        for prefixes in words),
+                    [self._bounds(self._words, prefix) for prefix in prefixes],
+                    self._words, limit - len(best), set(best))
+            return [dict(self._texts[oid]) for oid in best]
+
+    def _best(self, matches, runs, entries, limit, excluded):
+        """Find the first `limit` matching texts in author and title order
+
+        Parameters
+        ----------
+        matches : callable
+            given the field values and words of a text, returns whether the
+            text matches
+        runs : list of (int, int)
+            bounds of the runs of `entries` that include every matching text
+        entries : list of (str, str)
+        limit : int
+        excluded : collection of str
+            object_ids to leave out
+
+        Returns
+        -------
+        list of str
+            the object_ids of the matching texts
+        """
+        count = sum(end - start for start, end in runs)
+        if count == 0:
+            return []
+        # checking every entry of the runs costs about `count` checks, while
+        # walking every text in order until `limit` matches are found costs
+        # about limit * len(self._ordered) / count
+        if count * count < limit * len(self._ordered):
+            found = {
+                entries[pos][1]
+                for start, end in runs for pos in range(start, end)
+                if entries[pos][1] not in excluded
+                and matches(*self._terms_by_id[entries[pos][1]])
+            }
+            return [
+                sort_key[2] for sort_key in heapq.nsmallest(
+                    limit, (self._sort_keys[oid] for oid in found))
+            ]
+        best = []
+        for sort_key in self._ordered:
+            object_id = sort_key[2]
+            if object_id not in excluded and \
+                    matches(*self._terms_by_id[object_id]):
+                best.append(object_id)
+                if len(best) == limit:
+                    break
+        return best
+
+
+def register_text_index(app):
+    """Keep an index of text metadata for /texts/search/
+
+    TEXT_INDEX_TTL sets how many seconds pass before the index is rebuilt
+    from the database; changes made through this process are applied to the
+    index immediately.
+    """
+    app.extensions['text_index'] = TextIndex(
+        app.config.get('TEXT_INDEX_TTL', 300))
+
+
+def get_text_index():
+    return flask.current_app.extensions['text_index']
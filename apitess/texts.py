@@ -1,21 +1,245 @@
 """The family of /texts/ endpoints"""
+import functools
+import io
+import json
 import os
-import urllib.parse
-import uuid
+import re
 
 from bson.objectid import ObjectId
 import flask
 from flask_cors import cross_origin
 
+from apitess.cache import cached, invalidate
+from apitess.conditional import conditional
+from apitess.database import TEXT_SORT_FIELDS
+from apitess.events import event_stream
+from apitess.deletions import PENDING, deletion_json, find_deletion, \
+    hidden_text_ids, is_hidden, submit_deletion
+from apitess.ingestprogress import fetch_ingest_statuses, is_finished
+from apitess.textindex import get_text_index
+from apitess.uploads import UploadSession, check_file, find_texts_by_hash, \
+    forget_text, purge_sessions, record_file, save_stream
 import apitess.errors
-from apitess.utils import fix_id
+from apitess.utils import decode_cursor, encode_cursor, fix_id
 import tesserae.db.entities
+from tesserae.db.entities.text import TextStatus
 
 bp = flask.Blueprint('texts', __name__, url_prefix='/texts')
 
 
+def _is_ingested(text_json):
+    """Whether ingestion of a text has finished, so its metadata is stable"""
+    status = text_json.get('ingestion_status')
+    return not status or status[0] == TextStatus.DONE
+
+
+def _all_ingested(texts_json):
+    return all(_is_ingested(t) for t in texts_json['texts'])
+
+
+# URL query values that select the projected, paginated catalog
+CATALOG_ARGS = {'fields', 'limit', 'cursor', 'sort_by', 'sort_order'}
+CATALOG_FIELDS = {
+    'author', 'cts_urn', 'ingestion_msg', 'ingestion_status', 'is_prose',
+    'language', 'object_id', 'title', 'unit_types', 'year'
+}
+# most matches /texts/search/ returns at once
+MAX_SEARCH_LIMIT = 50
+# each of these has an index on (field, _id); see apitess.database
+CATALOG_SORT_FIELDS = set(TEXT_SORT_FIELDS)
+
+
+def _year_filter(before_val, after_val):
+    """Translate the "before" and "after" URL query values into a filter"""
+    if before_val is not None and after_val is not None:
+        return {
+            'year': {
+                '$not': {
+                    '$gte': before_val,
+                    '$lte': after_val
+                }
+            }
+        }
+    if before_val is not None:
+        return {'year': {'$lte': before_val}}
+    if after_val is not None:
+        return {'year': {'$gte': after_val}}
+    return {}
+
+
+def _catalog_options_or_error(args):
+    """Parse the URL query values of the paginated catalog
+
+    Returns
+    -------
+    options : dict or None
+        "fields" (set of str or None for all fields), "sort_by", "direction"
+        (1 or -1), "limit" (int or None), and "after" (the sort key and _id
+        of the last text on the previous page, or None)
+    error_response
+        If any value was invalid, this will be set to an error response;
+        otherwise, this will be set to None
+    """
+    data = {k: v for k, v in args.items()}
+    fields = None
+    if args.get('fields'):
+        fields = set(args['fields'].split(','))
+        unknown = fields - CATALOG_FIELDS
+        if unknown:
+            return None, apitess.errors.error(
+                400,
+                data=data,
+                message=(f'Unknown "fields" value(s): {sorted(unknown)} '
+                         f'(Supported values are {sorted(CATALOG_FIELDS)})'))
+    sort_by = args.get('sort_by', '_id')
+    if sort_by != '_id' and sort_by not in CATALOG_SORT_FIELDS:
+        return None, apitess.errors.error(
+            400,
+            data=data,
+            message=(f'Specified "sort_by" value ({sort_by}) is not '
+                     'supported. (Supported values are '
+                     f'{sorted(CATALOG_SORT_FIELDS)})'))
+    sort_order = args.get('sort_order', 'ascending')
+    if sort_order not in ('ascending', 'descending'):
+        return None, apitess.errors.error(
+            400,
+            data=data,
+            message=(f'Specified "sort_order" value ({sort_order}) is not '
+                     'supported. Supported values are '
+                     "['ascending', 'descending']"))
+    limit = args.get('limit')
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            limit = 0
+        if limit < 1:
+            return None, apitess.errors.error(
+                400,
+                data=data,
+                message=(f'Specified "limit" value ({args["limit"]}) is not '
+                         'supported. Only positive integers are supported.'))
+    after = None
+    token = args.get('cursor')
+    if token:
+        if limit is None:
+            return None, apitess.errors.error(
+                400,
+                data=data,
+                message='"cursor" can only be used together with "limit".')
+        decoded = decode_cursor(token)
+        if decoded is None:
+            return None, apitess.errors.error(
+                400,
+                data=data,
+                message=f'Specified "cursor" value ({token}) is malformed.')
+        if decoded[:2] != (sort_by, sort_order):
+            return None, apitess.errors.error(
+                400,
+                data=data,
+                message=('Specified "cursor" value was issued for a different '
+                         '"sort_by" and "sort_order" combination.'))
+        after = (decoded[2], ObjectId(decoded[3]))
+    return {
+        'fields': fields,
+        'sort_by': sort_by,
+        'sort_order': sort_order,
+        'direction': 1 if sort_order == 'ascending' else -1,
+        'limit': limit,
+        'after': after,
+    }, None
+
+
+def _after_filter(sort_by, direction, last_key, last_id):
+    """Match the texts sorting after a cursor position
+
+    MongoDB sorts texts whose `sort_by` field is null or missing before all
+    others, but compares values only against values of the same type, so
+    those texts are matched separately from the rest.
+    """
+    compare = '$gt' if direction == 1 else '$lt'
+    if sort_by == '_id':
+        return {'_id': {compare: last_id}}
+    tie = {sort_by: last_key, '_id': {compare: last_id}}
+    if last_key is None:
+        if direction == 1:
+            return {'$or': [tie, {sort_by: {'$ne': None}}]}
+        return tie
+    later = {sort_by: {compare: last_key}}
+    if direction == 1:
+        return {'$or': [later, tie]}
+    return {'$or': [later, tie, {sort_by: None}]}
+
+
+def _query_catalog(filters, before_val, after_val):
+    """List texts with the fields, order, and page asked for
+
+    Unlike the default response, the projection, sort, and page are all
+    applied by the database, so only the requested data is read and sent.
+    Pages are addressed by keyset: each page ends with a cursor marking the
+    sort key and _id of its last text, and the next page starts after it.
+    """
+    options, err = _catalog_options_or_error(flask.request.args)
+    if err:
+        return err
+    sort_by = options['sort_by']
+    direction = options['direction']
+    query = dict(filters)
+    query.update(_year_filter(before_val, after_val))
+    hidden = hidden_text_ids(flask.g.db)
+    if hidden:
+        query['_id'] = {'$nin': list(hidden)}
+    if options['after'] is not None:
+        last_key, last_id = options['after']
+        query = {
+            '$and': [
+                query,
+                _after_filter(sort_by, direction, last_key, last_id)
+            ]
+        }
+    projection = None
+    if options['fields'] is not None:
+        projection = {
+            field: True
+            for field in options['fields'] | {sort_by}
+            if field not in ('object_id', '_id')
+        }
+        projection['_id'] = True
+    sort = [('_id', direction)]
+    if sort_by != '_id':
+        sort.insert(0, (sort_by, direction))
+    cursor = flask.g.db.connection[tesserae.db.entities.Text.collection].find(
+        query, projection=projection, sort=sort)
+    if options['limit'] is not None:
+        cursor = cursor.limit(options['limit'])
+    docs = list(cursor)
+
+    texts = []
+    for doc in docs:
+        text = {k: v for k, v in doc.items() if k != '_id'}
+        text['object_id'] = str(doc['_id'])
+        if options['fields'] is not None:
+            text = {
+                k: v
+                for k, v in text.items() if k in options['fields']
+            }
+        texts.append(text)
+    page = {'texts': texts}
+    if options['limit'] is not None:
+        page['cursor'] = None
+        if len(docs) == options['limit']:
+            last = docs[-1]
+            page['cursor'] = encode_cursor(
+                sort_by, options['sort_order'],
+                None if sort_by == '_id' else last.get(sort_by),
+                str(last['_id']))
+    return flask.jsonify(page)
+
+
 @bp.route('/')
 @cross_origin()
+@conditional
+@cached('texts', should_cache=_all_ingested)
 def query_texts():
     """Consult database for text metadata"""
     alloweds = {'author', 'language', 'title', 'cts_urn'}
@@ -48,6 +272,9 @@ def query_texts():
             400,
             message='If used, "before" and "after" must have integer values.')
 
+    if CATALOG_ARGS & set(flask.request.args):
+        return _query_catalog(filters, before_val, after_val)
+
     if before_val is not None and after_val is not None:
         results = flask.g.db.find(tesserae.db.entities.Text.collection,
                                   year_not=(before_val, after_val),
@@ -67,11 +294,42 @@ def query_texts():
     else:
         results = flask.g.db.find(tesserae.db.entities.Text.collection,
                                   **filters)
-    return flask.jsonify(texts=[fix_id(r.json_encode()) for r in results])
+    hidden = {str(text_id) for text_id in hidden_text_ids(flask.g.db)}
+    texts = [fix_id(r.json_encode()) for r in results]
+    return flask.jsonify(
+        texts=[t for t in texts if str(t['object_id']) not in hidden])
+
+
+@bp.route('/search/')
+@cross_origin()
+def search_texts():
+    """Find texts whose author, title, or CTS URN match a partial query"""
+    query = flask.request.args.get('q', '')
+    limit = flask.request.args.get('limit', '10')
+    try:
+        limit = int(limit)
+    except ValueError:
+        limit = 0
+    if not 1 <= limit <= MAX_SEARCH_LIMIT:
+        return apitess.errors.error(
+            400,
+            data={k: v
+                  for k, v in flask.request.args.items()},
+            message=(f'"limit" must be an integer from 1 to '
+                     f'{MAX_SEARCH_LIMIT}'))
+    index = get_text_index()
+    # bound now, since the index may be rebuilt outside of this request
+    index.ensure_current(flask.g.db,
+                         functools.partial(hidden_text_ids, flask.g.db))
+    response = flask.jsonify(texts=index.search(query, limit))
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 
 @bp.route('/<object_id>/')
 @cross_origin()
+@conditional
+@cached('text:{object_id}', should_cache=_is_ingested)
 def get_text(object_id):
     """Retrieve specific text's metadata"""
     results, failures = apitess.utils.make_object_ids([object_id])
@@ -80,46 +338,151 @@ def get_text(object_id):
     object_id_obj = results[0]
     found = flask.g.db.find(tesserae.db.entities.Text.collection,
                             _id=object_id_obj)
-    if not found:
+    if not found or is_hidden(flask.g.db, object_id_obj):
         return apitess.errors.text_not_found_object_id(object_id)
     result = fix_id(found[0].json_encode())
     return flask.jsonify(result)
 
 
+@bp.route('/<object_id>/ingest/status/')
+@cross_origin()
+def ingest_status(object_id):
+    """Report how far the ingestion of a text has gone, stage by stage"""
+    error_message = apitess.errors.check_object_id(object_id)
+    if error_message:
+        return error_message
+    statuses = fetch_ingest_statuses(flask.g.db, [ObjectId(object_id)])
+    if not statuses or is_hidden(flask.g.db, ObjectId(object_id)):
+        return apitess.errors.text_not_found_object_id(object_id)
+    status = statuses[ObjectId(object_id)]
+    response = flask.jsonify(status)
+    if not is_finished(status):
+        response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
+@bp.route('/<object_id>/ingest/status/stream/')
+@cross_origin()
+def stream_ingest_status(object_id):
+    """Serve server-sent events for every change in a text's ingestion
+
+    The stream ends once ingestion is done or has failed.
+    """
+    error_message = apitess.errors.check_object_id(object_id)
+    if error_message:
+        return error_message
+    if not flask.g.db.find(tesserae.db.entities.Text.collection,
+                           _id=ObjectId(object_id)) or \
+            is_hidden(flask.g.db, ObjectId(object_id)):
+        return apitess.errors.text_not_found_object_id(object_id)
+    response = flask.Response(event_stream(flask.g.ingest_watcher,
+                                           ObjectId(object_id), is_finished),
+                              mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-store'
+    # keep reverse proxies from holding events back
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
 if os.environ.get('ADMIN_INSTANCE') == 'true':
-    from tesserae.utils.delete import remove_text
     from tesserae.utils.ingest import submit_ingest
     FILE_UPLOAD_DIR = os.path.join(os.path.expanduser('~'), 'tess_data',
                                    'tessfiles')
+    # upload sessions idle for UPLOAD_SESSION_MAX_AGE seconds (a day by
+    # default) are discarded when the next session starts
+    UPLOAD_SESSION_DIR = os.path.join(os.path.expanduser('~'), 'tess_data',
+                                      'uploads')
+    # request Content-Types whose whole body is the file to add
+    RAW_UPLOAD_TYPES = {'application/octet-stream', 'text/plain'}
+    CONTENT_RANGE = re.compile(
+        r'bytes (?P<start>\d+)-(?P<end>\d+)/(?P<size>\d+|\*)')
+
+    def _metadata_or_error(value, expected=dict):
+        """Parse metadata sent apart from the file, as a JSON string"""
+        if value is None:
+            return apitess.errors.error(
+                400,
+                data={},
+                message='The request is missing the "metadata" field'), None
+        try:
+            metadata = json.loads(value)
+        except ValueError:
+            return apitess.errors.error(
+                400,
+                data=value,
+                message=('Unable to parse "metadata"; perhaps the JSON data '
+                         'is malformed')), None
+        if not isinstance(metadata, expected):
+            return apitess.errors.error(
+                400,
+                data=value,
+                message='"metadata" must be a JSON {}'.format(
+                    'array' if expected is list else 'object')), None
+        return None, metadata
+
+    def _upload_or_error():
+        """Separate the metadata of a POST to /texts/ from its file
+
+        The file contents may be embedded in a JSON body ("file_contents"),
+        sent as the "file_contents" part of a multipart/form-data body
+        alongside a "metadata" part, or sent as the raw body with the
+        metadata in the "metadata" URL query value.  Only the JSON form is
+        read into memory whole.
+
+        Returns
+        -------
+        error_response
+            set if the request is malformed; None otherwise
+        received : dict
+            the request, as reported back in error responses
+        stream : file-like
+            binary stream of the file contents
+        """
+        if flask.request.mimetype == 'multipart/form-data':
+            error_response, metadata = _metadata_or_error(
+                flask.request.form.get('metadata'))
+            if error_response:
+                return error_response, None, None
+            received = {'metadata': metadata}
+            if 'file_contents' not in flask.request.files:
+                return apitess.errors.check_requireds(
+                    received, {'metadata', 'file_contents'}), None, None
+            return None, received, flask.request.files['file_contents'].stream
+        if flask.request.mimetype in RAW_UPLOAD_TYPES:
+            error_response, metadata = _metadata_or_error(
+                flask.request.args.get('metadata'))
+            if error_response:
+                return error_response, None, None
+            return None, {'metadata': metadata}, flask.request.stream
 
-    @bp.route('/', methods=['POST'])
-    def add_text():
-        os.makedirs(os.path.abspath(FILE_UPLOAD_DIR), exist_ok=True)
         error_response, received = apitess.errors.check_body(flask.request)
         if error_response:
-            return error_response
+            return error_response, None, None
         requireds = {'metadata', 'file_contents'}
         error_response = apitess.errors.check_requireds(received, requireds)
         if error_response:
-            return error_response
+            return error_response, None, None
+        return None, received, io.BytesIO(
+            received['file_contents'].encode('utf-8'))
 
-        text = received['metadata']
+    def _check_metadata(text):
+        """Return an error response if `text` cannot describe a new text"""
         requireds = {'author', 'is_prose', 'language', 'title', 'year'}
         error_response = apitess.errors.check_requireds(text, requireds)
         if error_response:
             return error_response
 
         prohibiteds = {'_id', 'id', 'object_id'}
-        error_response = apitess.errors.check_prohibited(text, prohibiteds)
-        if error_response:
-            return error_response
+        return apitess.errors.check_prohibited(text, prohibiteds)
 
-        # save uploaded file to local filesystem
-        file_location = os.path.join(FILE_UPLOAD_DIR,
-                                     str(uuid.uuid4()) + '.tess')
-        with open(file_location, 'w', encoding='utf-8') as ofh:
-            ofh.write(received['file_contents'])
+    def _submit(text, file_location):
+        """Submit the text saved at `file_location` for ingestion
 
+        Returns
+        -------
+        str
+            the object_id of the new text, which is also set in `text`
+        """
         # remove ingestion status information, if provided
         if 'ingestion_status' in text:
             del text['ingestion_status']
@@ -127,29 +490,306 @@ if os.environ.get('ADMIN_INSTANCE') == 'true':
             del text['ingestion_msg']
 
         text_to_add = tesserae.db.entities.Text(**text)
+        # add text to database
+        insert_id = submit_ingest(flask.g.ingest_queue, flask.g.db,
+                                  text_to_add, file_location)
+        object_id = str(insert_id)
+        text['object_id'] = object_id
+        get_text_index().add(text)
+        return object_id
+
+    def _ingest(text, file_location, received):
+        """Submit a text for ingestion and respond with its metadata
+
+        Returns
+        -------
+        flask.Response
+            201 Created, with the metadata of the new text, or an error
+        """
         try:
-            # add text to database
-            insert_id = submit_ingest(
-                flask.g.ingest_queue, flask.g.db, text_to_add, file_location)
+            object_id = _submit(text, file_location)
         except Exception as e:
             return apitess.errors.error(
                 500,
                 data=received,
                 message='Could not add to database: {}'.format(e))
-
-        object_id = str(insert_id)
-        text['object_id'] = object_id
-        percent_encoded_object_id = urllib.parse.quote(object_id)
+        invalidate('texts', 'languages', 'features', 'units', 'stopwords')
 
         response = flask.Response()
         response.status_code = 201
         response.status = '201 Created'
-        response.headers['Content-Location'] = os.path.join(
-            flask.request.base_url, percent_encoded_object_id, '')
+        response.headers['Content-Location'] = flask.url_for(
+            'texts.get_text', object_id=object_id, _external=True)
         response.headers['Content-Type'] = 'application/json; charset=utf-8'
         response.set_data(flask.json.dumps(text).encode('utf-8'))
         return response
 
+    @bp.route('/', methods=['POST'])
+    def add_text():
+        error_response, received, stream = _upload_or_error()
+        if error_response:
+            return error_response
+
+        text = received['metadata']
+        error_response = _check_metadata(text)
+        if error_response:
+            return error_response
+
+        # save uploaded file to local filesystem
+        try:
+            file_location, sha256, _ = save_stream(stream, FILE_UPLOAD_DIR)
+        except UnicodeDecodeError:
+            return apitess.errors.error(
+                400,
+                data=received['metadata'],
+                message='The uploaded file is not encoded as UTF-8')
+
+        response = _ingest(text, file_location, received)
+        if response.status_code == 201:
+            record_file(flask.g.db, sha256, text['object_id'])
+            response.headers['X-Tesserae-File-SHA256'] = sha256
+        return response
+
+    def _batch_or_error():
+        """Pair up the metadata and files of a POST to /texts/batch/
+
+        The batch is either a JSON object whose "texts" array holds objects
+        like the body of a JSON POST to /texts/, or a multipart/form-data
+        body whose "metadata" field is a JSON array of metadata objects and
+        whose "file_contents" parts are the files, in the same order.
+
+        Returns
+        -------
+        error_response
+            set if the batch as a whole is malformed; None otherwise
+        items : list of (object, file-like or None)
+            metadata and binary stream of the file of each text; the stream
+            is None for an item of a JSON batch lacking "file_contents"
+        """
+        if flask.request.mimetype == 'multipart/form-data':
+            error_response, metadata = _metadata_or_error(
+                flask.request.form.get('metadata'), list)
+            if error_response:
+                return error_response, None
+            files = flask.request.files.getlist('file_contents')
+            if len(files) != len(metadata):
+                return apitess.errors.error(
+                    400,
+                    data=metadata,
+                    message=(f'Received {len(metadata)} metadata objects '
+                             f'but {len(files)} files')), None
+            return None, [(m, f.stream) for m, f in zip(metadata, files)]
+
+        error_response, received = apitess.errors.check_body(flask.request)
+        if error_response:
+            return error_response, None
+        if not isinstance(received, dict) or \
+                not isinstance(received.get('texts'), list):
+            return apitess.errors.error(
+                400,
+                data=received,
+                message='"texts" must be a JSON array'), None
+        items = []
+        for item in received['texts']:
+            if isinstance(item, dict) and \
+                    isinstance(item.get('file_contents'), str):
+                items.append((item.get('metadata', {}),
+                              io.BytesIO(
+                                  item['file_contents'].encode('utf-8'))))
+            else:
+                items.append((item, None))
+        return None, items
+
+    @bp.route('/batch/', methods=['POST'])
+    def add_texts():
+        error_response, items = _batch_or_error()
+        if error_response:
+            return error_response
+
+        results = []
+        # (result, metadata, file location) of each file saved
+        saved = []
+        for index, (text, stream) in enumerate(items):
+            result = {'index': index}
+            results.append(result)
+            if stream is None:
+                result.update(
+                    status='rejected',
+                    message=('Each item must have "metadata" and '
+                             '"file_contents"'))
+                continue
+            if not isinstance(text, dict):
+                result.update(status='rejected',
+                              message='"metadata" must be a JSON object')
+                continue
+            error_response = _check_metadata(text)
+            if error_response:
+                result.update(status='rejected',
+                              message=error_response.get_json()['message'])
+                continue
+            try:
+                file_location, result['sha256'], _ = save_stream(
+                    stream, FILE_UPLOAD_DIR)
+            except UnicodeDecodeError:
+                result.update(
+                    status='rejected',
+                    message='The uploaded file is not encoded as UTF-8')
+                continue
+            saved.append((result, text, file_location))
+
+        # files identical to one already ingested, or to one earlier in the
+        # batch, are not ingested again
+        existing = find_texts_by_hash(flask.g.db,
+                                      {result['sha256']
+                                       for result, _, _ in saved})
+        for result, text, file_location in saved:
+            sha256 = result['sha256']
+            if sha256 in existing:
+                os.remove(file_location)
+                result.update(status='duplicate', object_id=existing[sha256])
+                continue
+            try:
+                object_id = _submit(text, file_location)
+            except Exception as e:
+                result.update(
+                    status='failed',
+                    message='Could not add to database: {}'.format(e))
+                continue
+            record_file(flask.g.db, sha256, object_id)
+            existing[sha256] = object_id
+            result.update(status='submitted', object_id=object_id)
+        if any(result.get('status') == 'submitted' for result in results):
+            invalidate('texts', 'languages', 'features', 'units', 'stopwords')
+        return flask.jsonify({'texts': results})
+
+    def _session_or_error(session_id):
+        session = UploadSession.find(UPLOAD_SESSION_DIR, session_id)
+        if session is None:
+            return apitess.errors.error(
+                404,
+                session_id=session_id,
+                message=('No upload session with the provided identifier '
+                         f'({session_id}) was found.')), None
+        return None, session
+
+    def _session_response(session, status_code=200):
+        response = flask.jsonify(session.describe())
+        response.status_code = status_code
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+
+    @bp.route('/uploads/', methods=['POST'])
+    def start_upload():
+        error_response, received = apitess.errors.check_body(flask.request)
+        if error_response:
+            return error_response
+        requireds = {'metadata', 'size'}
+        error_response = apitess.errors.check_requireds(received, requireds)
+        if error_response:
+            return error_response
+        size = received['size']
+        if not isinstance(size, int) or isinstance(size, bool) or size < 0:
+            return apitess.errors.error(
+                400,
+                data=received,
+                message='"size" must be a non-negative integer')
+        error_response = _check_metadata(received['metadata'])
+        if error_response:
+            return error_response
+
+        purge_sessions(
+            UPLOAD_SESSION_DIR,
+            flask.current_app.config.get('UPLOAD_SESSION_MAX_AGE', 86400))
+        session = UploadSession.create(UPLOAD_SESSION_DIR,
+                                       received['metadata'], size)
+        response = _session_response(session, 201)
+        response.headers['Location'] = flask.url_for(
+            'texts.upload_status',
+            session_id=session.session_id,
+            _external=True)
+        return response
+
+    @bp.route('/uploads/<session_id>/')
+    def upload_status(session_id):
+        error_response, session = _session_or_error(session_id)
+        if error_response:
+            return error_response
+        return _session_response(session)
+
+    @bp.route('/uploads/<session_id>/', methods=['PUT'])
+    def upload_range(session_id):
+        error_response, session = _session_or_error(session_id)
+        if error_response:
+            return error_response
+
+        content_range = flask.request.headers.get('Content-Range', '')
+        match = CONTENT_RANGE.fullmatch(content_range.strip())
+        if not match:
+            return apitess.errors.error(
+                400,
+                session_id=session_id,
+                message=('The Content-Range header must be of the form '
+                         '"bytes <first>-<last>/<size>"'))
+        start, end = int(match['start']), int(match['end'])
+        total = match['size']
+        if start > end or end >= session.size or \
+                (total != '*' and int(total) != session.size):
+            response = apitess.errors.error(
+                416,
+                session_id=session_id,
+                message=(f'Content-Range "{content_range}" does not fit '
+                         f'within the {session.size} bytes of the upload'))
+            response.headers['Content-Range'] = f'bytes */{session.size}'
+            return response
+
+        try:
+            session.write(start, flask.request.stream, end - start + 1)
+        except ValueError as e:
+            return apitess.errors.error(400, session_id=session_id,
+                                        message=str(e))
+        return _session_response(session)
+
+    @bp.route('/uploads/<session_id>/', methods=['DELETE'])
+    def cancel_upload(session_id):
+        error_response, session = _session_or_error(session_id)
+        if error_response:
+            return error_response
+        session.discard()
+        response = flask.Response()
+        response.status_code = 204
+        response.status = '204 No Content'
+        return response
+
+    @bp.route('/uploads/<session_id>/finalize/', methods=['POST'])
+    def finalize_upload(session_id):
+        error_response, session = _session_or_error(session_id)
+        if error_response:
+            return error_response
+        if not session.is_complete():
+            return apitess.errors.error(
+                409,
+                session_id=session_id,
+                received=session.received(),
+                message='Not every byte of the upload has been received')
+
+        text = session.metadata
+        file_location = session.finish(FILE_UPLOAD_DIR)
+        try:
+            sha256 = check_file(file_location)
+        except UnicodeDecodeError:
+            os.remove(file_location)
+            return apitess.errors.error(
+                400,
+                session_id=session_id,
+                data=text,
+                message='The uploaded file is not encoded as UTF-8')
+
+        response = _ingest(text, file_location, {'metadata': text})
+        if response.status_code == 201:
+            record_file(flask.g.db, sha256, text['object_id'])
+            response.headers['X-Tesserae-File-SHA256'] = sha256
+        return response
+
     @bp.route('/<object_id>/', methods=['PATCH'])
     def update_text(object_id):
         error_message = apitess.errors.check_object_id(object_id)
@@ -159,7 +799,8 @@ if os.environ.get('ADMIN_INSTANCE') == 'true':
         received = flask.request.get_json()
         found = flask.g.db.find(tesserae.db.entities.Text.collection,
                                 _id=ObjectId(object_id))
-        if not found:
+        # a text being deleted must not be put back in the search index
+        if not found or is_hidden(flask.g.db, ObjectId(object_id)):
             return apitess.errors.error(
                 404,
                 object_id=object_id,
@@ -182,6 +823,8 @@ if os.environ.get('ADMIN_INSTANCE') == 'true':
                 data=received,
                 message=('Unexpected number of updates: '
                          f'{updated.matched_count}'))
+        invalidate('texts', f'text:{object_id}', 'languages')
+        get_text_index().add(fix_id(found.json_encode()))
         return get_text(object_id)
 
     @bp.route('/<object_id>/', methods=['DELETE'])
@@ -197,8 +840,38 @@ if os.environ.get('ADMIN_INSTANCE') == 'true':
                 object_id=object_id,
                 message=(f'No text with the provided identifier ({object_id}) '
                          'was found in the database.'))
-        remove_text(flask.g.db, found[0])
-        response = flask.Response()
-        response.status_code = 204
-        response.status = '204 No Content'
+        # the text is hidden from now on; the deletion itself happens in the
+        # background (see apitess.deletions)
+        job = submit_deletion(flask.g.db, ObjectId(object_id))
+        forget_text(flask.g.db, object_id)
+        invalidate('texts', f'text:{object_id}', 'languages', 'features',
+                   'units', 'stopwords')
+        get_text_index().remove(object_id)
+        response = flask.jsonify(deletion_json(job))
+        response.status_code = 202
+        response.headers['Location'] = flask.url_for(
+            'texts.deletion_status',
+            deletion_id=str(job['_id']),
+            _external=True)
+        return response
+
+    @bp.route('/deletions/<deletion_id>/')
+    def deletion_status(deletion_id):
+        if not ObjectId.is_valid(deletion_id):
+            return apitess.errors.error(
+                400,
+                deletion_id=deletion_id,
+                message=('Provided identifier ({}) is malformed.'.format(
+                    deletion_id)))
+        job = find_deletion(flask.g.db, ObjectId(deletion_id))
+        if job is None:
+            return apitess.errors.error(
+                404,
+                deletion_id=deletion_id,
+                message=('No deletion with the provided identifier '
+                         f'({deletion_id}) was found.'))
+        status = deletion_json(job)
+        response = flask.jsonify(status)
+        if status['status'] in PENDING:
+            response.headers['Cache-Control'] = 'no-store'
         return response
@@ -5,6 +5,8 @@ from bson.objectid import ObjectId
 import flask
 from flask_cors import cross_origin
 
+from apitess.cache import cached
+from apitess.deletions import hidden_text_ids
 import apitess.utils
 import tesserae
 
@@ -14,6 +16,7 @@ bp = flask.Blueprint('units', __name__, url_prefix='/units')
 
 @bp.route('/')
 @cross_origin()
+@cached('units')
 def query_units():
     """Consult database for unit information"""
     if len(flask.request.args) == 0:
@@ -37,6 +40,8 @@ def query_units():
         if fails:
             return apitess.errors.bad_object_ids(fails, flask.request.args)
         filters['_id'] = oids
+    # units of texts being deleted are not served
+    hidden = hidden_text_ids(flask.g.db)
     results = [{
             "object_id": str(r.id),
             "index": r.index,
@@ -47,5 +52,5 @@ def query_units():
             "unit_type": r.unit_type,
         } for r in flask.g.db.find(
         tesserae.db.entities.Unit.collection,
-        **filters)]
+        **filters) if r.text not in hidden]
     return flask.jsonify(units=results)
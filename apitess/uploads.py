@@ -0,0 +1,302 @@
+"""Writing uploaded .tess files to disk without holding them in memory
+
+Files can be sent whole, in one request, or in byte ranges spread over an
+upload session, which lets an interrupted upload resume where it stopped.
+The hash of every uploaded file is recorded with the text made from it, so
+that uploading the same file again can be recognized.
+"""
+import codecs
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+
+from bson.objectid import ObjectId
+
+import tesserae.db.entities
+from tesserae.db.entities.text import TextStatus
+
+# bytes read from an upload at a time
+CHUNK_SIZE = 64 * 1024
+# maps the SHA-256 hash of an uploaded file to the text made from it
+FILES_COLLECTION = 'text_files'
+
+
+def _checked_chunks(stream, digest, chunk_size):
+    """Yield the chunks of `stream`, hashing each and checking it is UTF-8
+
+    Raises
+    ------
+    UnicodeDecodeError
+        once the bytes read so far cannot be UTF-8
+    """
+    # validates without keeping more than a partial character between chunks
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        decoder.decode(chunk)
+        digest.update(chunk)
+        yield chunk
+    decoder.decode(b'', final=True)
+
+
+def save_stream(stream, directory, chunk_size=CHUNK_SIZE):
+    """Copy `stream` into a new .tess file in `directory`
+
+    The upload is read `chunk_size` bytes at a time; each chunk is hashed and
+    checked to be UTF-8 before it is written, so memory use does not grow
+    with the size of the file.
+
+    Parameters
+    ----------
+    stream : file-like
+        binary stream positioned at the start of the file contents
+    directory : str
+        where to save the file
+    chunk_size : int
+        number of bytes read at a time
+
+    Returns
+    -------
+    file_location : str
+        path of the saved file
+    sha256 : str
+        hex digest of the file contents
+    size : int
+        number of bytes saved
+
+    Raises
+    ------
+    UnicodeDecodeError
+        if the upload is not UTF-8; nothing is left on disk in that case
+    """
+    os.makedirs(os.path.abspath(directory), exist_ok=True)
+    file_location = os.path.join(directory, str(uuid.uuid4()) + '.tess')
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(file_location, 'wb') as ofh:
+            for chunk in _checked_chunks(stream, digest, chunk_size):
+                ofh.write(chunk)
+                size += len(chunk)
+    except BaseException:
+        os.remove(file_location)
+        raise
+    return file_location, digest.hexdigest(), size
+
+
+def check_file(file_location, chunk_size=CHUNK_SIZE):
+    """Hash the file at `file_location` and check that it is UTF-8
+
+    Like `save_stream`, the file is read `chunk_size` bytes at a time.
+
+    Returns
+    -------
+    sha256 : str
+        hex digest of the file contents
+
+    Raises
+    ------
+    UnicodeDecodeError
+        if the file is not UTF-8
+    """
+    digest = hashlib.sha256()
+    with open(file_location, 'rb') as ifh:
+        for _ in _checked_chunks(ifh, digest, chunk_size):
+            pass
+    return digest.hexdigest()
+
+
+class UploadSession:
+    """A file uploaded in byte ranges over several requests
+
+    Everything about a session is kept on disk, in a directory of its own,
+    so that any worker process can serve any of its requests.  The file is
+    preallocated at its full size and every range is written straight to its
+    place in it, so that no assembly is needed once the last range arrives.
+    A range counts as received once an empty marker file named after it has
+    been created, which happens only after all its bytes are written.
+
+    Parameters
+    ----------
+    directory : str
+        the directory holding this session
+    """
+    DATA = 'data.tess'
+    INFO = 'session.json'
+    RANGES = 'ranges'
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, self.INFO), encoding='utf-8') as ifh:
+            info = json.load(ifh)
+        self.session_id = os.path.basename(directory)
+        self.metadata = info['metadata']
+        self.size = info['size']
+
+    @classmethod
+    def create(cls, sessions_dir, metadata, size):
+        """Start a session for a file of `size` bytes"""
+        directory = os.path.join(sessions_dir, uuid.uuid4().hex)
+        os.makedirs(os.path.join(directory, cls.RANGES))
+        with open(os.path.join(directory, cls.DATA), 'wb') as ofh:
+            ofh.truncate(size)
+        with open(os.path.join(directory, cls.INFO), 'w',
+                  encoding='utf-8') as ofh:
+            json.dump({'metadata': metadata, 'size': size}, ofh)
+        return cls(directory)
+
+    @classmethod
+    def find(cls, sessions_dir, session_id):
+        """Open an existing session, or return None if there is none"""
+        # session_id comes from the URL; only names made by create are valid
+        try:
+            if uuid.UUID(hex=session_id).hex != session_id:
+                return None
+        except ValueError:
+            return None
+        try:
+            return cls(os.path.join(sessions_dir, session_id))
+        except FileNotFoundError:
+            return None
+
+    def write(self, start, stream, length, chunk_size=CHUNK_SIZE):
+        """Store `length` bytes read from `stream` at offset `start`
+
+        Raises
+        ------
+        ValueError
+            if `stream` does not hold exactly `length` bytes; the range is
+            not marked as received in that case
+        """
+        written = 0
+        with open(os.path.join(self.directory, self.DATA), 'r+b') as ofh:
+            ofh.seek(start)
+            while written < length:
+                chunk = stream.read(min(chunk_size, length - written))
+                if not chunk:
+                    break
+                ofh.write(chunk)
+                written += len(chunk)
+        if written < length:
+            raise ValueError(
+                f'Expected {length} bytes but received only {written}')
+        if stream.read(1):
+            raise ValueError(f'Received more than the {length} bytes expected')
+        end = start + length - 1
+        open(os.path.join(self.directory, self.RANGES, f'{start}-{end}'),
+             'w').close()
+
+    def received(self):
+        """The byte ranges received so far, merged and in order
+
+        Returns
+        -------
+        list of [int, int]
+            first and last offsets, inclusive, of each received range
+        """
+        ranges = sorted(
+            [int(offset) for offset in name.split('-')]
+            for name in os.listdir(os.path.join(self.directory, self.RANGES)))
+        merged = []
+        for start, end in ranges:
+            if merged and start <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        return merged
+
+    def is_complete(self):
+        return self.size == 0 or self.received() == [[0, self.size - 1]]
+
+    def finish(self, upload_dir):
+        """Move the completed file into `upload_dir` and end the session
+
+        Returns
+        -------
+        str
+            path of the file in `upload_dir`
+        """
+        os.makedirs(os.path.abspath(upload_dir), exist_ok=True)
+        file_location = os.path.join(upload_dir, str(uuid.uuid4()) + '.tess')
+        os.replace(os.path.join(self.directory, self.DATA), file_location)
+        self.discard()
+        return file_location
+
+    def discard(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def last_active(self):
+        """When a range was last received, as a POSIX timestamp"""
+        return os.path.getmtime(os.path.join(self.directory, self.RANGES))
+
+    def describe(self):
+        return {
+            'session_id': self.session_id,
+            'metadata': self.metadata,
+            'size': self.size,
+            'received': self.received(),
+        }
+
+
+def purge_sessions(sessions_dir, max_age):
+    """Discard upload sessions that have received nothing in `max_age` s"""
+    if not os.path.isdir(sessions_dir):
+        return
+    now = time.time()
+    for session_id in os.listdir(sessions_dir):
+        session = UploadSession.find(sessions_dir, session_id)
+        if session is not None and now - session.last_active() > max_age:
+            session.discard()
+
+
+def record_file(db, sha256, text_id):
+    """Remember that the text `text_id` was made from the file `sha256`"""
+    db.connection[FILES_COLLECTION].replace_one(
+        {'_id': sha256}, {
+            '_id': sha256,
+            'text_id': ObjectId(str(text_id))
+        },
+        upsert=True)
+
+
+def forget_text(db, text_id):
+    """Stop matching uploads against the file of a removed text"""
+    db.connection[FILES_COLLECTION].delete_many(
+        {'text_id': ObjectId(str(text_id))})
+
+
+def find_texts_by_hash(db, hashes):
+    """Find the texts made from files with the given hashes
+
+    Texts whose ingestion failed are left out, so that their files can be
+    ingested again.
+
+    Parameters
+    ----------
+    hashes : iterable of str
+        SHA-256 hashes of uploaded files
+
+    Returns
+    -------
+    dict
+        maps each hash with a text to the text's object_id, as a str
+    """
+    files = list(db.connection[FILES_COLLECTION].find(
+        {'_id': {'$in': list(hashes)}}))
+    if not files:
+        return {}
+    texts = db.connection[tesserae.db.entities.Text.collection].find(
+        {'_id': {'$in': [f['text_id'] for f in files]}},
+        projection={'ingestion_status': True})
+    live = {
+        text['_id']
+        for text in texts
+        if not text.get('ingestion_status') or
+        text['ingestion_status'][0] != TextStatus.FAILED
+    }
+    return {f['_id']: str(f['text_id']) for f in files if f['text_id'] in live}
@@ -1,11 +1,17 @@
 """Utility function shared by multiple endpoints"""
+import base64
+import collections
+import json
+import threading
 import urllib.parse
 
 import flask
 import tesserae.db.entities
+import tesserae.utils.search
 from bson.objectid import ObjectId
 
 import apitess.errors
+import apitess.events
 
 
 def fix_id(entity_json):
@@ -43,6 +49,76 @@ def make_object_ids(ids):
     return results, failures
 
 
+# Fields of a Match document that are served to API users
+MATCH_PROJECTION = {
+    '_id': True,
+    'source_tag': True,
+    'target_tag': True,
+    'matched_features': True,
+    'score': True,
+    'source_snippet': True,
+    'target_snippet': True,
+    'highlight': True,
+}
+
+
+def match_json(match_doc):
+    """Converts a raw Match document into the JSON shape served for parallels
+
+    Parameters
+    ----------
+    match_doc : dict
+        a document from the Match collection, projected with MATCH_PROJECTION
+
+    Returns
+    -------
+    dict
+        the parallel, with its database identifier stored as "object_id"
+    """
+    match_doc['object_id'] = str(match_doc['_id'])
+    del match_doc['_id']
+    return match_doc
+
+
+# Maximum number of searches whose summaries are remembered
+SUMMARY_CACHE_SIZE = 1024
+_summary_cache = collections.OrderedDict()
+_summary_lock = threading.Lock()
+
+
+def get_search_summary(db, search_id):
+    """Retrieves the max_score and total_count of a completed search
+
+    Both values require a pass over the search's parallels, and neither can
+    change once the search is done, so they are remembered for the
+    SUMMARY_CACHE_SIZE most recently requested searches.
+
+    Parameters
+    ----------
+    db : tesserae.db.TessMongoConnection
+    search_id : ObjectId
+        database identifier of a Search whose status is DONE
+
+    Returns
+    -------
+    max_score : float
+        highest score among the search's parallels
+    total_count : int
+        number of parallels found by the search
+    """
+    with _summary_lock:
+        if search_id in _summary_cache:
+            _summary_cache.move_to_end(search_id)
+            return _summary_cache[search_id]
+    summary = (tesserae.utils.search.get_max_score(db, search_id),
+               tesserae.utils.search.get_results_count(db, search_id))
+    with _summary_lock:
+        _summary_cache[search_id] = summary
+        while len(_summary_cache) > SUMMARY_CACHE_SIZE:
+            _summary_cache.popitem(last=False)
+    return summary
+
+
 def parse_commas(in_str):
     if ',' in in_str:
         return in_str.split(',')
@@ -56,6 +132,20 @@ def parse_works_arg(works):
     return oids, fails
 
 
+def _status_json(status):
+    return {
+        'results_id': status.results_id,
+        'status': status.status,
+        'message': status.msg,
+        'progress': status.progress,
+    }
+
+
+def _is_finished(status_json):
+    return status_json['status'] in (tesserae.db.entities.Search.DONE,
+                                     tesserae.db.entities.Search.FAILED)
+
+
 def common_retrieve_status(db_find, results_id, search_type):
     results_status_found = db_find(tesserae.db.entities.Search.collection,
                                    results_id=results_id,
@@ -65,27 +155,72 @@ def common_retrieve_status(db_find, results_id, search_type):
         response.status_code = 404
         return response
     status = results_status_found[0]
-    response = flask.jsonify(results_id=status.results_id,
-                             status=status.status,
-                             message=status.msg,
-                             progress=status.progress)
+    response = flask.jsonify(_status_json(status))
     if status.status != tesserae.db.entities.Search.DONE and \
             status.status != tesserae.db.entities.Search.FAILED:
         response.headers['Cache-Control'] = 'no-store'
-    status.update_last_queried()
-    flask.g.db.update(status)
+    flask.g.last_queried.touch(status)
     return response
 
 
-def get_page_options_or_error(url_query_params):
-    if len(url_query_params) == 0:
-        return tesserae.utils.search.PageOptions(), None
+def fetch_search_statuses(db, keys):
+    """Retrieves the status of many searches with a single query
 
-    requireds = {'sort_by', 'sort_order', 'per_page', 'page_number'}
-    potential_error = apitess.errors.check_requireds(url_query_params,
-                                                     requireds)
-    if potential_error:
-        return None, potential_error
+    Parameters
+    ----------
+    db : tesserae.db.TessMongoConnection
+    keys : list of (str, str)
+        results_id and search_type of each search
+
+    Returns
+    -------
+    dict
+        mapping from each key found in the database to the JSON object that
+        the status endpoints would serve for it
+    """
+    found = db.find(tesserae.db.entities.Search.collection,
+                    results_id=[results_id for results_id, _ in keys])
+    wanted = set(keys)
+    return {(s.results_id, s.search_type): _status_json(s)
+            for s in found if (s.results_id, s.search_type) in wanted}
+
+
+def common_stream_status(results_id, search_type):
+    """Serves server-sent events for every change in a search's status
+
+    The stream ends once the search is done or has failed.
+    """
+    results_status_found = flask.g.db.find(
+        tesserae.db.entities.Search.collection,
+        results_id=results_id,
+        search_type=search_type)
+    if not results_status_found:
+        response = flask.Response('Could not find results_id')
+        response.status_code = 404
+        return response
+    flask.g.last_queried.touch(results_status_found[0])
+    response = flask.Response(
+        apitess.events.event_stream(flask.g.status_watcher,
+                                    (results_id, search_type), _is_finished),
+        mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-store'
+    # keep reverse proxies from holding events back
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def _get_ordering_or_error(url_query_params):
+    """Validates the "sort_by", "sort_order", and "per_page" URL query values
+
+    Returns
+    -------
+    ordering : tuple of (str, str, int) or None
+        sort_by, sort_order, and per_page, if all values were valid; otherwise
+        None
+    error_response
+        If any value was invalid, this will be set to an error response;
+        otherwise, this will be set to None
+    """
     allowed_sort_by = {'score', 'source_tag', 'target_tag', 'matched_features'}
     sort_by = url_query_params.get('sort_by')
     if sort_by not in allowed_sort_by:
@@ -119,6 +254,22 @@ def get_page_options_or_error(url_query_params):
             data=url_query_params,
             message=(f'Specified "per_page" value ({raw_per_page}) is not '
                      'supported. Only positive integers are supported.'))
+    return (sort_by, sort_order, per_page), None
+
+
+def get_page_options_or_error(url_query_params):
+    if len(url_query_params) == 0:
+        return tesserae.utils.search.PageOptions(), None
+
+    requireds = {'sort_by', 'sort_order', 'per_page', 'page_number'}
+    potential_error = apitess.errors.check_requireds(url_query_params,
+                                                     requireds)
+    if potential_error:
+        return None, potential_error
+    ordering, potential_error = _get_ordering_or_error(url_query_params)
+    if potential_error:
+        return None, potential_error
+    sort_by, sort_order, per_page = ordering
     try:
         raw_page_number = url_query_params.get('page_number')
         page_number = int(raw_page_number)
@@ -140,3 +291,258 @@ def get_page_options_or_error(url_query_params):
                                              sort_order=sort_order,
                                              per_page=per_page,
                                              page_number=page_number), None
+
+
+CursorOptions = collections.namedtuple(
+    'CursorOptions', ['sort_by', 'sort_order', 'per_page', 'last_key',
+                      'last_id'])
+
+
+def encode_cursor(sort_by, sort_order, last_key, last_id):
+    """Builds an opaque token marking a position in sorted results
+
+    Parameters
+    ----------
+    sort_by : str
+        the "sort_by" value of the page ending at this position
+    sort_order : str
+        the "sort_order" value of the page ending at this position
+    last_key
+        the sort key of the last parallel on the page
+    last_id : str
+        the object_id of the last parallel on the page
+
+    Returns
+    -------
+    str
+        URL-safe token that can be passed back as the "cursor" query value
+    """
+    payload = json.dumps([sort_by, sort_order, last_key, last_id],
+                         separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(token):
+    """Unpacks a token built by encode_cursor
+
+    Returns
+    -------
+    tuple of (str, str, object, str) or None
+        sort_by, sort_order, last sort key, and last object_id; None if the
+        token is malformed
+    """
+    try:
+        payload = json.loads(
+            base64.urlsafe_b64decode(token.encode('ascii')).decode('utf-8'))
+    except (ValueError, UnicodeError):
+        return None
+    if not isinstance(payload, list) or len(payload) != 4:
+        return None
+    if not ObjectId.is_valid(payload[3]):
+        return None
+    return tuple(payload)
+
+
+def get_cursor_options_or_error(url_query_params):
+    """Parses keyset pagination options from URL query values
+
+    Keyset pagination is requested by passing a "cursor" value along with
+    "sort_by", "sort_order", and "per_page"; the first page is requested with
+    an empty cursor, and every later page with the cursor returned by the
+    previous page.
+
+    Returns
+    -------
+    cursor_options : CursorOptions or None
+        parsed options
+    error_response
+        If there was a problem with the URL query values, this will be set to
+        an error response; otherwise, this will be set to None
+    """
+    requireds = {'sort_by', 'sort_order', 'per_page', 'cursor'}
+    potential_error = apitess.errors.check_requireds(url_query_params,
+                                                     requireds)
+    if potential_error:
+        return None, potential_error
+    if 'page_number' in url_query_params:
+        return None, apitess.errors.error(
+            400,
+            data=url_query_params,
+            message=('"page_number" and "cursor" cannot be used together.'))
+    ordering, potential_error = _get_ordering_or_error(url_query_params)
+    if potential_error:
+        return None, potential_error
+    sort_by, sort_order, per_page = ordering
+    token = url_query_params.get('cursor')
+    if not token:
+        return CursorOptions(sort_by, sort_order, per_page, None, None), None
+    decoded = decode_cursor(token)
+    if decoded is None:
+        return None, apitess.errors.error(
+            400,
+            data=url_query_params,
+            message=f'Specified "cursor" value ({token}) is malformed.')
+    if decoded[:2] != (sort_by, sort_order):
+        return None, apitess.errors.error(
+            400,
+            data=url_query_params,
+            message=('Specified "cursor" value was issued for a different '
+                     '"sort_by" and "sort_order" combination.'))
+    return CursorOptions(sort_by, sort_order, per_page, decoded[2],
+                         decoded[3]), None
+
+
+def _matched_features_key(match_doc):
+    return ' '.join(match_doc['matched_features'])
+
+
+def get_keyset_results(db, search_id, cursor_options):
+    """Retrieves the page of parallels following a cursor position
+
+    Instead of skipping over earlier pages, the query filters for parallels
+    sorting after the cursor position, so every page costs the same no matter
+    how deep into the results it lies.  Ties in the sort key are broken by
+    the parallel's _id.
+
+    The constant cost relies on the (search_id, sort field, _id) indexes made
+    by `apitess.database.ensure_indexes`.  Sorting by matched_features is the
+    exception: its key is computed from the array for every parallel of the
+    search, so each page costs as much as sorting all of them.
+
+    Parameters
+    ----------
+    db : tesserae.db.TessMongoConnection
+    search_id : ObjectId
+        database identifier of the Search whose parallels are retrieved
+    cursor_options : CursorOptions
+
+    Returns
+    -------
+    parallels : list of dict
+        the parallels on the page
+    next_cursor : str or None
+        token for the following page; None if there are no more parallels
+    """
+    sort_by = cursor_options.sort_by
+    direction = 1 if cursor_options.sort_order == 'ascending' else -1
+    pipeline = [{'$match': {'search_id': search_id}}]
+    if sort_by == 'matched_features':
+        # arrays cannot be compared against a single position, so the
+        # features are joined into a string key first
+        sort_field = 'sort_key'
+        pipeline.append({
+            '$addFields': {
+                sort_field: {
+                    '$reduce': {
+                        'input': '$matched_features',
+                        'initialValue': '',
+                        'in': {
+                            '$cond': [{
+                                '$eq': ['$$value', '']
+                            }, '$$this', {
+                                '$concat': ['$$value', ' ', '$$this']
+                            }]
+                        }
+                    }
+                }
+            }
+        })
+    else:
+        sort_field = sort_by
+    if cursor_options.last_id is not None:
+        comparison = '$gt' if direction == 1 else '$lt'
+        last_key = cursor_options.last_key
+        pipeline.append({
+            '$match': {
+                '$or': [{
+                    sort_field: {
+                        comparison: last_key
+                    }
+                }, {
+                    sort_field: last_key,
+                    '_id': {
+                        comparison: ObjectId(cursor_options.last_id)
+                    }
+                }]
+            }
+        })
+    pipeline.extend([
+        {
+            '$sort': {
+                sort_field: direction,
+                '_id': direction
+            }
+        },
+        {
+            '$limit': cursor_options.per_page
+        },
+        {
+            '$project': MATCH_PROJECTION
+        },
+    ])
+    parallels = [
+        match_json(match_doc) for match_doc in db.connection[
+            tesserae.db.entities.Match.collection].aggregate(pipeline)
+    ]
+    next_cursor = None
+    if len(parallels) == cursor_options.per_page:
+        last = parallels[-1]
+        if sort_by == 'matched_features':
+            last_key = _matched_features_key(last)
+        else:
+            last_key = last[sort_by]
+        next_cursor = encode_cursor(sort_by, cursor_options.sort_order,
+                                    last_key, last['object_id'])
+    return parallels, next_cursor
+
+
+def get_keyset_multiresults(db, multitext_id, search_id, cursor_options):
+    """Retrieves the page of multitext results following a cursor position
+
+    Pages run over the parallels of the original Tesserae search (see
+    get_keyset_results); each parallel is paired with the multitext
+    cross-references found for it.
+
+    Parameters
+    ----------
+    db : tesserae.db.TessMongoConnection
+    multitext_id : ObjectId
+        database identifier of the multitext Search
+    search_id : ObjectId
+        database identifier of the Search the multitext search is based on
+    cursor_options : CursorOptions
+
+    Returns
+    -------
+    multiresults : list of dict
+        the multitext results on the page
+    next_cursor : str or None
+        token for the following page; None if there are no more results
+    """
+    parallels, next_cursor = get_keyset_results(db, search_id,
+                                                cursor_options)
+    cross_refs = collections.defaultdict(list)
+    found = db.connection[tesserae.db.entities.MultiResult.collection].find(
+        {
+            'search_id': multitext_id,
+            'match_id': {
+                '$in': [ObjectId(p['object_id']) for p in parallels]
+            }
+        },
+        projection={
+            '_id': False,
+            'match_id': True,
+            'bigram': True,
+            'units': True
+        })
+    for multiresult in found:
+        for unit in multiresult['units']:
+            unit['unit_id'] = str(unit['unit_id'])
+        cross_refs[str(multiresult['match_id'])].append({
+            'bigram': multiresult['bigram'],
+            'units': multiresult['units']
+        })
+    return [{
+        'match': p,
+        'cross-ref': cross_refs[p['object_id']]
+    } for p in parallels], next_cursor
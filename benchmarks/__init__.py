@@ -0,0 +1,6 @@
+"""Benchmarks for the TIS API
+
+bench_json compares JSON serializers on a page of search results; corpus
+generates synthetic texts; api ingests a synthetic corpus and times the key
+endpoints against it; compare reports differences between two runs of api.
+"""
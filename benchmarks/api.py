@@ -0,0 +1,257 @@
+"""Time the key endpoints of the TIS API against a synthetic corpus
+
+The corpus is ingested into its own database the same way the test fixtures
+are, then each endpoint is requested through the flask test client.  Results
+are written as JSON, so that runs made at different commits can be compared
+with benchmarks.compare.
+
+Usage:
+    python -m benchmarks.api [--lines N] [--repeat N] [--output PATH]
+"""
+import argparse
+import datetime
+import json
+import statistics
+import subprocess
+import tempfile
+import time
+
+import flask
+
+import apitess
+from benchmarks.corpus import generate_corpus
+from tesserae.db.entities import Search, Text
+from tesserae.utils import ingest_text
+from tesserae.utils.coordinate import JobQueue
+from tesserae.utils.delete import obliterate
+from tesserae.utils.ingest import IngestQueue
+
+PER_PAGE = 100
+# pages of search results, counted from the first, at which paging is timed
+PAGE_DEPTHS = (0, 10, 100)
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'],
+                              capture_output=True,
+                              text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _summarize(samples):
+    return {
+        'samples': samples,
+        'min': min(samples),
+        'median': statistics.median(samples),
+        'mean': statistics.mean(samples),
+        'max': max(samples),
+    }
+
+
+def _get_ok(client, url):
+    response = client.get(url)
+    if response.status_code != 200:
+        raise RuntimeError(f'GET {url} gave {response.status_code}: '
+                           f'{response.get_data(as_text=True)[:500]}')
+    return response
+
+
+def _measure(results, name, func, repeat):
+    samples = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        func(i)
+        samples.append(time.perf_counter() - start)
+    results[name] = _summarize(samples)
+    print(f'{name:>32}: median {results[name]["median"] * 1000:10.2f} ms')
+
+
+def _run_search(client, source, target, stopwords):
+    """Submit a search and wait until it is done; return its results URL"""
+    response = client.post('/parallels/',
+                           json={
+                               'source': {
+                                   'object_id': source,
+                                   'units': 'line'
+                               },
+                               'target': {
+                                   'object_id': target,
+                                   'units': 'line'
+                               },
+                               'method': {
+                                   'name': 'original',
+                                   'feature': 'lemmata',
+                                   'stopwords': stopwords,
+                                   'score_basis': 'lemmata',
+                                   'freq_basis': 'corpus',
+                                   'max_distance': 10,
+                                   'distance_basis': 'frequency'
+                               }
+                           })
+    if response.status_code not in (201, 303):
+        raise RuntimeError(f'Search submission gave {response.status_code}: '
+                           f'{response.get_data(as_text=True)[:500]}')
+    # cached results are given with a query string for their first page
+    results_url = response.headers['Location'].split('?')[0]
+    while True:
+        response = client.get(results_url + 'status/')
+        if response.status_code == 200:
+            data = response.get_json()
+            if data['status'] == Search.DONE:
+                return results_url
+            if data['status'] == Search.FAILED:
+                raise RuntimeError(f'Search failed: {data["message"]}')
+        time.sleep(0.05)
+
+
+def run(args):
+    """Ingest a synthetic corpus and time the endpoints
+
+    Returns
+    -------
+    dict
+        timings in seconds, keyed by benchmark name
+    """
+    config = {
+        'MONGO_HOSTNAME': args.host,
+        'MONGO_PORT': args.port,
+        'MONGO_USER': args.user,
+        'MONGO_PASSWORD': args.password,
+        'DB_NAME': args.db_name,
+        # time the work of the endpoints, not of the response cache
+        'RESPONSE_CACHE': None,
+    }
+    cred = {
+        'host': args.host,
+        'port': args.port,
+        'user': args.user,
+        'password': args.password,
+        'db': args.db_name,
+    }
+    results = {}
+    jobqueue = JobQueue(1, cred)
+    ingest_queue = IngestQueue(cred)
+    try:
+        app = apitess.create_app(jobqueue, ingest_queue, config)
+        client = app.test_client()
+        with app.test_request_context(), \
+                tempfile.TemporaryDirectory() as corpus_dir:
+            app.preprocess_request()
+            db = flask.g.db
+            obliterate(db)
+            texts = generate_corpus(corpus_dir, args.texts_per_language,
+                                    args.lines, args.seed)
+            samples = []
+            for metadata in texts:
+                start = time.perf_counter()
+                ingest_text(db, Text.json_decode(metadata))
+                samples.append(time.perf_counter() - start)
+            results['ingest'] = _summarize(samples)
+            print(f'{"ingest":>32}: median '
+                  f'{results["ingest"]["median"] * 1000:10.2f} ms')
+            ids = {
+                language: [
+                    str(t.id) for t in db.find(Text.collection,
+                                               language=language)
+                ]
+                for language in ('latin', 'greek')
+            }
+
+        latin = ids['latin']
+        _measure(results, 'texts_catalog',
+                 lambda i: _get_ok(client, '/texts/'), args.repeat)
+        _measure(
+            results, 'units_whole_work', lambda i: _get_ok(
+                client, f'/units/?unit_type=line&works={latin[0]}'),
+            args.repeat)
+        _measure(
+            results, 'stopwords_by_works', lambda i: _get_ok(
+                client, f'/stopwords/?works={",".join(latin)}&list_size=20'),
+            args.repeat)
+
+        stopwords = _get_ok(
+            client, f'/stopwords/?works={",".join(latin)}&list_size='
+            f'{10 + args.repeat}').get_json()['stopwords']
+        results_urls = []
+        # each search uses a different number of stopwords, so that no
+        # search is answered from the cache of a previous one
+        _measure(
+            results, 'search_submit_to_done',
+            lambda i: results_urls.append(
+                _run_search(client, latin[0], latin[-1], stopwords[:10 + i])),
+            args.repeat)
+
+        results_url = results_urls[0]
+        base_query = (f'{results_url}?sort_by=score&sort_order=descending'
+                      f'&per_page={PER_PAGE}')
+        total_count = _get_ok(client, base_query +
+                              '&page_number=0').get_json()['total_count']
+        for depth in PAGE_DEPTHS:
+            if depth * PER_PAGE >= total_count:
+                continue
+            _measure(
+                results, f'results_page_{depth}', lambda i: _get_ok(
+                    client, f'{base_query}&page_number={depth}'), args.repeat)
+            cursor = ''
+            for _ in range(depth):
+                cursor = _get_ok(client, f'{base_query}&cursor={cursor}'
+                                 ).get_json()['cursor']
+            _measure(
+                results, f'results_cursor_{depth}', lambda i: _get_ok(
+                    client, f'{base_query}&cursor={cursor}'), args.repeat)
+
+        if not args.keep:
+            with app.test_request_context():
+                app.preprocess_request()
+                obliterate(flask.g.db)
+    finally:
+        jobqueue.cleanup()
+        ingest_queue.cleanup()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=27017)
+    parser.add_argument('--user', default=None)
+    parser.add_argument('--password', default=None)
+    parser.add_argument('--db-name', default='bench_apitess',
+                        help='database to use; its contents are deleted')
+    parser.add_argument('--texts-per-language', type=int, default=2)
+    parser.add_argument('--lines', type=int, default=2000,
+                        help='number of lines in each synthetic text')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--keep', action='store_true',
+                        help='leave the benchmark database in place')
+    parser.add_argument('--output', default=None,
+                        help='where to write the results; defaults to '
+                        'benchmark-<commit>.json')
+    args = parser.parse_args()
+
+    commit = _git_commit()
+    results = run(args)
+    output = args.output or f'benchmark-{(commit or "unknown")[:12]}.json'
+    with open(output, 'w', encoding='utf-8') as ofh:
+        json.dump(
+            {
+                'commit': commit,
+                'created': datetime.datetime.now(
+                    datetime.timezone.utc).isoformat(),
+                'parameters': {
+                    k: v
+                    for k, v in vars(args).items() if k != 'password'
+                },
+                'results': results,
+            },
+            ofh,
+            indent=2)
+    print(f'Wrote {output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""Compare JSON providers on a representative page of search results
+
+Usage:
+    python -m benchmarks.bench_json [--per-page N] [--repeat N]
+"""
+import argparse
+import random
+import timeit
+
+from bson.objectid import ObjectId
+import flask
+from flask.json.provider import DefaultJSONProvider
+
+from apitess.jsonprovider import FastJSONProvider, orjson
+
+
+def make_results_page(per_page, seed=0):
+    """Build a page shaped like the response of /parallels/<uuid>/"""
+    rng = random.Random(seed)
+    words = ['arma', 'virum', 'cano', 'troiae', 'qui', 'primus', 'ab', 'oris',
+             'italiam', 'fato', 'profugus', 'laviniaque', 'venit', 'litora']
+
+    def snippet():
+        return ' '.join(rng.choice(words) for _ in range(12))
+
+    parallels = []
+    for _ in range(per_page):
+        parallels.append({
+            'object_id': ObjectId(),
+            'source_tag': f'vergil aeneid {rng.randint(1, 12)}.'
+                          f'{rng.randint(1, 900)}',
+            'target_tag': f'lucan bellum civile {rng.randint(1, 10)}.'
+                          f'{rng.randint(1, 900)}',
+            'matched_features': rng.sample(words, 2),
+            'score': rng.uniform(3, 12),
+            'source_snippet': snippet(),
+            'target_snippet': snippet(),
+            'highlight': [[[rng.randint(0, 11)], [rng.randint(0, 11)]]],
+        })
+    return {
+        'data': {'source': {}, 'target': {}, 'method': {}},
+        'max_score': 12.0,
+        'total_count': per_page * 100,
+        'parallels': parallels,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--per-page', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    page = make_results_page(args.per_page)
+    providers = [('stdlib', DefaultJSONProvider)]
+    if orjson is not None:
+        providers.append(('orjson', FastJSONProvider))
+    else:
+        print('orjson is not installed; only the stdlib is measured')
+
+    for name, provider_class in providers:
+        app = flask.Flask(__name__)
+        app.json = provider_class(app)
+        # ObjectIds need the same handling in both providers
+        app.json.default = FastJSONProvider.default
+        with app.app_context():
+            seconds = min(
+                timeit.repeat(lambda: flask.jsonify(page).get_data(),
+                              number=args.repeat, repeat=3)) / args.repeat
+        print(f'{name:>8}: {seconds * 1000:8.2f} ms per page of '
+              f'{args.per_page} parallels')
+
+
+if __name__ == '__main__':
+    main()
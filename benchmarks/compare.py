@@ -0,0 +1,59 @@
+"""Compare two runs of benchmarks.api
+
+Usage:
+    python -m benchmarks.compare BASELINE.json CANDIDATE.json [--threshold F]
+"""
+import argparse
+import json
+
+
+def compare(baseline, candidate, threshold):
+    """Print the median timings of two runs side by side
+
+    Returns
+    -------
+    list of str
+        names of the benchmarks whose median grew by more than `threshold`
+        (a fraction of the baseline median)
+    """
+    print(f'{"benchmark":>32} {"baseline ms":>12} {"candidate ms":>12} '
+          f'{"change":>8}')
+    regressions = []
+    for name in sorted(set(baseline) | set(candidate)):
+        if name not in baseline or name not in candidate:
+            print(f'{name:>32} only in '
+                  f'{"baseline" if name in baseline else "candidate"}')
+            continue
+        before = baseline[name]['median']
+        after = candidate[name]['median']
+        change = (after - before) / before
+        flag = ''
+        if change > threshold:
+            regressions.append(name)
+            flag = '  slower'
+        print(f'{name:>32} {before * 1000:12.2f} {after * 1000:12.2f} '
+              f'{change:+8.1%}{flag}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='fractional slowdown reported as a regression')
+    args = parser.parse_args()
+
+    runs = []
+    for path in (args.baseline, args.candidate):
+        with open(path, encoding='utf-8') as ifh:
+            runs.append(json.load(ifh))
+    print(f'baseline: {runs[0]["commit"]}  candidate: {runs[1]["commit"]}')
+    regressions = compare(runs[0]['results'], runs[1]['results'],
+                          args.threshold)
+    if regressions:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""Generate synthetic Latin- and Greek-like corpora of configurable size
+
+Words are drawn from the vocabulary of the .tess files used by the tests,
+weighted by how often they occur there, so that the synthetic texts can be
+lemmatized and have a realistic spread of frequent and rare words.
+"""
+import collections
+from pathlib import Path
+import random
+import re
+
+TESTS_DIR = Path(__file__).resolve().parent.parent.joinpath('tests')
+SEED_FILES = {
+    'latin': ['ztest.aen.tess', 'ztest.phar.tess', 'mini.punica.tess'],
+    'greek': ['ztest.il.tess', 'ztest.gorg.tess', 'mini.ach.tess'],
+}
+TAG_PATTERN = re.compile(r'^<[^>]*>\s*')
+# words may contain combining diacritics, which \w does not match
+PUNCTUATION = '.,;:!?·;\'"()[]—'
+LINES_PER_BOOK = 1000
+
+
+def vocabulary(language):
+    """Count the words of the test texts in a language
+
+    Parameters
+    ----------
+    language : {'latin', 'greek'}
+
+    Returns
+    -------
+    words : list of str
+    weights : list of int
+        number of occurrences of each word
+    """
+    counts = collections.Counter()
+    for filename in SEED_FILES[language]:
+        with open(TESTS_DIR.joinpath(filename), encoding='utf-8') as ifh:
+            for line in ifh:
+                for token in TAG_PATTERN.sub('', line).split():
+                    word = token.strip(PUNCTUATION).lower()
+                    if word and not word.isdigit():
+                        counts[word] += 1
+    words, weights = zip(*counts.most_common())
+    return list(words), list(weights)
+
+
+def generate_text(path, language, lines, abbreviation, rng):
+    """Write a synthetic poem of `lines` lines to a .tess file
+
+    Lines are tagged "<abbreviation book.line>", and phrases end with
+    punctuation every few lines so that phrase units are formed.
+    """
+    words, weights = vocabulary(language)
+    with open(path, 'w', encoding='utf-8') as ofh:
+        for i in range(lines):
+            book, line = divmod(i, LINES_PER_BOOK)
+            tokens = rng.choices(words, weights, k=rng.randint(6, 9))
+            if rng.random() < 0.3:
+                pos = rng.randrange(1, len(tokens) - 1)
+                tokens[pos] += ','
+            ending = '.' if rng.random() < 0.3 else ''
+            ofh.write(f'<{abbreviation} {book + 1}.{line + 1}>\t'
+                      f'{" ".join(tokens)}{ending}\n')
+
+
+def generate_corpus(directory, texts_per_language=2, lines=2000, seed=0):
+    """Write synthetic texts and return their metadata
+
+    Parameters
+    ----------
+    directory : str or pathlib.Path
+        where the .tess files are written
+    texts_per_language : int
+        number of texts generated for each of Latin and Greek
+    lines : int
+        number of lines in each text
+    seed : int
+        seed for the random number generator, so that corpora can be
+        regenerated exactly
+
+    Returns
+    -------
+    list of dict
+        metadata of the texts, in the form expected by
+        tesserae.db.entities.Text.json_decode
+    """
+    rng = random.Random(seed)
+    metadata = []
+    for language in SEED_FILES:
+        for i in range(texts_per_language):
+            abbreviation = f'syn. {language[:3]}. {i}'
+            path = Path(directory).joinpath(f'synthetic.{language}.{i}.tess')
+            generate_text(path, language, lines, abbreviation, rng)
+            metadata.append({
+                'title': f'synthetic {language} {i}',
+                'author': f'synthetic author {i}',
+                'language': language,
+                'year': i,
+                'unit_types': ['line', 'phrase'],
+                'path': str(path),
+                'is_prose': False,
+            })
+    return metadata
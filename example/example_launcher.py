@@ -1,4 +1,8 @@
-"""Example script for launching under WSGI"""
+"""Example script for launching under WSGI
+
+This serves the app from a single process; for several HTTP worker processes
+sharing one pool of search workers, use apitess.launcher (apitess-serve).
+"""
 import atexit
 from multiprocessing import freeze_support
 import signal
@@ -24,8 +24,16 @@ setup(
     ],
     keywords='text_processing intertext_matching',
     install_requires=[
-        'flask>=1.0.2',
+        'flask>=2.2',
         'flask-cors',
         'tesserae @ git+https://github.com/tesserae/tesserae-v5@master',
     ],
+    extras_require={
+        'compression': ['brotli', 'zstandard'],
+        'fast-json': ['orjson'],
+        'server': ['gunicorn'],
+    },
+    entry_points={
+        'console_scripts': ['apitess-serve=apitess.launcher:main'],
+    },
 )
@@ -56,6 +56,17 @@ def app():
         ingest_queue.cleanup()
 
 
+@pytest.fixture(autouse=True)
+def clear_response_cache(request):
+    """Tests write to the database directly, bypassing cache invalidation"""
+    for name in ('app', 'populated_app', 'multitext_app'):
+        if name in request.fixturenames:
+            cache = request.getfixturevalue(name).extensions.get(
+                'response_cache')
+            if cache is not None:
+                cache.clear()
+
+
 @pytest.fixture(scope='session')
 def client(app):
     return app.test_client()
@@ -0,0 +1,81 @@
+import datetime
+
+from bson.objectid import ObjectId
+import flask
+import pytest
+from tesserae.db.entities import Search
+
+from apitess.admission import SUBMITTERS_COLLECTION, AdmissionController, \
+    Overloaded, count_pending_searches
+
+
+def test_stuck_searches_expire(populated_app):
+    with populated_app.test_request_context():
+        populated_app.preprocess_request()
+        db = flask.g.db
+        searches = db.connection[Search.collection]
+        before = count_pending_searches(db, max_age=None)
+        # submitted two hours ago and never finished
+        stuck_id = ObjectId.from_datetime(
+            datetime.datetime.now(datetime.timezone.utc) -
+            datetime.timedelta(hours=2))
+        searches.insert_one({'_id': stuck_id, 'status': Search.RUN})
+        try:
+            assert count_pending_searches(db, max_age=None) == before + 1
+            assert count_pending_searches(db, max_age=3600) <= before
+
+            admission = AdmissionController(max_backlog=before + 1,
+                                            max_pending_age=None)
+            with pytest.raises(Overloaded):
+                admission.admit(db, 'client')
+            admission.max_pending_age = 3600
+            admission.admit(db, 'client')
+        finally:
+            searches.delete_one({'_id': stuck_id})
+
+
+def test_per_client_limit_is_shared(populated_app):
+    with populated_app.test_request_context():
+        populated_app.preprocess_request()
+        db = flask.g.db
+    searches = db.connection[Search.collection]
+    submitters = db.connection[SUBMITTERS_COLLECTION]
+    # controllers of two processes serving the API
+    first, second = (AdmissionController(max_per_client=2) for _ in range(2))
+    search_ids = []
+    try:
+        for controller, results_id in ((first, 'fair-a'), (second, 'fair-b')):
+            controller.admit(db, 'heavy')
+            search_ids.append(
+                searches.insert_one({
+                    'results_id': results_id,
+                    'status': Search.RUN
+                }).inserted_id)
+            controller.record(db, 'heavy', results_id)
+        for controller in (first, second):
+            with pytest.raises(Overloaded) as e:
+                controller.admit(db, 'heavy')
+            assert e.value.status_code == 429
+            controller.admit(db, 'light')
+
+        searches.update_one({'_id': search_ids[0]},
+                            {'$set': {
+                                'status': Search.DONE
+                            }})
+        second.admit(db, 'heavy')
+    finally:
+        searches.delete_many({'_id': {'$in': search_ids}})
+        submitters.delete_many({'_id': {'$in': ['fair-a', 'fair-b']}})
+
+
+def test_identify():
+    app = flask.Flask(__name__)
+    direct = AdmissionController()
+    proxied = AdmissionController(client_header='X-Forwarded-For')
+    with app.test_request_context(
+            headers={'X-Forwarded-For': '203.0.113.9, 198.51.100.7'},
+            environ_base={'REMOTE_ADDR': '10.0.0.1'}):
+        assert direct.identify(flask.request) == '10.0.0.1'
+        assert proxied.identify(flask.request) == '198.51.100.7'
+    with app.test_request_context(environ_base={'REMOTE_ADDR': '10.0.0.1'}):
+        assert proxied.identify(flask.request) == '10.0.0.1'
@@ -0,0 +1,62 @@
+import os
+import stat
+
+import flask
+
+from apitess.cache import DiskBackend, MemoryBackend, cached, register_cache
+
+
+def test_memory_backend_bytes():
+    backend = MemoryBackend(max_entries=10, ttl=60, max_bytes=10)
+    backend.set('tag', 'a', (b'12345', 'application/json', 'a'))
+    backend.set('tag', 'b', (b'12345', 'application/json', 'b'))
+    assert backend.get('tag', 'a') is not None
+    # evicts the least recently used entry, now b
+    backend.set('tag', 'c', (b'123', 'application/json', 'c'))
+    assert backend.get('tag', 'a') is not None
+    assert backend.get('tag', 'b') is None
+    assert backend.get('tag', 'c') is not None
+    # too large to be cached at all
+    backend.set('tag', 'd', (b'12345678901', 'application/json', 'd'))
+    assert backend.get('tag', 'd') is None
+    assert backend.get('tag', 'a') is not None
+
+
+def test_disk_backend(tmp_path):
+    directory = str(tmp_path / 'cache')
+    backend = DiskBackend(directory, ttl=60)
+    assert stat.S_IMODE(os.stat(directory).st_mode) == 0o700
+    value = (b'{"a": 1}\n', 'application/json', 'abc')
+    backend.set('tag', 'key', value)
+    assert backend.get('tag', 'key') == value
+    backend.invalidate('tag')
+    assert backend.get('tag', 'key') is None
+
+
+def test_disk_backend_ignores_garbage(tmp_path):
+    backend = DiskBackend(str(tmp_path), ttl=60)
+    backend.set('tag', 'key', (b'body', 'text/plain', 'abc'))
+    tag_dir = backend._tag_dir('tag')
+    for name in os.listdir(tag_dir):
+        with open(os.path.join(tag_dir, name), 'wb') as ofh:
+            ofh.write(b'\x80\x04not a header')
+    assert backend.get('tag', 'key') is None
+
+
+def test_max_body_bytes():
+    app = flask.Flask(__name__)
+    app.config['RESPONSE_CACHE_MAX_BODY_BYTES'] = 16
+    register_cache(app)
+    calls = []
+
+    @app.route('/<int:size>')
+    @cached('sized')
+    def sized(size):
+        calls.append(size)
+        return flask.jsonify('x' * size)
+
+    client = app.test_client()
+    for _ in range(2):
+        assert client.get('/2').status_code == 200
+        assert client.get('/100').status_code == 200
+    assert calls == [2, 100, 100]
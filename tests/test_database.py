@@ -0,0 +1,149 @@
+import logging
+import time
+import types
+
+import flask
+import pymongo
+import pymongo.errors
+import pytest
+from pymongo.read_preferences import SecondaryPreferred
+
+import apitess
+from apitess.database import INDEXES, IndexBuilder, connect, \
+    ensure_indexes, reads_from_secondary
+
+OBJECT_ID = '5c6c69f042facf59122418f6'
+
+routed_config = {
+    'MONGO_HOSTNAME': 'localhost',
+    'MONGO_PORT': 27017,
+    'MONGO_USER': None,
+    'MONGO_PASSWORD': None,
+    'DB_NAME': 'test_apitess',
+    'MONGO_READ_PREFERENCE': 'secondaryPreferred',
+}
+
+# results and catalog reads, which may lag the primary
+SECONDARY_REQUESTS = [
+    ('GET', '/texts/'),
+    ('HEAD', '/texts/'),
+    ('GET', f'/texts/{OBJECT_ID}/'),
+    ('GET', '/texts/search/'),
+    ('GET', f'/parallels/{OBJECT_ID}/'),
+    ('GET', f'/parallels/{OBJECT_ID}/stream/'),
+    ('GET', f'/parallels/{OBJECT_ID}/downloads/'),
+    ('GET', f'/multitexts/{OBJECT_ID}/'),
+    ('GET', '/features/'),
+    ('GET', '/languages/'),
+    ('GET', '/stopwords/'),
+    ('GET', '/units/'),
+]
+# writes, and reads of progress that must not lag
+PRIMARY_REQUESTS = [
+    ('POST', '/texts/'),
+    ('POST', '/texts/batch/'),
+    ('PATCH', f'/texts/{OBJECT_ID}/'),
+    ('DELETE', f'/texts/{OBJECT_ID}/'),
+    ('POST', '/parallels/'),
+    ('POST', '/multitexts/'),
+    ('POST', '/stopwords/lists/'),
+    ('DELETE', '/stopwords/lists/mine/'),
+    ('GET', f'/parallels/{OBJECT_ID}/status/'),
+    ('GET', f'/multitexts/{OBJECT_ID}/status/'),
+    ('GET', f'/texts/{OBJECT_ID}/ingest/status/'),
+    ('GET', f'/texts/deletions/{OBJECT_ID}/'),
+]
+
+
+@pytest.fixture(scope='module')
+def routed_app():
+    return apitess.create_app(None, None, routed_config)
+
+
+@pytest.mark.parametrize('method,path', SECONDARY_REQUESTS)
+def test_reads_from_secondary(routed_app, method, path):
+    with routed_app.test_request_context(path, method=method):
+        assert reads_from_secondary()
+
+
+@pytest.mark.parametrize('method,path', PRIMARY_REQUESTS)
+def test_reads_from_primary(routed_app, method, path):
+    with routed_app.test_request_context(path, method=method):
+        assert not reads_from_secondary()
+
+
+def test_connect():
+    db, read_db = connect(routed_config)
+    assert db.connection.read_preference == pymongo.ReadPreference.PRIMARY
+    assert read_db.connection.read_preference == SecondaryPreferred()
+    # both share one client, and so one connection pool
+    assert read_db.connection.client is db.connection.client
+
+    db, read_db = connect(dict(routed_config,
+                               MONGO_READ_PREFERENCE='primary'))
+    assert read_db is db
+
+
+def test_request_connection(routed_app):
+    for method, path, preference in [
+        ('GET', '/texts/', SecondaryPreferred()),
+        ('GET', f'/parallels/{OBJECT_ID}/', SecondaryPreferred()),
+        ('PATCH', f'/texts/{OBJECT_ID}/', pymongo.ReadPreference.PRIMARY),
+        ('GET', f'/parallels/{OBJECT_ID}/status/',
+         pymongo.ReadPreference.PRIMARY),
+    ]:
+        with routed_app.test_request_context(path, method=method):
+            routed_app.preprocess_request()
+            assert flask.g.db.connection.read_preference == preference
+
+
+class FlakyConnection:
+    """Unreachable for the first `outages` index creations"""
+
+    def __init__(self, outages, denied=()):
+        self.outages = outages
+        self.denied = denied
+        self.attempts = 0
+        self.created = []
+
+    def __getitem__(self, collection):
+        return types.SimpleNamespace(
+            create_index=lambda keys, **options: self._create(
+                collection, keys, options))
+
+    def _create(self, collection, keys, options):
+        self.attempts += 1
+        if self.outages:
+            self.outages -= 1
+            raise pymongo.errors.ServerSelectionTimeoutError('unreachable')
+        if collection in self.denied:
+            raise pymongo.errors.OperationFailure('not authorized')
+        self.created.append((collection, keys, options))
+
+
+def test_ensure_indexes():
+    logger = logging.getLogger(__name__)
+    connection = FlakyConnection(outages=1, denied={'matches'})
+    db = types.SimpleNamespace(connection=connection)
+    # an unreachable database is given up on at once
+    assert ensure_indexes(db, logger) == INDEXES
+    assert connection.attempts == 1
+    # indexes that are refused are not tried again
+    assert ensure_indexes(db, logger) == []
+    assert [c for c, _, _ in connection.created] == [
+        c for c, _, _ in INDEXES if c != 'matches'
+    ]
+
+
+def test_index_builder():
+    connection = FlakyConnection(outages=3)
+    builder = IndexBuilder(types.SimpleNamespace(connection=connection),
+                           logging.getLogger(__name__),
+                           retry_interval=0.01)
+    builder.start()
+    deadline = time.monotonic() + 5
+    while len(connection.created) < len(INDEXES) and \
+            time.monotonic() < deadline:
+        time.sleep(0.01)
+    builder.stop()
+    assert connection.created == INDEXES
@@ -0,0 +1,29 @@
+from apitess.events import Watcher
+
+
+def test_watcher_survives_failed_fetch():
+    calls = []
+
+    def fetch(keys):
+        calls.append(keys)
+        if len(calls) == 1:
+            raise RuntimeError('database unavailable')
+        return {key: {'status': 'Done'} for key in keys}
+
+    watcher = Watcher(fetch, interval=0.01)
+    events = watcher.subscribe('key')
+    try:
+        assert events.get(timeout=5) == {'status': 'Done'}
+    finally:
+        watcher.unsubscribe('key', events)
+    assert len(calls) >= 2
+
+
+def test_watcher_restarts_after_last_unsubscribe():
+    watcher = Watcher(lambda keys: {key: key for key in keys}, interval=0.01)
+    for key in ('a', 'b'):
+        events = watcher.subscribe(key)
+        try:
+            assert events.get(timeout=5) == key
+        finally:
+            watcher.unsubscribe(key, events)
@@ -0,0 +1,92 @@
+import datetime
+
+from bson.objectid import ObjectId
+import apitess
+import flask
+from tesserae.db.entities import Search, Text
+
+
+def test_live(client):
+    response = client.get('/health/live')
+    assert response.status_code == 200
+    assert response.get_json()['status'] == 'alive'
+
+
+def test_ready(populated_app, populated_client):
+    response = populated_client.get('/health/ready')
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['status'] == 'ready'
+    assert not data['failures']
+    assert data['database']['latency_ms'] >= 0
+    for queue in ('search_queue', 'ingest_queue'):
+        for key in ('depth', 'running', 'oldest_pending_seconds'):
+            assert key in data[queue]
+
+
+def test_not_ready(populated_app, populated_client):
+    populated_app.config['HEALTH_MAX_DB_LATENCY_MS'] = -1
+    try:
+        response = populated_client.get('/health/ready')
+    finally:
+        del populated_app.config['HEALTH_MAX_DB_LATENCY_MS']
+    assert response.status_code == 503
+    data = response.get_json()
+    assert data['status'] == 'unavailable'
+    assert len(data['failures']) == 1
+    assert 'HEALTH_MAX_DB_LATENCY_MS' in data['failures'][0]
+
+
+def test_live_without_database():
+    app = apitess.create_app(
+        None, None, {
+            'MONGO_HOSTNAME': 'localhost',
+            'MONGO_PORT': 1,
+            'MONGO_USER': None,
+            'MONGO_PASSWORD': None,
+            'DB_NAME': 'test_apitess_unreachable',
+            'MONGO_SERVER_SELECTION_TIMEOUT_MS': 100,
+        })
+    response = app.test_client().get('/health/live')
+    assert response.status_code == 200
+
+
+def test_ready_ignores_legacy_texts(populated_app, populated_client):
+    before = populated_client.get('/health/ready').get_json()
+    with populated_app.test_request_context():
+        populated_app.preprocess_request()
+        texts = flask.g.db.connection[Text.collection]
+        legacy_id = texts.insert_one({'title': 'legacy'}).inserted_id
+    try:
+        after = populated_client.get('/health/ready').get_json()
+    finally:
+        texts.delete_one({'_id': legacy_id})
+    assert after['ingest_queue']['depth'] == \
+        before['ingest_queue']['depth']
+
+
+def test_ready_ignores_stuck_searches(populated_app, populated_client):
+    before = populated_client.get('/health/ready').get_json()
+    with populated_app.test_request_context():
+        populated_app.preprocess_request()
+        searches = flask.g.db.connection[Search.collection]
+    # submitted two hours ago and never finished
+    stuck_id = searches.insert_one({
+        '_id':
+        ObjectId.from_datetime(
+            datetime.datetime.now(datetime.timezone.utc) -
+            datetime.timedelta(hours=2)),
+        'status':
+        Search.RUN
+    }).inserted_id
+    populated_app.config['HEALTH_MAX_PENDING_AGE_SECONDS'] = 3600
+    try:
+        response = populated_client.get('/health/ready')
+    finally:
+        del populated_app.config['HEALTH_MAX_PENDING_AGE_SECONDS']
+        searches.delete_one({'_id': stuck_id})
+    assert response.status_code == 200
+    after = response.get_json()
+    assert after['search_queue']['depth'] == before['search_queue']['depth']
+    assert after['search_queue']['running'] == \
+        before['search_queue']['running']
@@ -0,0 +1,51 @@
+import datetime
+
+import flask
+import pytest
+
+from apitess.inflight import IN_FLIGHT_COLLECTION, claim, fingerprint, \
+    is_recent, release
+
+
+@pytest.fixture
+def db(app):
+    with app.test_request_context():
+        app.preprocess_request()
+        db = flask.g.db
+    db.connection[IN_FLIGHT_COLLECTION].delete_many({})
+    yield db
+    db.connection[IN_FLIGHT_COLLECTION].delete_many({})
+
+
+def test_fingerprint_ignores_order():
+    assert fingerprint({'stopwords': ['a', 'b']}) == \
+        fingerprint({'stopwords': ['b', 'a']})
+    assert fingerprint({'max_distance': 10}) != \
+        fingerprint({'max_distance': 11})
+
+
+def test_claim_and_release(db):
+    assert claim(db, 'key', 'first') is None
+    assert claim(db, 'key', 'second') == 'first'
+    # only the holder of the claim can release it
+    release(db, 'key', 'second')
+    assert claim(db, 'key', 'second') == 'first'
+    release(db, 'key', 'first')
+    assert claim(db, 'key', 'second') is None
+
+
+def test_is_recent(db):
+    claim(db, 'key', 'first')
+    assert is_recent(db, 'key', 'first')
+    assert not is_recent(db, 'key', 'second')
+    assert not is_recent(db, 'other', 'first')
+
+    db.connection[IN_FLIGHT_COLLECTION].update_one({'_id': 'key'}, {
+        '$set': {
+            'claimed':
+            datetime.datetime.now(datetime.timezone.utc) -
+            datetime.timedelta(minutes=5)
+        }
+    })
+    assert not is_recent(db, 'key', 'first')
+    assert is_recent(db, 'key', 'first', grace=600)
@@ -0,0 +1,64 @@
+import dataclasses
+import datetime
+import decimal
+import json
+import uuid
+
+import flask
+import pytest
+from bson.objectid import ObjectId
+from flask.json.provider import DefaultJSONProvider
+
+from apitess.jsonprovider import FastJSONProvider
+
+
+@dataclasses.dataclass
+class Point:
+    x: int
+    y: int
+
+
+@pytest.fixture
+def json_app():
+    app = flask.Flask(__name__)
+    app.json = FastJSONProvider(app)
+    return app
+
+
+def test_matches_default_provider(json_app):
+    default, fast = DefaultJSONProvider(json_app), json_app.json
+    obj = {
+        'when': datetime.datetime(2024, 3, 2, 15, 20, 11),
+        'day': datetime.date(2024, 3, 2),
+        'amount': decimal.Decimal('1.50'),
+        'key': uuid.UUID('12345678-1234-5678-1234-567812345678'),
+        'point': Point(1, 2),
+    }
+    assert json.loads(fast.dumps(obj)) == json.loads(default.dumps(obj))
+    assert json.loads(fast.dumps(obj))['when'] == \
+        'Sat, 02 Mar 2024 15:20:11 GMT'
+
+
+def test_object_id(json_app):
+    object_id = ObjectId('5c6c69f042facf59122418f6')
+    assert json.loads(json_app.json.dumps({'object_id': object_id})) == {
+        'object_id': '5c6c69f042facf59122418f6'
+    }
+
+
+def test_response(json_app):
+    obj = {
+        'object_id': ObjectId('5c6c69f042facf59122418f6'),
+        'when': datetime.datetime(2024, 3, 2, 15, 20, 11),
+    }
+    with json_app.app_context():
+        body = flask.jsonify(obj).get_json()
+    assert body == {
+        'object_id': '5c6c69f042facf59122418f6',
+        'when': 'Sat, 02 Mar 2024 15:20:11 GMT',
+    }
+
+
+def test_unserializable(json_app):
+    with pytest.raises(TypeError):
+        json_app.json.dumps({'set': object()})
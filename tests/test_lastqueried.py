@@ -0,0 +1,70 @@
+import datetime
+import types
+
+import pymongo.errors
+import tesserae.db.entities
+
+from apitess.lastqueried import LastQueriedFlusher
+
+
+class FakeSearch:
+    def __init__(self, search_id, last_queried):
+        self.id = search_id
+        self.last_queried = last_queried
+
+    def update_last_queried(self):
+        pass
+
+
+class FlakyCollection:
+    """Fails the first write, during which `during_failure` is called"""
+
+    def __init__(self, during_failure):
+        self.during_failure = during_failure
+        self.written = []
+
+    def bulk_write(self, requests, ordered=True):
+        if self.during_failure is not None:
+            self.during_failure()
+            self.during_failure = None
+            raise pymongo.errors.AutoReconnect('database unavailable')
+        self.written.extend(requests)
+
+
+def test_failed_flush_is_retried():
+    earlier = datetime.datetime(2024, 3, 2, 15, 20)
+    later = earlier + datetime.timedelta(minutes=1)
+    collection = FlakyCollection(
+        lambda: flusher.touch(FakeSearch('a', later)))
+    db = types.SimpleNamespace(
+        connection={tesserae.db.entities.Search.collection: collection})
+    flusher = LastQueriedFlusher(db, interval=60)
+
+    flusher.touch(FakeSearch('a', earlier))
+    flusher.touch(FakeSearch('b', earlier))
+    try:
+        flusher.flush()
+    except pymongo.errors.PyMongoError:
+        pass
+    flusher.flush()
+
+    assert len(collection.written) == 2
+    for search_id, last_queried in (('a', later), ('b', earlier)):
+        assert pymongo.UpdateOne(
+            {'_id': search_id},
+            {'$max': {
+                'last_queried': last_queried
+            }}) in collection.written
+
+
+def test_failed_stop_is_quiet(caplog):
+    collection = FlakyCollection(lambda: None)
+    db = types.SimpleNamespace(
+        connection={tesserae.db.entities.Search.collection: collection})
+    flusher = LastQueriedFlusher(db, interval=60)
+    flusher.start()
+    flusher.touch(FakeSearch('a', datetime.datetime(2024, 3, 2, 15, 20)))
+    flusher.stop()
+    assert 'Dropped 1 last_queried timestamps' in caplog.text
+    flusher.flush()
+    assert collection.written == []
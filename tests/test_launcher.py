@@ -0,0 +1,21 @@
+import pytest
+
+# the launcher needs the optional server dependencies
+pytest.importorskip('gunicorn')
+from apitess.launcher import share_response_cache  # noqa: E402
+
+
+def test_share_response_cache():
+    config = {}
+    share_response_cache(config, 1)
+    assert 'RESPONSE_CACHE' not in config
+    share_response_cache(config, 4)
+    assert config['RESPONSE_CACHE'] == 'disk'
+
+    config = {'RESPONSE_CACHE': None}
+    share_response_cache(config, 4)
+    assert config['RESPONSE_CACHE'] is None
+
+    share_response_cache({'RESPONSE_CACHE': 'memory'}, 1)
+    with pytest.raises(ValueError):
+        share_response_cache({'RESPONSE_CACHE': 'memory'}, 4)
@@ -0,0 +1,39 @@
+import flask
+from tesserae.db.entities import Text
+
+from apitess.metrics import count_pending_ingests
+
+
+def test_metrics(populated_client):
+    response = populated_client.get('/languages/')
+    assert response.status_code == 200
+
+    response = populated_client.get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    lines = response.get_data(as_text=True).splitlines()
+    assert any(
+        line.startswith('apitess_requests_total{endpoint="languages.'
+                        'query_languages",method="GET",status="200"}')
+        for line in lines)
+    assert any(
+        line.startswith('apitess_request_duration_seconds_count{endpoint='
+                        '"languages.query_languages"') for line in lines)
+    assert any(
+        line.startswith('apitess_mongo_command_duration_seconds_count{'
+                        'endpoint="languages.query_languages",'
+                        'command="distinct"}') for line in lines)
+    for gauge in ('apitess_search_queue_depth', 'apitess_ingest_queue_depth'):
+        assert any(line.startswith(gauge + ' ') for line in lines)
+
+
+def test_ingest_queue_depth_ignores_legacy_texts(populated_app):
+    with populated_app.test_request_context():
+        populated_app.preprocess_request()
+        texts = flask.g.db.connection[Text.collection]
+        before = count_pending_ingests(flask.g.db)
+        legacy_id = texts.insert_one({'title': 'legacy'}).inserted_id
+        try:
+            assert count_pending_ingests(flask.g.db) == before
+        finally:
+            texts.delete_one({'_id': legacy_id})
@@ -1,4 +1,3 @@
-import gzip
 import json
 import time
 
@@ -71,8 +70,7 @@ def test_multitexts(multitext_app, multitext_client):
                                           results_id=search_results_id)
     response = multitext_client.get(retrieve_endpoint)
     assert response.status_code == 200
-    data = flask.json.loads(
-        gzip.decompress(response.get_data()).decode('utf-8'))
+    data = response.get_json()
     assert 'parallels' in data
     assert len(data['parallels']) > 0
 
@@ -179,8 +177,7 @@ def test_multitexts(multitext_app, multitext_client):
                                           results_id=multitext_results_id)
     response = multitext_client.get(retrieve_endpoint)
     assert response.status_code == 200, response.data
-    data = flask.json.loads(
-        gzip.decompress(response.get_data()).decode('utf-8'))
+    data = response.get_json()
     assert 'multiresults' in data
     assert len(data['multiresults']) > 0
     matches_with_cross_refs = 0
@@ -212,8 +209,7 @@ def test_multitexts(multitext_app, multitext_client):
     redirect_url = response.headers['Location']
     response = multitext_client.get(redirect_url)
     assert response.status_code == 200
-    data = flask.json.loads(
-        gzip.decompress(response.get_data()).decode('utf-8'))
+    data = response.get_json()
     assert 'multiresults' in data
     assert 'max_score' in data
     assert 'total_count' in data
@@ -225,8 +221,7 @@ def test_multitexts(multitext_app, multitext_client):
                                           results_id=multitext_results_id)
     response = multitext_client.get(retrieve_endpoint)
     assert response.status_code == 200
-    data = flask.json.loads(
-        gzip.decompress(response.get_data()).decode('utf-8'))
+    data = response.get_json()
     assert 'multiresults' in data
     assert 'max_score' in data
     assert 'total_count' in data
@@ -243,8 +238,7 @@ def test_multitexts(multitext_app, multitext_client):
                                           page_number='0')
     response = multitext_client.get(retrieve_endpoint)
     assert response.status_code == 200
-    data = flask.json.loads(
-        gzip.decompress(response.get_data()).decode('utf-8'))
+    data = response.get_json()
     assert 'multiresults' in data
     assert 'max_score' in data
     assert 'total_count' in data
@@ -260,8 +254,7 @@ def test_multitexts(multitext_app, multitext_client):
                                           page_number='0')
     response = multitext_client.get(retrieve_endpoint)
     assert response.status_code == 200
-    data = flask.json.loads(
-        gzip.decompress(response.get_data()).decode('utf-8'))
+    data = response.get_json()
     assert 'multiresults' in data
     assert 'max_score' in data
     assert 'total_count' in data
@@ -282,6 +275,30 @@ def test_multitexts(multitext_app, multitext_client):
                 matches_with_cross_refs += 1
     assert matches_with_cross_refs == 2
 
+    print('Retrieving by cursor')
+    seen = []
+    cursor = ''
+    while cursor is not None:
+        with multitext_app.test_request_context():
+            retrieve_endpoint = flask.url_for(
+                'multitexts.retrieve_results',
+                results_id=multitext_results_id,
+                sort_by='source_tag',
+                sort_order='ascending',
+                per_page='3',
+                cursor=cursor)
+        response = multitext_client.get(retrieve_endpoint)
+        assert response.status_code == 200
+        data = response.get_json()
+        assert 'cursor' in data
+        for multiresult in data['multiresults']:
+            assert 'match' in multiresult
+            assert 'cross-ref' in multiresult
+        seen.extend(data['multiresults'])
+        cursor = data['cursor']
+    assert len(seen) == int(data['total_count'])
+    assert len({mr['match']['object_id'] for mr in seen}) == len(seen)
+
     print('Try ridiculous page')
     with multitext_app.test_request_context():
         retrieve_endpoint = flask.url_for('multitexts.retrieve_results',
@@ -292,8 +309,7 @@ def test_multitexts(multitext_app, multitext_client):
                                           page_number='999999999')
     response = multitext_client.get(retrieve_endpoint)
     assert response.status_code == 200
-    data = flask.json.loads(
-        gzip.decompress(response.get_data()).decode('utf-8'))
+    data = response.get_json()
     assert 'multiresults' in data
     assert 'max_score' in data
     assert 'total_count' in data
@@ -1,4 +1,5 @@
 import csv
+import datetime
 import gzip
 import io
 import json
@@ -6,8 +7,11 @@ import time
 
 import flask
 import tesserae.db.entities
+from tesserae.db.entities.text import TextStatus
 import werkzeug.datastructures
 
+from apitess.deletions import DELETIONS_COLLECTION
+
 
 def test_greek_to_latin(populated_app, populated_client):
     # request a search
@@ -82,8 +86,7 @@ def test_greek_to_latin(populated_app, populated_client):
                                           results_id=search_results_id)
     response = populated_client.get(retrieve_endpoint)
     assert response.status_code == 200
-    data = flask.json.loads(
-        gzip.decompress(response.get_data()).decode('utf-8'))
+    data = response.get_json()
     assert 'parallels' in data
     assert len(data['parallels']) > 0
 
@@ -164,8 +167,7 @@ def test_min_score(populated_app, populated_client):
                                           results_id=search_results_id)
     response = populated_client.get(retrieve_endpoint)
     assert response.status_code == 200
-    data = flask.json.loads(
-        gzip.decompress(response.get_data()).decode('utf-8'))
+    data = response.get_json()
     assert 'parallels' in data
     assert len(data['parallels']) > 0
 
@@ -245,8 +247,7 @@ def test_search_search_retrieval(populated_app, populated_client):
                                           results_id=search_results_id)
     response = populated_client.get(retrieve_endpoint)
     assert response.status_code == 200
-    data = flask.json.loads(
-        gzip.decompress(response.get_data()).decode('utf-8'))
+    data = response.get_json()
     assert 'parallels' in data
     assert len(data['parallels']) > 0
 
@@ -263,8 +264,7 @@ def test_search_search_retrieval(populated_app, populated_client):
     redirect_url = response.headers['Location']
     response = populated_client.get(redirect_url)
     assert response.status_code == 200
-    data = flask.json.loads(
-        gzip.decompress(response.get_data()).decode('utf-8'))
+    data = response.get_json()
     assert 'parallels' in data
     assert 'max_score' in data
     assert 'total_count' in data
@@ -276,8 +276,7 @@ def test_search_search_retrieval(populated_app, populated_client):
                                           results_id=search_results_id)
     response = populated_client.get(retrieve_endpoint)
     assert response.status_code == 200
-    data = flask.json.loads(
-        gzip.decompress(response.get_data()).decode('utf-8'))
+    data = response.get_json()
     assert 'parallels' in data
     assert 'max_score' in data
     assert 'total_count' in data
@@ -285,6 +284,24 @@ def test_search_search_retrieval(populated_app, populated_client):
     assert len(parallels) == int(data['total_count'])
     assert max(p['score'] for p in parallels) == float(data['max_score'])
 
+    print('Revalidate results')
+    assert 'immutable' in response.headers['Cache-Control']
+    etag = response.headers['ETag']
+    response = populated_client.get(retrieve_endpoint,
+                                    headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.get_data() == b''
+
+    print('Retrieve compressed')
+    response = populated_client.get(retrieve_endpoint,
+                                    headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    compressed = flask.json.loads(
+        gzip.decompress(response.get_data()).decode('utf-8'))
+    assert compressed == data
+
     print('Retrieving by score')
     with populated_app.test_request_context():
         retrieve_endpoint = flask.url_for('parallels.retrieve_results',
@@ -295,8 +312,7 @@ def test_search_search_retrieval(populated_app, populated_client):
                                           page_number='0')
     response = populated_client.get(retrieve_endpoint)
     assert response.status_code == 200
-    data = flask.json.loads(
-        gzip.decompress(response.get_data()).decode('utf-8'))
+    data = response.get_json()
     assert 'parallels' in data
     assert 'max_score' in data
     assert 'total_count' in data
@@ -315,8 +331,7 @@ def test_search_search_retrieval(populated_app, populated_client):
                                           page_number='0')
     response = populated_client.get(retrieve_endpoint)
     assert response.status_code == 200
-    data = flask.json.loads(
-        gzip.decompress(response.get_data()).decode('utf-8'))
+    data = response.get_json()
     assert 'parallels' in data
     assert 'max_score' in data
     assert 'total_count' in data
@@ -325,6 +340,40 @@ def test_search_search_retrieval(populated_app, populated_client):
     for earlier, later in zip(parallels[:-1], parallels[1:]):
         assert tuple(earlier['source_tag'].split()[-1].split('.')) <= \
             tuple(later['source_tag'].split()[-1].split('.'))
+    print('Retrieving by cursor')
+    seen = []
+    cursor = ''
+    while cursor is not None:
+        with populated_app.test_request_context():
+            retrieve_endpoint = flask.url_for('parallels.retrieve_results',
+                                              results_id=search_results_id,
+                                              sort_by='score',
+                                              sort_order='descending',
+                                              per_page='3',
+                                              cursor=cursor)
+        response = populated_client.get(retrieve_endpoint)
+        assert response.status_code == 200
+        data = response.get_json()
+        assert 'cursor' in data
+        assert len(data['parallels']) <= 3
+        seen.extend(data['parallels'])
+        cursor = data['cursor']
+    assert len(seen) == int(data['total_count'])
+    assert len({p['object_id'] for p in seen}) == len(seen)
+    for earlier, later in zip(seen[:-1], seen[1:]):
+        assert earlier['score'] >= later['score']
+
+    print('Try malformed cursor')
+    with populated_app.test_request_context():
+        retrieve_endpoint = flask.url_for('parallels.retrieve_results',
+                                          results_id=search_results_id,
+                                          sort_by='score',
+                                          sort_order='descending',
+                                          per_page='3',
+                                          cursor='garbage')
+    response = populated_client.get(retrieve_endpoint)
+    assert response.status_code == 400
+
     print('Try ridiculous page')
     with populated_app.test_request_context():
         retrieve_endpoint = flask.url_for('parallels.retrieve_results',
@@ -335,8 +384,7 @@ def test_search_search_retrieval(populated_app, populated_client):
                                           page_number='999999999')
     response = populated_client.get(retrieve_endpoint)
     assert response.status_code == 200
-    data = flask.json.loads(
-        gzip.decompress(response.get_data()).decode('utf-8'))
+    data = response.get_json()
     assert 'parallels' in data
     parallels = data['parallels']
     assert len(parallels) == 0
@@ -362,6 +410,53 @@ def test_search_search_retrieval(populated_app, populated_client):
         # there are 4 results, plus a header
         assert row_count == 5
 
+    print('Checking that last_queried is recorded')
+    with populated_app.test_request_context():
+        populated_app.preprocess_request()
+        before = flask.g.db.find(tesserae.db.entities.Search.collection,
+                                 results_id=search_results_id)[0]
+    response = populated_client.get(status_endpoint)
+    assert response.status_code == 200
+    populated_app.extensions['last_queried'].flush()
+    with populated_app.test_request_context():
+        populated_app.preprocess_request()
+        after = flask.g.db.find(tesserae.db.entities.Search.collection,
+                                results_id=search_results_id)[0]
+    assert after.last_queried > before.last_queried
+
+    print('Try streaming status')
+    with populated_app.test_request_context():
+        status_stream_endpoint = flask.url_for('parallels.stream_status',
+                                               results_id=search_results_id)
+    response = populated_client.get(status_stream_endpoint)
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    events = response.get_data().decode('utf-8').strip().split('\n\n')
+    # the search is already done, so the stream closes after one event
+    assert len(events) == 1
+    event_type, event_data = events[0].split('\n')
+    assert event_type == 'event: status'
+    data = json.loads(event_data[len('data: '):])
+    assert data['results_id'] == search_results_id
+    assert data['status'] == tesserae.db.entities.Search.DONE
+
+    print('Try streaming')
+    with populated_app.test_request_context():
+        stream_endpoint = flask.url_for('parallels.stream_results',
+                                        results_id=search_results_id)
+    response = populated_client.get(stream_endpoint,
+                                    headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert response.headers['Content-Type'] == 'application/x-ndjson'
+    assert response.headers['Content-Encoding'] == 'gzip'
+    lines = gzip.decompress(response.get_data()).decode('utf-8').splitlines()
+    # there are 4 results
+    assert len(lines) == 4
+    for line in lines:
+        parallel = flask.json.loads(line)
+        assert 'object_id' in parallel
+        assert 'score' in parallel
+
 
 def test_bad_feature_search(populated_app, populated_client):
     bad_feature = 'DEADBEEF'
@@ -422,6 +517,237 @@ def test_bad_feature_search(populated_app, populated_client):
     assert f'"{bad_feature}"' in data['message']
 
 
+def test_coalesce_identical_searches(populated_app, populated_client):
+    with populated_app.test_request_context():
+        populated_app.preprocess_request()
+        found_texts = {
+            t.title: t
+            for t in flask.g.db.find(tesserae.db.entities.Text.collection)
+        }
+        submit_endpoint = flask.url_for('parallels.submit_search')
+    headers = werkzeug.datastructures.Headers()
+    headers['Content-Type'] = 'application/json; charset=utf-8'
+    search_query = {
+        'source': {
+            'object_id': str(found_texts['ziliad'].id),
+            'units': 'line'
+        },
+        'target': {
+            'object_id': str(found_texts['zgorgias'].id),
+            'units': 'line'
+        },
+        'method': {
+            'name': 'original',
+            'feature': 'lemmata',
+            'stopwords': [],
+            'score_basis': 'lemmata',
+            'freq_basis': 'corpus',
+            'max_distance': 10,
+            'distance_basis': 'frequency'
+        }
+    }
+    response = populated_client.post(submit_endpoint,
+                                     data=json.dumps(search_query),
+                                     headers=headers)
+    assert response.status_code == 201
+    results_id = response.headers['Location'].split('/')[-2]
+
+    # whether or not the first search has finished, the second submission
+    # should be pointed to it
+    response = populated_client.post(submit_endpoint,
+                                     data=json.dumps(search_query),
+                                     headers=headers)
+    assert response.status_code == 303
+    assert results_id == response.headers['Location'].split('?')[0].split(
+        '/')[-2]
+
+    # wait for the search to finish before moving on
+    with populated_app.test_request_context():
+        status_endpoint = flask.url_for('parallels.retrieve_status',
+                                        results_id=results_id)
+    response = populated_client.get(status_endpoint)
+    while response.status_code == 404 or response.get_json()['status'] not in \
+            (tesserae.db.entities.Search.DONE,
+             tesserae.db.entities.Search.FAILED):
+        time.sleep(0.1)
+        response = populated_client.get(status_endpoint)
+
+
+def test_search_text_being_deleted(populated_app, populated_client):
+    with populated_app.test_request_context():
+        populated_app.preprocess_request()
+        found_texts = flask.g.db.find(tesserae.db.entities.Text.collection)
+        deletions = flask.g.db.connection[DELETIONS_COLLECTION]
+        submit_endpoint = flask.url_for('parallels.submit_search')
+        units_endpoint = flask.url_for('units.query_units',
+                                       works=str(found_texts[0].id))
+    # a deletion that is running, so that the text stays in the database
+    job_id = deletions.insert_one({
+        'text_id': found_texts[0].id,
+        'status': TextStatus.RUN,
+        'claimed': datetime.datetime.now(
+            datetime.timezone.utc).replace(tzinfo=None),
+    }).inserted_id
+    try:
+        headers = werkzeug.datastructures.Headers()
+        headers['Content-Type'] = 'application/json; charset=utf-8'
+        search_query = {
+            'source': {
+                'object_id': str(found_texts[0].id),
+                'units': 'line'
+            },
+            'target': {
+                'object_id': str(found_texts[1].id),
+                'units': 'line'
+            },
+            'method': {
+                'name': 'original',
+                'feature': 'lemmata',
+                'stopwords': [],
+                'score_basis': 'lemmata',
+                'freq_basis': 'corpus',
+                'max_distance': 10,
+                'distance_basis': 'frequency'
+            }
+        }
+        response = populated_client.post(submit_endpoint,
+                                         data=json.dumps(search_query),
+                                         headers=headers)
+        assert response.status_code == 400
+        assert str(found_texts[0].id) in response.get_json()['message']
+
+        response = populated_client.get(units_endpoint)
+        assert response.status_code == 200
+        assert response.get_json()['units'] == []
+    finally:
+        deletions.delete_one({'_id': job_id})
+
+
+def test_batch_search(populated_app, populated_client):
+    with populated_app.test_request_context():
+        populated_app.preprocess_request()
+        found_texts = {
+            t.title: t
+            for t in flask.g.db.find(tesserae.db.entities.Text.collection)
+        }
+        batch_endpoint = flask.url_for('parallels.submit_search_batch')
+    headers = werkzeug.datastructures.Headers()
+    headers['Content-Type'] = 'application/json; charset=utf-8'
+    good_query = {
+        'source': {
+            'object_id': str(found_texts['zaeneid'].id),
+            'units': 'phrase'
+        },
+        'target': {
+            'object_id': str(found_texts['zbellum civile'].id),
+            'units': 'phrase'
+        },
+        'method': {
+            'name': 'original',
+            'feature': 'lemmata',
+            'stopwords': [],
+            'score_basis': 'lemmata',
+            'freq_basis': 'corpus',
+            'max_distance': 10,
+            'distance_basis': 'frequency'
+        }
+    }
+    missing_text_query = {
+        'source': {
+            'object_id': 'DEADBEEFDEADBEEFDEADBEEF',
+            'units': 'line'
+        },
+        'target': good_query['target'],
+        'method': good_query['method'],
+    }
+    missing_method_query = {
+        'source': good_query['source'],
+        'target': good_query['target'],
+    }
+    batch_query = {
+        'searches': [good_query, missing_text_query, missing_method_query]
+    }
+    response = populated_client.post(batch_endpoint,
+                                     data=json.dumps(batch_query),
+                                     headers=headers)
+    assert response.status_code == 200
+    data = response.get_json()
+    assert len(data['searches']) == 3
+    good, missing_text, missing_method = data['searches']
+    assert good['status'] == 201
+    assert good['location'] is not None
+    assert missing_text['status'] == 400
+    assert 'DEADBEEFDEADBEEFDEADBEEF' in missing_text['message']
+    assert missing_method['status'] == 400
+    assert 'method' in missing_method['message']
+
+    # resubmitting the good search should point to the first one
+    response = populated_client.post(batch_endpoint,
+                                     data=json.dumps(
+                                         {'searches': [good_query]}),
+                                     headers=headers)
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['searches'][0]['status'] == 303
+    results_id = good['location'].split('/')[-2]
+    assert results_id == data['searches'][0]['location'].split('?')[0].split(
+        '/')[-2]
+
+    # wait for the search to finish before moving on
+    with populated_app.test_request_context():
+        status_endpoint = flask.url_for('parallels.retrieve_status',
+                                        results_id=results_id)
+    response = populated_client.get(status_endpoint)
+    while response.status_code == 404 or response.get_json()['status'] not in \
+            (tesserae.db.entities.Search.DONE,
+             tesserae.db.entities.Search.FAILED):
+        time.sleep(0.1)
+        response = populated_client.get(status_endpoint)
+
+
+def test_overloaded_search(populated_app, populated_client):
+    with populated_app.test_request_context():
+        populated_app.preprocess_request()
+        found_texts = {
+            t.title: t
+            for t in flask.g.db.find(tesserae.db.entities.Text.collection)
+        }
+        submit_endpoint = flask.url_for('parallels.submit_search')
+    headers = werkzeug.datastructures.Headers()
+    headers['Content-Type'] = 'application/json; charset=utf-8'
+    search_query = {
+        'source': {
+            'object_id': str(found_texts['zgorgias'].id),
+            'units': 'phrase'
+        },
+        'target': {
+            'object_id': str(found_texts['ziliad'].id),
+            'units': 'phrase'
+        },
+        'method': {
+            'name': 'original',
+            'feature': 'lemmata',
+            'stopwords': [],
+            'score_basis': 'lemmata',
+            'freq_basis': 'corpus',
+            'max_distance': 10,
+            'distance_basis': 'frequency'
+        }
+    }
+    admission = populated_app.extensions['admission']
+    admission.max_backlog = 0
+    try:
+        response = populated_client.post(submit_endpoint,
+                                         data=json.dumps(search_query),
+                                         headers=headers)
+    finally:
+        admission.max_backlog = None
+    assert response.status_code == 503
+    assert int(response.headers['Retry-After']) >= 1
+    data = response.get_json()
+    assert 'message' in data
+
+
 def test_non_existent_results(populated_app, populated_client):
     with populated_app.test_request_context():
         populated_app.preprocess_request()
@@ -0,0 +1,82 @@
+import os
+
+import flask
+import pytest
+
+from apitess.profiling import register_profiling
+
+
+def _profiling_app(directory, **config):
+    app = flask.Flask(__name__)
+    app.config['PROFILE_DIR'] = str(directory)
+    app.config.update(config)
+    register_profiling(app)
+
+    @app.route('/work/')
+    def work():
+        return flask.jsonify(sum(range(1000)))
+
+    return app
+
+
+@pytest.fixture
+def admin(monkeypatch):
+    monkeypatch.setenv('ADMIN_INSTANCE', 'true')
+
+
+@pytest.fixture
+def public(monkeypatch):
+    monkeypatch.setenv('ADMIN_INSTANCE', 'false')
+
+
+def test_profiled_request(admin, tmp_path):
+    app = _profiling_app(tmp_path, PROFILE_ENABLED=True)
+    client = app.test_client()
+    assert client.get('/work/').status_code == 200
+    assert os.listdir(tmp_path) == []
+    response = client.get('/work/', headers={'X-Tesserae-Profile': '1'})
+    assert response.status_code == 200
+    assert len([f for f in os.listdir(tmp_path) if f.endswith('.prof')]) == 1
+
+    response = client.get('/profiles/')
+    assert response.status_code == 200
+    profiles = response.get_json()['profiles']
+    assert len(profiles) == 1
+    assert profiles[0]['path'] == '/work/'
+    assert profiles[0]['method'] == 'GET'
+    assert profiles[0]['top']
+
+    response = client.get(f'/profiles/{profiles[0]["name"]}/')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/octet-stream'
+    assert client.get('/profiles/no-such-profile/').status_code == 404
+
+
+def test_sampled_request(admin, tmp_path):
+    app = _profiling_app(tmp_path,
+                         PROFILE_ENABLED=True,
+                         PROFILE_SAMPLE_RATE=1.0,
+                         PROFILE_KEEP=2)
+    client = app.test_client()
+    for _ in range(3):
+        assert client.get('/work/').status_code == 200
+    assert len([f for f in os.listdir(tmp_path) if f.endswith('.prof')]) == 2
+
+
+def test_header_ignored_on_public(public, tmp_path):
+    app = _profiling_app(tmp_path, PROFILE_ENABLED=True)
+    client = app.test_client()
+    response = client.get('/work/', headers={'X-Tesserae-Profile': '1'})
+    assert response.status_code == 200
+    assert os.listdir(tmp_path) == []
+    assert client.get('/profiles/').status_code == 404
+
+
+def test_profiling_disabled(admin, tmp_path):
+    directory = tmp_path / 'profiles'
+    app = _profiling_app(directory)
+    client = app.test_client()
+    response = client.get('/work/', headers={'X-Tesserae-Profile': '1'})
+    assert response.status_code == 200
+    assert not directory.exists()
+    assert client.get('/profiles/').status_code == 404
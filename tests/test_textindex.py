@@ -0,0 +1,84 @@
+import threading
+import time
+import types
+
+from bson.objectid import ObjectId
+import tesserae.db.entities
+
+from apitess.textindex import TextIndex, normalize
+
+
+class FakeCollection:
+    def __init__(self, docs):
+        self.docs = docs
+        self.release = threading.Event()
+        self.release.set()
+
+    def find(self, *args, **kwargs):
+        self.release.wait(5)
+        return [dict(doc) for doc in self.docs]
+
+
+TEXTS = tesserae.db.entities.Text.collection
+
+
+def _db(docs):
+    return types.SimpleNamespace(connection={TEXTS: FakeCollection(docs)})
+
+
+def _doc(author, title):
+    return {
+        '_id': ObjectId(),
+        'author': author,
+        'title': title,
+        'cts_urn': None,
+        'language': 'latin',
+    }
+
+
+def test_normalize():
+    assert normalize('Æschylus') == 'aeschylus'
+    assert normalize('urn:cts:latinLit:phi0690') == 'urn cts latinlit phi0690'
+
+
+def test_search_order():
+    docs = [
+        _doc('vergil', 'aeneid'),
+        _doc('lucan', 'bellum civile'),
+        _doc('caesar', 'de bello civili'),
+    ]
+    index = TextIndex(ttl=300)
+    index.ensure_current(_db(docs))
+    assert [t['title'] for t in index.search('bell', 10)] == [
+        'bellum civile', 'de bello civili'
+    ]
+    assert [t['title'] for t in index.search('civ bel', 10)] == [
+        'de bello civili', 'bellum civile'
+    ]
+    # misspelled
+    assert [t['author'] for t in index.search('vregil', 10)] == ['vergil']
+    assert index.search('zzz', 10) == []
+
+
+def test_rebuild_in_background():
+    docs = [_doc('vergil', 'aeneid')]
+    db = _db(docs)
+    index = TextIndex(ttl=0)
+    index.ensure_current(db)
+
+    docs.append(_doc('lucan', 'bellum civile'))
+    db.connection[TEXTS].release.clear()
+    # the rebuild waits on the database, but searches do not wait for it
+    index.ensure_current(db)
+    assert [t['author'] for t in index.search('vergil', 10)] == ['vergil']
+    assert index.search('lucan', 10) == []
+    # a change made during the rebuild survives it
+    added = _doc('statius', 'thebaid')
+    index.add(dict(added, object_id=str(added['_id'])))
+    db.connection[TEXTS].release.set()
+    for _ in range(500):
+        if index.search('lucan', 10):
+            break
+        time.sleep(0.01)
+    assert [t['author'] for t in index.search('lucan', 10)] == ['lucan']
+    assert [t['author'] for t in index.search('statius', 10)] == ['statius']
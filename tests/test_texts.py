@@ -1,10 +1,17 @@
+import datetime
+import hashlib
+import io
 import json
 import os
 import time
 
+from bson.objectid import ObjectId
 import flask
 import werkzeug.datastructures
 
+from apitess.deletions import DELETIONS_COLLECTION, DeletionWorker
+from tesserae.db import TessMongoConnection
+from tesserae.db.entities import Text
 from tesserae.db.entities.text import TextStatus
 
 
@@ -15,6 +22,20 @@ def test_query_texts(populated_client):
     assert 'texts' in data and isinstance(data['texts'], list)
 
 
+def test_query_texts_revalidate(populated_client):
+    response = populated_client.get('/texts/')
+    assert response.status_code == 200
+    assert 'ETag' in response.headers
+    etag = response.headers['ETag']
+    response = populated_client.get('/texts/',
+                                    headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+    response = populated_client.get('/texts/',
+                                    headers={'If-None-Match': '"stale"'})
+    assert response.status_code == 200
+
+
 def test_query_texts_with_fields(populated_app, populated_client):
     year = 1
     lang = 'latin'
@@ -31,6 +52,161 @@ def test_query_texts_with_fields(populated_app, populated_client):
         assert text['language'] == lang
 
 
+def test_query_texts_catalog(populated_app, populated_client):
+    response = populated_client.get('/texts/')
+    all_ids = {t['object_id'] for t in response.get_json()['texts']}
+
+    with populated_app.test_request_context():
+        endpoint = flask.url_for('texts.query_texts',
+                                 fields='object_id,author,title',
+                                 sort_by='title',
+                                 limit=2)
+    seen = []
+    cursor = ''
+    while True:
+        response = populated_client.get(f'{endpoint}&cursor={cursor}')
+        assert response.status_code == 200
+        data = response.get_json()
+        assert len(data['texts']) <= 2
+        for text in data['texts']:
+            assert set(text) == {'object_id', 'author', 'title'}
+        seen.extend(data['texts'])
+        cursor = data['cursor']
+        if not cursor:
+            break
+    assert {t['object_id'] for t in seen} == all_ids
+    titles = [t['title'] for t in seen]
+    assert titles == sorted(titles)
+
+    response = populated_client.get('/texts/?fields=no_such_field')
+    assert response.status_code == 400
+    response = populated_client.get('/texts/?limit=2&cursor=malformed')
+    assert response.status_code == 400
+
+
+def test_query_texts_catalog_missing_year(populated_app, populated_client):
+    with populated_app.test_request_context():
+        populated_app.preprocess_request()
+        texts = flask.g.db.connection[Text.collection]
+        undated_ids = texts.insert_many([{
+            'title': 'undated',
+            'language': 'latin'
+        }, {
+            'title': 'null year',
+            'language': 'latin',
+            'year': None
+        }]).inserted_ids
+    try:
+        response = populated_client.get('/texts/')
+        all_ids = {t['object_id'] for t in response.get_json()['texts']}
+        assert {str(i) for i in undated_ids} <= all_ids
+        for sort_order in ('ascending', 'descending'):
+            seen = []
+            cursor = ''
+            while True:
+                response = populated_client.get(
+                    '/texts/',
+                    query_string={
+                        'fields': 'object_id,year',
+                        'sort_by': 'year',
+                        'sort_order': sort_order,
+                        'limit': 1,
+                        'cursor': cursor
+                    })
+                assert response.status_code == 200
+                data = response.get_json()
+                seen.extend(t['object_id'] for t in data['texts'])
+                cursor = data['cursor']
+                if not cursor:
+                    break
+            assert len(seen) == len(all_ids)
+            assert set(seen) == all_ids
+    finally:
+        texts.delete_many({'_id': {'$in': undated_ids}})
+
+
+def test_search_texts(populated_client):
+    response = populated_client.get('/texts/search/?q=zaen')
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['texts'][0]['title'] == 'zaeneid'
+    assert set(data['texts'][0]) == {
+        'object_id', 'author', 'title', 'cts_urn', 'language'
+    }
+
+    response = populated_client.get('/texts/search/?q=civile%20zbell')
+    data = response.get_json()
+    assert [t['title'] for t in data['texts']] == ['zbellum civile']
+
+    # misspelled
+    response = populated_client.get('/texts/search/?q=zvregil')
+    data = response.get_json()
+    assert [t['author'] for t in data['texts']] == ['zvergil']
+
+    response = populated_client.get('/texts/search/?q=z&limit=2')
+    data = response.get_json()
+    assert len(data['texts']) == 2
+
+    response = populated_client.get('/texts/search/?q=z&limit=0')
+    assert response.status_code == 400
+
+
+def test_ingest_status(populated_client):
+    text = populated_client.get('/texts/').get_json()['texts'][0]
+    endpoint = f'/texts/{text["object_id"]}/ingest/status/'
+    response = populated_client.get(endpoint)
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['object_id'] == text['object_id']
+    assert data['status'] == TextStatus.DONE
+    assert isinstance(data['stages'], list)
+
+    # the stream of a finished ingestion ends after its final status
+    response = populated_client.get(endpoint + 'stream/')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    events = response.get_data(as_text=True)
+    assert events.count('event: status') == 1
+    assert json.loads(events.split('data: ')[1])['status'] == TextStatus.DONE
+
+    response = populated_client.get(
+        '/texts/DEADBEEFDEADBEEFDEADBEEF/ingest/status/')
+    assert response.status_code == 404
+    response = populated_client.get('/texts/malformed/ingest/status/')
+    assert response.status_code == 400
+
+
+def test_text_being_deleted(populated_app, populated_client):
+    with populated_app.test_request_context():
+        populated_app.preprocess_request()
+        texts = flask.g.db.connection[Text.collection]
+        deletions = flask.g.db.connection[DELETIONS_COLLECTION]
+    text_id = texts.insert_one({
+        'title': 'doomed',
+        'language': 'zdoomed',
+        'ingestion_status': [TextStatus.DONE],
+    }).inserted_id
+    assert 'zdoomed' in \
+        populated_client.get('/languages/').get_json()['languages']
+    # a deletion that is running, so that the text stays in the database
+    job_id = deletions.insert_one({
+        'text_id': text_id,
+        'status': TextStatus.RUN,
+        'claimed': datetime.datetime.now(
+            datetime.timezone.utc).replace(tzinfo=None),
+    }).inserted_id
+    populated_app.extensions['response_cache'].clear()
+    try:
+        assert 'zdoomed' not in \
+            populated_client.get('/languages/').get_json()['languages']
+        endpoint = f'/texts/{text_id}/ingest/status/'
+        assert populated_client.get(endpoint).status_code == 404
+        assert populated_client.get(endpoint + 'stream/').status_code == 404
+    finally:
+        deletions.delete_one({'_id': job_id})
+        texts.delete_one({'_id': text_id})
+
+
 def test_query_texts_is_prose(populated_app, populated_client):
     # gather true statistics
     with populated_app.test_request_context():
@@ -152,8 +328,9 @@ if os.environ.get('ADMIN_INSTANCE') == 'true':
                 assert k in before and v == before[k]
 
         response = client.delete(endpoint)
-        # make sure the new text has been deleted
-        assert response.status_code == 204
+        # make sure the new text is hidden at once
+        assert response.status_code == 202
+        status_endpoint = response.headers['Location']
         response = client.get(endpoint)
         assert response.status_code == 404
 
@@ -165,6 +342,15 @@ if os.environ.get('ADMIN_INSTANCE') == 'true':
         for k, v in after_delete.items():
             assert k in before and v == before[k]
 
+        # make sure the new text is deleted in the background
+        status = client.get(status_endpoint).get_json()
+        while status['status'] != TextStatus.DONE:
+            assert status['status'] != TextStatus.FAILED
+            time.sleep(0.1)
+            status = client.get(status_endpoint).get_json()
+        assert status['object_id'] == new_obj_id
+        assert client.get(endpoint).status_code == 404
+
     def test_add_text_insufficient_data(client):
         to_be_added = {}
 
@@ -183,6 +369,247 @@ if os.environ.get('ADMIN_INSTANCE') == 'true':
             assert k in to_be_added and v == to_be_added[k]
         assert 'message' in data
 
+    def test_add_text_streamed(app, client):
+        with open(os.path.join(os.path.dirname(__file__), 'bob.txt'),
+                  'rb') as ifh:
+            file_bytes = ifh.read()
+        metadata = {
+            'author': 'Bob',
+            'is_prose': False,
+            'language': 'latin',
+            'title': 'Bob Bob',
+            'year': 2018
+        }
+        multipart = client.post(
+            '/texts/',
+            data={
+                'metadata': json.dumps(metadata),
+                'file_contents': (io.BytesIO(file_bytes), 'bob.tess'),
+            },
+            content_type='multipart/form-data',
+        )
+        raw = client.post(
+            '/texts/',
+            query_string={'metadata': json.dumps(metadata)},
+            data=file_bytes,
+            content_type='application/octet-stream',
+        )
+        for response in (multipart, raw):
+            assert response.status_code == 201
+            assert response.headers['X-Tesserae-File-SHA256'] == \
+                hashlib.sha256(file_bytes).hexdigest()
+            data = response.get_json()
+            for k, v in metadata.items():
+                assert data[k] == v
+            with app.test_request_context():
+                endpoint = flask.url_for('texts.get_text',
+                                         object_id=data['object_id'])
+            assert client.delete(endpoint).status_code == 202
+
+        response = client.post(
+            '/texts/',
+            query_string={'metadata': json.dumps(metadata)},
+            data=b'\xff\xfe',
+            content_type='application/octet-stream',
+        )
+        assert response.status_code == 400
+
+        response = client.post(
+            '/texts/',
+            data=file_bytes,
+            content_type='application/octet-stream',
+        )
+        assert response.status_code == 400
+
+    def test_upload_session(app, client):
+        with open(os.path.join(os.path.dirname(__file__), 'bob.txt'),
+                  'rb') as ifh:
+            file_bytes = ifh.read()
+        size = len(file_bytes)
+        half = size // 2
+        metadata = {
+            'author': 'Bob',
+            'is_prose': False,
+            'language': 'latin',
+            'title': 'Bob Bob',
+            'year': 2018
+        }
+        response = client.post('/texts/uploads/',
+                               json={
+                                   'metadata': metadata,
+                                   'size': size
+                               })
+        assert response.status_code == 201
+        assert response.get_json()['received'] == []
+        with app.test_request_context():
+            endpoint = flask.url_for(
+                'texts.upload_status',
+                session_id=response.get_json()['session_id'])
+
+        # send the second half first, as if the first had been interrupted
+        response = client.put(
+            endpoint,
+            data=file_bytes[half:],
+            headers={'Content-Range': f'bytes {half}-{size - 1}/{size}'})
+        assert response.status_code == 200
+        assert response.get_json()['received'] == [[half, size - 1]]
+        response = client.post(endpoint + 'finalize/')
+        assert response.status_code == 409
+
+        response = client.put(
+            endpoint,
+            data=file_bytes[:half],
+            headers={'Content-Range': f'bytes 0-{size}/{size}'})
+        assert response.status_code == 416
+        response = client.put(
+            endpoint,
+            data=file_bytes[:half - 1],
+            headers={'Content-Range': f'bytes 0-{half - 1}/{size}'})
+        assert response.status_code == 400
+        response = client.put(
+            endpoint,
+            data=file_bytes[:half],
+            headers={'Content-Range': f'bytes 0-{half - 1}/{size}'})
+        assert response.status_code == 200
+        assert client.get(endpoint).get_json()['received'] == [[0, size - 1]]
+
+        response = client.post(endpoint + 'finalize/')
+        assert response.status_code == 201
+        sha256 = hashlib.sha256(file_bytes).hexdigest()
+        assert response.headers['X-Tesserae-File-SHA256'] == sha256
+        data = response.get_json()
+        for k, v in metadata.items():
+            assert data[k] == v
+        assert client.get(endpoint).status_code == 404
+
+        # the file is recognized when it is uploaded again
+        response = client.post('/texts/batch/',
+                               json={
+                                   'texts': [{
+                                       'metadata': metadata,
+                                       'file_contents':
+                                       file_bytes.decode('utf-8')
+                                   }]
+                               })
+        assert response.get_json()['texts'][0]['status'] == 'duplicate'
+        assert response.get_json()['texts'][0]['object_id'] == \
+            data['object_id']
+
+        with app.test_request_context():
+            text_endpoint = flask.url_for('texts.get_text',
+                                          object_id=data['object_id'])
+        assert client.delete(text_endpoint).status_code == 202
+
+    def test_upload_session_not_utf8(app, client):
+        # a character split across the two ranges, then an invalid byte
+        file_bytes = 'caf\u00e9'.encode('utf-8') + b'\xff'
+        size = len(file_bytes)
+        response = client.post('/texts/uploads/',
+                               json={
+                                   'metadata': {
+                                       'author': 'Bob',
+                                       'is_prose': False,
+                                       'language': 'latin',
+                                       'title': 'Bob Garbled',
+                                       'year': 2018
+                                   },
+                                   'size': size
+                               })
+        assert response.status_code == 201
+        with app.test_request_context():
+            endpoint = flask.url_for(
+                'texts.upload_status',
+                session_id=response.get_json()['session_id'])
+        for start, end in ((0, 3), (4, size - 1)):
+            response = client.put(
+                endpoint,
+                data=file_bytes[start:end + 1],
+                headers={'Content-Range': f'bytes {start}-{end}/{size}'})
+            assert response.status_code == 200
+
+        response = client.post(endpoint + 'finalize/')
+        assert response.status_code == 400
+        assert client.get(endpoint).status_code == 404
+        response = client.get('/texts/', query_string={'title': 'Bob Garbled'})
+        assert response.get_json()['texts'] == []
+
+    def test_patch_text_being_deleted(app, client):
+        with app.test_request_context():
+            app.preprocess_request()
+            texts = flask.g.db.connection[Text.collection]
+            deletions = flask.g.db.connection[DELETIONS_COLLECTION]
+        text_id = texts.insert_one({
+            'title': 'zdoomed',
+            'language': 'latin',
+        }).inserted_id
+        job_id = deletions.insert_one({
+            'text_id': text_id,
+            'status': TextStatus.RUN,
+            'claimed': datetime.datetime.now(
+                datetime.timezone.utc).replace(tzinfo=None),
+        }).inserted_id
+        try:
+            response = client.patch(f'/texts/{text_id}/',
+                                    json={'title': 'zrevived'})
+            assert response.status_code == 404
+            assert texts.find_one({'_id': text_id})['title'] == 'zdoomed'
+            response = client.get('/texts/search/?q=zrevived')
+            assert response.get_json()['texts'] == []
+        finally:
+            deletions.delete_one({'_id': job_id})
+            texts.delete_one({'_id': text_id})
+
+    def test_add_texts_batch(app, client):
+        with open(os.path.join(os.path.dirname(__file__), 'bob.txt'),
+                  'r',
+                  encoding='utf-8') as ifh:
+            file_contents = ifh.read()
+        metadata = {
+            'author': 'Bob',
+            'is_prose': False,
+            'language': 'latin',
+            'title': 'Bob Bob',
+            'year': 2018
+        }
+        batch = {
+            'texts': [
+                {
+                    'metadata': metadata,
+                    'file_contents': file_contents
+                },
+                {
+                    'metadata': dict(metadata, title='Bob Again'),
+                    'file_contents': file_contents
+                },
+                {
+                    'metadata': {
+                        'author': 'Bob'
+                    },
+                    'file_contents': file_contents + 'more'
+                },
+            ]
+        }
+        response = client.post('/texts/batch/', json=batch)
+        assert response.status_code == 200
+        first, again, incomplete = response.get_json()['texts']
+        assert first['status'] == 'submitted'
+        assert again['status'] == 'duplicate'
+        assert again['object_id'] == first['object_id']
+        assert incomplete['status'] == 'rejected'
+
+        # uploading the same file again finds the text already made from it
+        response = client.post('/texts/batch/', json=batch)
+        assert response.get_json()['texts'][0] == dict(first,
+                                                        status='duplicate')
+
+        with app.test_request_context():
+            endpoint = flask.url_for('texts.get_text',
+                                     object_id=first['object_id'])
+        assert client.delete(endpoint).status_code == 202
+
+        response = client.post('/texts/batch/', json={'texts': 'Bob'})
+        assert response.status_code == 400
+
     def test_patch_then_replace_text(app, client):
         with open(os.path.join(os.path.dirname(__file__), 'bob.txt'),
                   'r',
@@ -235,7 +662,7 @@ if os.environ.get('ADMIN_INSTANCE') == 'true':
                 assert k in before and before[k] == v
 
         response = client.delete(endpoint)
-        assert response.status_code == 204
+        assert response.status_code == 202
         response = client.get(endpoint)
         assert response.status_code == 404
 
@@ -268,7 +695,7 @@ if os.environ.get('ADMIN_INSTANCE') == 'true':
             endpoint = flask.url_for('texts.get_text',
                                      object_id=data['object_id'])
         response = client.delete(endpoint)
-        assert response.status_code == 204
+        assert response.status_code == 202
         response = client.get(endpoint)
         assert response.status_code == 404
 
@@ -303,4 +730,32 @@ if os.environ.get('ADMIN_INSTANCE') == 'true':
         assert 'object_id' in data and data['object_id'] == nonexistent
         assert 'message' in data
 
+    def test_reclaim_abandoned_deletion(app):
+        # a database of its own, so that no other deletion can be claimed
+        db = TessMongoConnection(app.config['MONGO_HOSTNAME'],
+                                 app.config['MONGO_PORT'],
+                                 app.config['MONGO_USER'],
+                                 app.config['MONGO_PASSWORD'],
+                                 db='test_apitess_deletions')
+        deletions = db.connection[DELETIONS_COLLECTION]
+        now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        # both claimed by a worker; only the first has stopped renewing
+        abandoned_id, _ = deletions.insert_many([{
+            'text_id': ObjectId(),
+            'status': TextStatus.RUN,
+            'claimed': now - datetime.timedelta(minutes=10),
+        }, {
+            'text_id': ObjectId(),
+            'status': TextStatus.RUN,
+            'claimed': now,
+        }]).inserted_ids
+        try:
+            worker = DeletionWorker(app, db, interval=1, claim_timeout=60)
+            job = worker.claim()
+            assert job['_id'] == abandoned_id
+            assert job['claimed'] > now - datetime.timedelta(minutes=1)
+            assert worker.claim() is None
+        finally:
+            db.connection.drop_collection(DELETIONS_COLLECTION)
+
     # TODO check for 400 errors when object_ids are bad